@@ -1,24 +1,177 @@
 from OpenGL.GL import *
-from typing import Dict
+from OpenGL.GL.EXT import texture_compression_s3tc
+from typing import Dict, Iterable, List, Tuple
 import numpy as np
 import ctypes
 
-from structs import Model, RenderObject, Texture
+from structs import Model, RenderObject, Texture, TextureImage
+from geometry import instance_matrices_to_opengl
+from shaders import ATTRIBUTE_LOCATIONS
 
 
-def create_vbo(shaders: int, name: str, data: np.ndarray):
-    """create a vertex buffer object and set the atrribute pointer,
-    assumes the vao is already bound
+def pack_normals(normals: np.ndarray):
+    """pack unit normals as signed normalized GL_INT_2_10_10_10_REV
 
     Args:
-        shader (int): shader program
-        name (str): attribute name (must match shader)
-        data (np array): data to be stored in the vbo
+        normals (np.ndarray): N x 3 normals in [-1, 1]
+
+    Returns:
+        np.ndarray: N uint32 packed normals (w component is 0)
+    """
+    q = np.round(np.clip(normals, -1.0, 1.0) * 511.0).astype(np.int32) & 0x3FF
+    return (q[:, 0] | (q[:, 1] << 10) | (q[:, 2] << 20)).astype(np.uint32)
+
+
+def pack_positions(vertices: np.ndarray):
+    """pack positions in [-1, 1] as signed normalized shorts,
+    padded to 4 components so the following attributes stay 4 byte aligned
+
+    Args:
+        vertices (np.ndarray): N x 3 positions, models are normalized to [-1, 1] when loaded
+
+    Returns:
+        np.ndarray: N x 4 int16 packed positions (w component is 0)
+    """
+    q = np.zeros((len(vertices), 4), dtype=np.int16)
+    q[:, :3] = np.round(np.clip(vertices, -1.0, 1.0) * 32767.0)
+    return q
+
+
+# compact vertex attribute formats: (attribute name, numpy field, gl size, gl type, normalized)
+# a textured vertex takes 16 instead of 32 bytes
+VERTEX_FORMAT = [
+    ("position", "4i2", 3, GL_SHORT, True),
+    ("normal", "u4", 4, GL_INT_2_10_10_10_REV, True),
+    ("texture_coord", "2f2", 2, GL_HALF_FLOAT, False),
+    ("color", "4u1", 4, GL_UNSIGNED_BYTE, True),
+]
+
+
+# gl index type by index size in bytes, meshes with few vertices use 16 bit indices
+INDEX_TYPES = {2: GL_UNSIGNED_SHORT, 4: GL_UNSIGNED_INT}
+
+
+def model_attributes(model: Model):
+    """names of the vertex attributes a model has, which select its vertex layout
+
+    Args:
+        model (Model): model struct
+
+    Returns:
+        Tuple[str, ...]: attribute names in VERTEX_FORMAT order
+    """
+    values = {
+        "position": model.vertices,
+        "normal": model.normals,
+        "texture_coord": model.texture_coords,
+        "color": model.colors,
+    }
+    return tuple(name for name, *_ in VERTEX_FORMAT if values[name] is not None)
+
+
+def vertex_attribute_values(model: Model, name: str):
+    """convert a vertex attribute of a model to its compact format
+
+    Args:
+        model (Model): model struct
+        name (str): attribute name
+
+    Returns:
+        np.ndarray: converted values or None if the model does not have the attribute
+    """
+    if name == "position":
+        return pack_positions(model.vertices)
+    if name == "normal" and model.normals is not None:
+        return pack_normals(model.normals)
+    if name == "texture_coord" and model.texture_coords is not None:
+        return model.texture_coords.astype(np.float16)
+    if name == "color" and model.colors is not None:
+        return np.round(np.clip(model.colors, 0.0, 1.0) * 255.0).astype(np.uint8)
+    return None
+
+
+def vertex_layout(names: List[str]):
+    """compute the interleaved layout of a set of vertex attributes
+
+    Args:
+        names (List[str]): attribute names
+
+    Returns:
+        Tuple[np.dtype, List[Tuple[str, int, int, bool, int]]]:
+            (structured vertex dtype, attribute layout (name, size, gl type, normalized, offset))
+    """
+    attributes = [a for a in VERTEX_FORMAT if a[0] in names]
+    dtype = np.dtype([(name, field) for name, field, _, _, _ in attributes])
+    layout = [
+        (name, size, gl_type, normalized, dtype.fields[name][1])
+        for name, _, size, gl_type, normalized in attributes
+    ]
+    return dtype, layout
+
+
+def pack_vertices(model: Model, names: List[str] = None):
+    """interleave vertex attributes of a model into a single compact buffer:
+    position as snorm16, normal as GL_INT_2_10_10_10_REV,
+    texture coordinates as half floats, and colors as unorm8
+
+    Args:
+        model (Model): model struct
+        names (List[str], optional): attributes to include, missing ones are zero filled. Defaults to the attributes of the model.
+
+    Returns:
+        Tuple[np.ndarray, List[Tuple[str, int, int, bool, int]]]:
+            (structured vertex array, attribute layout (name, size, gl type, normalized, offset))
+    """
+    values = {name: vertex_attribute_values(model, name) for name, *_ in VERTEX_FORMAT}
+    if names is None:
+        names = [name for name, v in values.items() if v is not None]
+    dtype, layout = vertex_layout(names)
+    data = np.zeros(model.vertices.shape[0], dtype=dtype)
+    for name in dtype.names:
+        if values[name] is not None:
+            data[name] = values[name]
+    return data, layout
+
+
+def set_vertex_attributes(layout: List[Tuple], stride: int, shaders: int = None):
+    """set and enable the attribute pointers of an interleaved layout,
+    assumes the vao and the vertex buffer are already bound
+
+    Args:
+        layout (List[Tuple]): attribute layout returned by pack_vertices
+        stride (int): vertex size in bytes
+        shaders (int, optional): shader program to query locations from, the fixed ATTRIBUTE_LOCATIONS if None. Defaults to None.
+    """
+    for name, size, gl_type, normalized, offset in layout:
+        if shaders is None:
+            location = ATTRIBUTE_LOCATIONS[name]
+        else:
+            location = glGetAttribLocation(shaders, name)
+        if location == -1:
+            continue  # attribute not used by the shaders
+        glVertexAttribPointer(
+            index=location,
+            size=size,
+            type=gl_type,
+            normalized=GL_TRUE if normalized else GL_FALSE,
+            stride=stride,
+            pointer=ctypes.c_void_p(offset),
+        )
+        glEnableVertexAttribArray(location)
+
+
+def create_vbo(shaders: int, model: Model):
+    """create a single interleaved vertex buffer object for all attributes of a model
+    and set the atrribute pointers, assumes the vao is already bound
+
+    Args:
+        shaders (int): shader program
+        model (Model): model struct
 
     Returns:
         int: vbo id
     """
-    location = glGetAttribLocation(shaders, name)
+    data, layout = pack_vertices(model)
     vbo = glGenBuffers(1)
     glBindBuffer(GL_ARRAY_BUFFER, vbo)
     glBufferData(
@@ -27,20 +180,12 @@ def create_vbo(shaders: int, name: str, data: np.ndarray):
         data=data,
         usage=GL_STATIC_DRAW,
     )
-    glVertexAttribPointer(
-        index=location,
-        size=data.shape[-1],
-        type=GL_FLOAT,
-        normalized=GL_FALSE,
-        stride=0,
-        pointer=ctypes.c_void_p(0),
-    )
-    glEnableVertexAttribArray(location)
+    set_vertex_attributes(layout, data.itemsize, shaders)
     return vbo
 
 
 def create_vao(model: Model, shaders: int):
-    """create a vao and bind the vbos for a given model
+    """create a vao and bind the vbo for a given model
 
     Args:
         model (Model): model struct
@@ -51,14 +196,7 @@ def create_vao(model: Model, shaders: int):
     """
     vao = glGenVertexArrays(1)
     glBindVertexArray(vao)
-    vbos = []
-    vbos.append(create_vbo(shaders, "position", model.vertices))
-    if model.normals is not None:
-        vbos.append(create_vbo(shaders, "normal", model.normals))
-    if model.texture_coords is not None:
-        vbos.append(create_vbo(shaders, "texture_coord", model.texture_coords))
-    if model.colors is not None:
-        vbos.append(create_vbo(shaders, "color", model.colors))
+    vbos = [create_vbo(shaders, model)]
     if model.faces is not None:
         index_buffer = glGenBuffers(1)
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, index_buffer)
@@ -72,11 +210,520 @@ def create_vao(model: Model, shaders: int):
     return vao, vbos
 
 
-def create_2d_texture(img: np.ndarray, unit: int):
-    """create a static 2d texture
+class RangeAllocator:
+    """first fit allocator of [offset, offset + size) ranges,
+    freed ranges are merged with their neighbours
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.free_ranges = [(0, capacity)]  # sorted (offset, size)
+
+    def allocate(self, size: int, alignment: int = 1):
+        """reserve a range
+
+        Args:
+            size (int): range size
+            alignment (int, optional): the offset is a multiple of this. Defaults to 1.
+
+        Returns:
+            int: range offset or None if there is no free range large enough
+        """
+        for i, (offset, free_size) in enumerate(self.free_ranges):
+            padding = -offset % alignment
+            if free_size >= size + padding:
+                rest = (offset + padding + size, free_size - padding - size)
+                # the padding in front of the range stays free
+                ranges = [(offset, padding), rest]
+                self.free_ranges[i : i + 1] = [r for r in ranges if r[1] > 0]
+                return offset + padding
+        return None
+
+    def release(self, offset: int, size: int):
+        """give a range back to the allocator
+
+        Args:
+            offset (int): range offset
+            size (int): range size
+        """
+        self.free_ranges.append((offset, size))
+        self.free_ranges.sort()
+        merged = []
+        for offset, size in self.free_ranges:
+            if merged and merged[-1][0] + merged[-1][1] == offset:
+                merged[-1] = (merged[-1][0], merged[-1][1] + size)
+            else:
+                merged.append((offset, size))
+        self.free_ranges = merged
+
+    def grow(self, capacity: int):
+        """extend the managed range, the new space becomes free
+
+        Args:
+            capacity (int): new capacity, must not be smaller than the current one
+        """
+        self.release(self.capacity, capacity - self.capacity)
+        self.capacity = capacity
+
+
+class VertexPool:
+    """vertex buffer of a geometry arena holding the meshes of one vertex layout,
+    together with the vaos reading from it
+    """
+
+    def __init__(self, names: Tuple[str, ...], capacity: int):
+        self.names = names
+        self.data_format, self.layout = vertex_layout(names)
+        self.stride = self.data_format.itemsize
+        self.vertices = RangeAllocator(capacity)
+        self.vbo = create_arena_buffer(capacity * self.stride)
+        self.vaos = []
+        self.vao = None  # default vao, set by the arena
+
+
+def create_arena_buffer(size: int):
+    """create an uninitialized static buffer without touching any vao
 
     Args:
-        img (np.ndarray): image formatted for open gl
+        size (int): size in bytes
+
+    Returns:
+        int: buffer id
+    """
+    # the element buffer binding is vao state, use a copy target instead
+    buffer = glGenBuffers(1)
+    glBindBuffer(GL_COPY_WRITE_BUFFER, buffer)
+    glBufferData(
+        target=GL_COPY_WRITE_BUFFER, size=size, data=None, usage=GL_STATIC_DRAW
+    )
+    glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+    return buffer
+
+
+class GeometryArena:
+    """one vertex buffer per vertex layout and one shared index buffer for all static meshes,
+    meshes are sub allocated and drawn with a base vertex and first index,
+    so objects with the same layout share a vao and draw without vao switches,
+    meshes only store the attributes they have, the vaos of layouts without
+    an attribute leave its array disabled and the shaders read the constant default,
+    the index buffer holds uint16 and uint32 indices and is managed in 2 byte slots
+    """
+
+    def __init__(self, vertex_capacity: int = 1 << 20, index_capacity: int = 1 << 23):
+        self.vertex_capacity = vertex_capacity  # initial capacity of every layout
+        self.pools: Dict[Tuple[str, ...], VertexPool] = {}
+        self.indices = RangeAllocator(index_capacity)  # 2 byte slots
+        self.ibo = create_arena_buffer(index_capacity * 2)
+
+    def pool(self, names: Iterable[str]):
+        """vertex pool of a layout, created on first use
+
+        Args:
+            names (Iterable[str]): attribute names of the layout
+
+        Returns:
+            VertexPool: vertex pool
+        """
+        names = tuple(name for name, *_ in VERTEX_FORMAT if name in names)
+        if names not in self.pools:
+            pool = VertexPool(names, self.vertex_capacity)
+            self.pools[names] = pool
+            pool.vao = self.create_vao(names)
+        return self.pools[names]
+
+    def vao(self, names: Iterable[str]):
+        """shared vao of a vertex layout
+
+        Args:
+            names (Iterable[str]): attribute names of the layout, see model_attributes
+
+        Returns:
+            int: vao id
+        """
+        return self.pool(names).vao
+
+    def _bind_buffers(self, pool: VertexPool, vao: int):
+        glBindVertexArray(vao)
+        glBindBuffer(GL_ARRAY_BUFFER, pool.vbo)
+        set_vertex_attributes(pool.layout, pool.stride)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ibo)
+        glBindVertexArray(0)
+
+    def create_vao(self, names: Iterable[str]):
+        """create an additional vao reading from the arena buffers of a vertex layout,
+        e.g. to attach per instance attributes
+
+        Args:
+            names (Iterable[str]): attribute names of the layout
+
+        Returns:
+            int: vao id
+        """
+        pool = self.pool(names)
+        vao = glGenVertexArrays(1)
+        self._bind_buffers(pool, vao)
+        pool.vaos.append(vao)
+        return vao
+
+    def delete_vao(self, vao: int):
+        """delete a vao created with create_vao, the shared vaos of the layouts are kept
+
+        Args:
+            vao (int): vao id
+        """
+        for pool in self.pools.values():
+            if vao in pool.vaos and vao != pool.vao:
+                pool.vaos.remove(vao)
+                glDeleteVertexArrays(1, vao)
+
+    def _grow_buffer(self, buffer: int, old_size: int, new_size: int):
+        new_buffer = create_arena_buffer(new_size)
+        glBindBuffer(GL_COPY_READ_BUFFER, buffer)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, new_buffer)
+        glCopyBufferSubData(GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, 0, 0, old_size)
+        glBindBuffer(GL_COPY_READ_BUFFER, 0)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+        glDeleteBuffers(1, buffer)
+        return new_buffer
+
+    def _allocate(
+        self,
+        allocator: RangeAllocator,
+        size: int,
+        element_size: int,
+        alignment=1,
+        pool: VertexPool = None,
+    ):
+        offset = allocator.allocate(size, alignment)
+        if offset is not None:
+            return offset
+        # grow the buffer (at least doubling) and point all affected vaos to the new one
+        old_capacity = allocator.capacity
+        allocator.grow(max(2 * old_capacity, old_capacity + size + alignment))
+        old_size = old_capacity * element_size
+        new_size = allocator.capacity * element_size
+        if pool is not None:
+            pool.vbo = self._grow_buffer(pool.vbo, old_size, new_size)
+            pools = [pool]
+        else:
+            self.ibo = self._grow_buffer(self.ibo, old_size, new_size)
+            pools = self.pools.values()
+        for p in pools:
+            for vao in p.vaos:
+                self._bind_buffers(p, vao)
+        return allocator.allocate(size, alignment)
+
+    def allocate(self, model: Model):
+        """upload the vertices and faces of a model into the arena,
+        in the layout of the attributes the model has
+
+        Args:
+            model (Model): model struct
+
+        Returns:
+            Tuple[int, int]: (base vertex, first index), first index is None without faces
+        """
+        data, _ = pack_vertices(model)
+        return self.allocate_packed(data, model.faces)
+
+    def allocate_packed(self, data: np.ndarray, faces: np.ndarray = None):
+        """upload vertices already packed with pack_vertices,
+        they go to the vertex pool of their layout
+
+        Args:
+            data (np.ndarray): structured vertex array
+            faces (np.ndarray, optional): F x 3 uint16 or uint32 indices relative to the first vertex. Defaults to None.
+
+        Returns:
+            Tuple[int, int]: (base vertex, first index), first index is None without faces,
+                it counts indices of the type of faces like the first index of a draw call
+        """
+        pool = self.pool(data.dtype.names)
+        assert data.dtype == pool.data_format, f"Unsupported vertex format {data.dtype}"
+        base_vertex = self._allocate(
+            pool.vertices, data.shape[0], pool.stride, pool=pool
+        )
+        glBindBuffer(GL_ARRAY_BUFFER, pool.vbo)
+        glBufferSubData(GL_ARRAY_BUFFER, base_vertex * pool.stride, data.nbytes, data)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        first_index = None
+        if faces is not None:
+            faces = np.ascontiguousarray(faces)
+            assert (
+                faces.itemsize in INDEX_TYPES
+            ), f"Unsupported index type {faces.dtype}"
+            slots = faces.itemsize // 2
+            # indices are aligned to their size
+            offset = self._allocate(self.indices, faces.size * slots, 2, slots)
+            glBindBuffer(GL_COPY_WRITE_BUFFER, self.ibo)
+            glBufferSubData(GL_COPY_WRITE_BUFFER, offset * 2, faces.nbytes, faces)
+            glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+            first_index = offset // slots
+        return base_vertex, first_index
+
+    def allocate_lods(self, model: Model):
+        """upload a model and all its levels of detail into the arena
+
+        Args:
+            model (Model): indexed model struct, model.lods may be None
+
+        Returns:
+            np.ndarray: (base vertex, first index, index count) per level, row 0 is the model itself
+        """
+        levels = [model, *(model.lods or [])]
+        names = model_attributes(model)
+        ranges = np.zeros((len(levels), 3), dtype=np.int64)
+        for i, level in enumerate(levels):
+            # all levels are drawn with the vao and index type of the model
+            data, _ = pack_vertices(level, names=names)
+            faces = level.faces.astype(model.faces.dtype, copy=False)
+            base_vertex, first_index = self.allocate_packed(data, faces)
+            ranges[i] = base_vertex, first_index, level.faces.size
+        return ranges
+
+    def free(self, render_object: RenderObject):
+        """give the ranges of a render object back to the arena
+
+        Args:
+            render_object (RenderObject): render object allocated in this arena
+        """
+        model = render_object.model
+        if render_object.chunks is not None:
+            render_object.chunks.evict_all()
+            return
+        names = model_attributes(model)
+        index_size = model.faces.itemsize if model.faces is not None else 4
+        if render_object.lod_ranges is not None:
+            for level, (base_vertex, first_index, count) in zip(
+                [model, *(model.lods or [])], render_object.lod_ranges
+            ):
+                self.release(
+                    names,
+                    int(base_vertex),
+                    level.vertices.shape[0],
+                    int(first_index),
+                    int(count),
+                    index_size,
+                )
+            return
+        self.release(
+            names,
+            render_object.base_vertex,
+            model.vertices.shape[0],
+            render_object.first_index,
+            model.faces.size if model.faces is not None else 0,
+            index_size,
+        )
+
+    def release(
+        self,
+        names: Iterable[str],
+        base_vertex: int,
+        vertex_count: int,
+        first_index: int = None,
+        index_count: int = 0,
+        index_size: int = 4,
+    ):
+        """give vertex and index ranges back to the arena
+
+        Args:
+            names (Iterable[str]): attribute names of the vertex layout
+            base_vertex (int): first vertex of the range
+            vertex_count (int): number of vertices
+            first_index (int, optional): first index of the range, None without faces. Defaults to None.
+            index_count (int, optional): number of indices. Defaults to 0.
+            index_size (int, optional): bytes per index of the range. Defaults to 4.
+        """
+        self.pool(names).vertices.release(base_vertex, vertex_count)
+        if first_index is not None:
+            slots = index_size // 2
+            self.indices.release(first_index * slots, index_count * slots)
+
+    def destroy(self):
+        """free all gl resources of the arena"""
+        for pool in self.pools.values():
+            for vao in pool.vaos:
+                glDeleteVertexArrays(1, vao)
+            glDeleteBuffers(1, pool.vbo)
+        glDeleteBuffers(1, self.ibo)
+
+
+def create_instance_vbo(shaders: int, vao: int, ms: np.ndarray):
+    """create a vertex buffer object holding per instance model and normal matrices
+    and set the instanced attribute pointers of a vao
+
+    Args:
+        shaders (int): shader program (must have instance_model_matrix and instance_normal_matrix attributes)
+        vao (int): vao to attach the instance attributes to
+        ms (np.ndarray): N x 4 x 4 model matrices of the instances
+
+    Returns:
+        int: vbo id
+    """
+    data = instance_matrices_to_opengl(ms)
+    glBindVertexArray(vao)
+    vbo = glGenBuffers(1)
+    glBindBuffer(GL_ARRAY_BUFFER, vbo)
+    glBufferData(
+        target=GL_ARRAY_BUFFER,
+        size=data.nbytes,
+        data=data,
+        usage=GL_DYNAMIC_DRAW,
+    )
+    # matrix attributes occupy one location per column
+    for name, size, offset in [
+        ("instance_model_matrix", 4, 0),
+        ("instance_normal_matrix", 3, 16 * data.itemsize),
+    ]:
+        location = glGetAttribLocation(shaders, name)
+        for column in range(size):
+            glVertexAttribPointer(
+                index=location + column,
+                size=size,
+                type=GL_FLOAT,
+                normalized=GL_FALSE,
+                stride=data.strides[0],
+                pointer=ctypes.c_void_p(offset + column * size * data.itemsize),
+            )
+            glEnableVertexAttribArray(location + column)
+            glVertexAttribDivisor(location + column, 1)  # advance once per instance
+    glBindVertexArray(0)
+    return vbo
+
+
+def update_instance_vbo(vbo: int, ms: np.ndarray):
+    """overwrite the per instance matrices of an instance vbo
+
+    Args:
+        vbo (int): vbo created by create_instance_vbo
+        ms (np.ndarray): N x 4 x 4 model matrices of the instances, N must not change
+    """
+    data = instance_matrices_to_opengl(ms)
+    glBindBuffer(GL_ARRAY_BUFFER, vbo)
+    glBufferSubData(GL_ARRAY_BUFFER, 0, data.nbytes, data)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+
+def create_uniform_buffer(size: int, binding: int):
+    """create a uniform buffer object and attach it to a binding point
+
+    Args:
+        size (int): buffer size in bytes
+        binding (int): uniform buffer binding point
+
+    Returns:
+        int: ubo id
+    """
+    ubo = glGenBuffers(1)
+    glBindBuffer(GL_UNIFORM_BUFFER, ubo)
+    glBufferData(
+        target=GL_UNIFORM_BUFFER,
+        size=size,
+        data=None,
+        usage=GL_DYNAMIC_DRAW,
+    )
+    glBindBuffer(GL_UNIFORM_BUFFER, 0)
+    glBindBufferBase(GL_UNIFORM_BUFFER, binding, ubo)
+    return ubo
+
+
+def update_uniform_buffer(ubo: int, data: np.ndarray):
+    """overwrite the content of a uniform buffer object with a single upload
+
+    Args:
+        ubo (int): ubo id
+        data (np.ndarray): data laid out according to the uniform block
+    """
+    glBindBuffer(GL_UNIFORM_BUFFER, ubo)
+    glBufferSubData(GL_UNIFORM_BUFFER, 0, data.nbytes, data)
+    glBindBuffer(GL_UNIFORM_BUFFER, 0)
+
+
+# order of the cubemap faces, GL_TEXTURE_CUBE_MAP_POSITIVE_X + i is face i
+CUBEMAP_FACES = ["px", "nx", "py", "ny", "pz", "nz"]
+
+# gl internal formats of the block compressed TextureImage formats
+COMPRESSED_TEXTURE_FORMATS = {
+    "bc1": texture_compression_s3tc.GL_COMPRESSED_RGB_S3TC_DXT1_EXT,
+    "bc3": texture_compression_s3tc.GL_COMPRESSED_RGBA_S3TC_DXT5_EXT,
+}
+
+
+def upload_texture_level(
+    target: int, image: TextureImage, level: int, data: np.ndarray = None
+):
+    """upload one mip level of an image to the bound texture
+
+    Args:
+        target (int): texture target, e.g. GL_TEXTURE_2D or a cubemap face
+        image (TextureImage): mip chain
+        level (int): mip level
+        data (np.ndarray, optional): level data, None to read it from the bound pixel unpack buffer. Defaults to None.
+    """
+    width = max(image.width >> level, 1)
+    height = max(image.height >> level, 1)
+    nbytes = image.levels[level].nbytes
+    if data is not None:
+        data = np.ascontiguousarray(data)
+    if image.format == "rgba8":
+        glTexImage2D(
+            target,  # target
+            level,  # level
+            GL_RGBA8,  # internal format
+            width,  # width
+            height,  # height
+            0,  # border
+            GL_RGBA,  # format
+            GL_UNSIGNED_BYTE,  # type
+            data,  # data
+        )
+    else:
+        glCompressedTexImage2D(
+            target,  # target
+            level,  # level
+            COMPRESSED_TEXTURE_FORMATS[image.format],  # internal format
+            width,  # width
+            height,  # height
+            0,  # border
+            nbytes,  # image size
+            data,  # data
+        )
+
+
+def upload_texture_levels(target: int, image: TextureImage):
+    """upload all mip levels of an image to the bound texture
+
+    Args:
+        target (int): texture target, e.g. GL_TEXTURE_2D or a cubemap face
+        image (TextureImage): mip chain
+    """
+    for level, data in enumerate(image.levels):
+        upload_texture_level(target, image, level, data)
+
+
+def set_texture_parameters(texture_type: int, levels: int):
+    """set filtering (and for cubemaps wrapping) of the bound texture
+
+    Args:
+        texture_type (int): GL_TEXTURE_2D or GL_TEXTURE_CUBE_MAP
+        levels (int): number of uploaded mip levels
+    """
+    glTexParameteri(texture_type, GL_TEXTURE_MAX_LEVEL, levels - 1)
+    # interpolate texels for fragments
+    glTexParameteri(texture_type, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+    glTexParameteri(texture_type, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+    if texture_type == GL_TEXTURE_CUBE_MAP:
+        # clamp to edge to only sample from correct cube face
+        glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_R, GL_CLAMP_TO_EDGE)
+
+
+def create_2d_texture(image: TextureImage, unit: int):
+    """create a static mipmapped 2d texture
+
+    Args:
+        image (TextureImage): mip chain, see texture.prepare_texture
         unit (int): open gl texture unit to use
 
     Returns:
@@ -84,67 +731,116 @@ def create_2d_texture(img: np.ndarray, unit: int):
     """
     tex_id = glGenTextures(1)
     glBindTexture(GL_TEXTURE_2D, tex_id)
-
-    glTexImage2D(
-        GL_TEXTURE_2D,  # target
-        0,  # level
-        GL_RGBA,  # internal format
-        img.shape[1],  # width
-        img.shape[0],  # height
-        0,  # border
-        GL_RGBA,  # format
-        GL_UNSIGNED_BYTE,  # type
-        img,  # data
-    )
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)  # this or mipmap
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+    upload_texture_levels(GL_TEXTURE_2D, image)
+    set_texture_parameters(GL_TEXTURE_2D, len(image.levels))
     glBindTexture(GL_TEXTURE_2D, 0)
     return Texture(id=tex_id, type=GL_TEXTURE_2D, unit=unit)
 
 
-def create_cubemap_texture(imgs: Dict[str, np.ndarray], unit: int):
-    """create a static cubemap texture
+def create_cubemap_texture(images: Dict[str, TextureImage], unit: int):
+    """create a static mipmapped cubemap texture
 
     Args:
-        imgs (Dict[str, np array]): dict containing 6 faces already prepared as opengl np arrays
+        images (Dict[str, TextureImage]): dict containing the mip chains of the 6 faces
         unit (int): open gl texture unit to use
 
     Returns:
         Texture: texture struct for the cubemap
     """
+    assert (
+        len({image.format for image in images.values()}) == 1
+    ), "All cubemap faces need the same format"
     tex_id = glGenTextures(1)  # no need for a framebuffer for now
     glBindTexture(GL_TEXTURE_CUBE_MAP, tex_id)
-    for i, name in enumerate(["px", "nx", "py", "ny", "pz", "nz"]):
-        img = imgs[name]
-        glTexImage2D(
-            GL_TEXTURE_CUBE_MAP_POSITIVE_X + i,  # target
-            0,  # level
-            GL_RGBA,  # internal format
-            img.shape[1],  # width
-            img.shape[0],  # height
-            0,  # border
-            GL_RGBA,  # format
-            GL_UNSIGNED_BYTE,  # type
-            img,  # data
-        )
-    # interpolate texels for fragments
-    glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-    glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-    # clamp to edge to only sample from correct cube face
-    glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
-    glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
-    glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_R, GL_CLAMP_TO_EDGE)
+    for i, name in enumerate(CUBEMAP_FACES):
+        upload_texture_levels(GL_TEXTURE_CUBE_MAP_POSITIVE_X + i, images[name])
+    set_texture_parameters(
+        GL_TEXTURE_CUBE_MAP, min(len(image.levels) for image in images.values())
+    )
     glBindTexture(GL_TEXTURE_CUBE_MAP, 0)
     return Texture(id=tex_id, type=GL_TEXTURE_CUBE_MAP, unit=unit)
 
 
+def create_placeholder_texture(texture_type: int, unit: int):
+    """create a 1 x 1 grey texture to be sampled until the real texture is resident
+
+    Args:
+        texture_type (int): GL_TEXTURE_2D or GL_TEXTURE_CUBE_MAP
+        unit (int): open gl texture unit to use
+
+    Returns:
+        Texture: texture struct for the placeholder
+    """
+    image = TextureImage(
+        levels=[np.full((1, 1, 4), [128, 128, 128, 255], dtype=np.uint8)],
+        width=1,
+        height=1,
+        format="rgba8",
+    )
+    tex_id = glGenTextures(1)
+    glBindTexture(texture_type, tex_id)
+    if texture_type == GL_TEXTURE_CUBE_MAP:
+        for i in range(len(CUBEMAP_FACES)):
+            upload_texture_levels(GL_TEXTURE_CUBE_MAP_POSITIVE_X + i, image)
+    else:
+        upload_texture_levels(texture_type, image)
+    set_texture_parameters(texture_type, 1)
+    glBindTexture(texture_type, 0)
+    return Texture(id=tex_id, type=texture_type, unit=unit)
+
+
+def create_framebuffer(size: Tuple[int, int]):
+    """create a framebuffer object with color and depth renderbuffers for offscreen rendering
+
+    Args:
+        size (Tuple[int, int]): framebuffer size (width, height)
+
+    Returns:
+        Tuple[int, List[int]]: (fbo id, list of renderbuffer ids)
+    """
+    fbo = glGenFramebuffers(1)
+    glBindFramebuffer(GL_FRAMEBUFFER, fbo)
+    renderbuffers = []
+    for internal_format, attachment in [
+        (GL_RGBA8, GL_COLOR_ATTACHMENT0),
+        (GL_DEPTH_COMPONENT24, GL_DEPTH_ATTACHMENT),
+    ]:
+        rbo = glGenRenderbuffers(1)
+        glBindRenderbuffer(GL_RENDERBUFFER, rbo)
+        glRenderbufferStorage(GL_RENDERBUFFER, internal_format, size[0], size[1])
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, attachment, GL_RENDERBUFFER, rbo)
+        renderbuffers.append(rbo)
+    glBindRenderbuffer(GL_RENDERBUFFER, 0)
+    status = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+    assert status == GL_FRAMEBUFFER_COMPLETE, f"Framebuffer incomplete: {status}"
+    return fbo, renderbuffers
+
+
+def destroy_framebuffer(fbo: int, renderbuffers: List[int]):
+    """free a framebuffer object and its renderbuffers
+
+    Args:
+        fbo (int): fbo id
+        renderbuffers (List[int]): renderbuffer ids
+    """
+    glBindFramebuffer(GL_FRAMEBUFFER, 0)
+    glDeleteFramebuffers(1, fbo)
+    for rbo in renderbuffers:
+        glDeleteRenderbuffers(1, rbo)
+
+
 def destroy_render_object(render_object: RenderObject):
-    """free all resources associated with a render object
+    """free all resources associated with a render object,
+    geometry in an arena is given back to the arena
 
     Args:
         render_object (RenderObject): the render object to destroy
     """
-    glDeleteVertexArrays(1, render_object.vao)
+    if render_object.arena is not None:
+        render_object.arena.free(render_object)
+        render_object.arena.delete_vao(render_object.vao)
+    else:
+        glDeleteVertexArrays(1, render_object.vao)
     for vbo in render_object.vbos:
         glDeleteBuffers(1, vbo)
     if render_object.textures:
@@ -0,0 +1,313 @@
+import os
+import argparse
+
+PLATFORMS = ["egl", "osmesa"]
+
+# the platform has to be chosen before OpenGL is imported anywhere,
+# worker processes inherit it through the environment
+if __name__ == "__main__":
+    _parser = argparse.ArgumentParser(add_help=False)
+    _parser.add_argument("--platform", choices=PLATFORMS, default="egl")
+    os.environ.setdefault("PYOPENGL_PLATFORM", _parser.parse_known_args()[0].platform)
+
+import ctypes
+import json
+import time
+from dataclasses import fields
+import numpy as np
+from OpenGL.GL import *
+from typing import List, Tuple
+
+from structs import Camera, FrameStats
+from render import prepare_render, render_frame
+from geometry import P
+from alloc import (
+    create_framebuffer,
+    destroy_framebuffer,
+    create_uniform_buffer,
+    destroy_render_object,
+    GeometryArena,
+)
+from shaders import (
+    compile_shaders,
+    ShaderVariants,
+    FRAME_DATA_SIZE,
+    FRAME_DATA_BINDING,
+)
+from main import init_opengl, build_scene
+
+
+def init_egl(size: Tuple[int, int]):
+    """create an offscreen opengl context with egl (pbuffer surface)
+
+    Args:
+        size (Tuple[int, int]): surface size (width, height)
+
+    Returns:
+        Callable[[], None]: function destroying the context
+    """
+    from OpenGL import EGL
+
+    display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+    major, minor = EGL.EGLint(), EGL.EGLint()
+    assert EGL.eglInitialize(display, ctypes.pointer(major), ctypes.pointer(minor))
+    config_attribs = [
+        EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+        EGL.EGL_RED_SIZE, 8,
+        EGL.EGL_GREEN_SIZE, 8,
+        EGL.EGL_BLUE_SIZE, 8,
+        EGL.EGL_DEPTH_SIZE, 24,
+        EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+        EGL.EGL_NONE,
+    ]  # fmt: skip
+    config = EGL.EGLConfig()
+    num_configs = EGL.EGLint()
+    assert EGL.eglChooseConfig(
+        display,
+        (EGL.EGLint * len(config_attribs))(*config_attribs),
+        ctypes.pointer(config),
+        1,
+        ctypes.pointer(num_configs),
+    )
+    assert num_configs.value > 0, "No suitable egl config found"
+    pbuffer_attribs = [EGL.EGL_WIDTH, size[0], EGL.EGL_HEIGHT, size[1], EGL.EGL_NONE]
+    surface = EGL.eglCreatePbufferSurface(
+        display, config, (EGL.EGLint * len(pbuffer_attribs))(*pbuffer_attribs)
+    )
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, None)
+    assert EGL.eglMakeCurrent(display, surface, surface, context)
+
+    def destroy():
+        EGL.eglMakeCurrent(
+            display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT
+        )
+        EGL.eglDestroyContext(display, context)
+        EGL.eglDestroySurface(display, surface)
+        EGL.eglTerminate(display)
+
+    return destroy
+
+
+def init_osmesa(size: Tuple[int, int]):
+    """create an offscreen opengl context with osmesa (software rasterizer)
+
+    Args:
+        size (Tuple[int, int]): buffer size (width, height)
+
+    Returns:
+        Callable[[], None]: function destroying the context
+    """
+    from OpenGL import osmesa, arrays
+
+    context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0, None)
+    assert context, "Could not create osmesa context"
+    buffer = arrays.GLubyteArray.zeros((size[1], size[0], 4))
+    assert osmesa.OSMesaMakeCurrent(context, buffer, GL_UNSIGNED_BYTE, *size)
+
+    def destroy():
+        osmesa.OSMesaDestroyContext(context)
+
+    return destroy
+
+
+def camera_path(frame: int, frames: int):
+    """scripted camera orbiting the scene once over the timed frames
+
+    Args:
+        frame (int): index of the timed frame, wraps around outside [0, frames)
+        frames (int): number of timed frames
+
+    Returns:
+        Camera: camera struct for the frame
+    """
+    t = (frame % frames) / frames
+    return Camera(
+        center=np.array([0.0, 1.0, 0.0], dtype=np.float32),
+        psi=0.3 + 0.2 * np.sin(4 * np.pi * t),
+        phi=2 * np.pi * t,
+        distance=3.0 + 3.0 * (1 - np.cos(2 * np.pi * t)),
+    )
+
+
+def summarize(times: List[float]):
+    """summarize a list of durations in seconds
+
+    Args:
+        times (List[float]): durations in seconds
+
+    Returns:
+        Dict[str, float]: min, median and p99 in milliseconds
+    """
+    ms = np.asarray(times) * 1000.0
+    return {
+        "min": float(ms.min()),
+        "median": float(np.median(ms)),
+        "p99": float(np.percentile(ms, 99)),
+    }
+
+
+def run_benchmark(
+    size: Tuple[int, int],
+    frames: int,
+    warmup: int,
+    indirect: bool = False,
+    depth_prepass: bool = False,
+    occlusion_culling: bool = False,
+):
+    """render the scene along the camera path into an fbo and time every frame,
+    cpu time covers the python side of render_frame, gl time is measured with timer queries
+
+    Args:
+        size (Tuple[int, int]): framebuffer size (width, height)
+        frames (int): number of timed frames
+        warmup (int): number of untimed frames rendered first
+        indirect (bool, optional): submit normal objects with multi draw indirect. Defaults to False.
+        depth_prepass (bool, optional): render a depth pre-pass before shading. Defaults to False.
+        occlusion_culling (bool, optional): skip objects occluded by others. Defaults to False.
+
+    Returns:
+        dict: benchmark results
+    """
+    init_opengl(size)
+    fbo, renderbuffers = create_framebuffer(size)
+
+    if indirect:
+        object_shaders = ShaderVariants(
+            "object", vertex_shader="indirect_vertex_shader.glsl"
+        )
+    else:
+        object_shaders = ShaderVariants("object")
+    instanced_object_shaders = ShaderVariants(
+        "object", vertex_shader="instanced_vertex_shader.glsl"
+    )
+    skybox_shaders = compile_shaders("cubemap")
+    frame_ubo = create_uniform_buffer(FRAME_DATA_SIZE, FRAME_DATA_BINDING)
+    arena = GeometryArena()
+    objects, skybox = build_scene(
+        object_shaders, instanced_object_shaders, skybox_shaders, arena
+    )
+    state = prepare_render(
+        P(size),
+        objects,
+        skybox,
+        frame_ubo,
+        indirect_shaders=object_shaders if indirect else None,
+        depth_prepass=depth_prepass,
+        count_samples=True,
+        occlusion_culling=occlusion_culling,
+    )
+
+    query = glGenQueries(1)
+    frame_times, cpu_times, gl_times = [], [], []
+    totals = FrameStats()
+    for frame in range(warmup + frames):
+        # warm-up frames replay the end of the path, the timed ones cover it once
+        camera = camera_path(frame - warmup, frames)
+        start = time.perf_counter()
+        glBeginQuery(GL_TIME_ELAPSED, query)
+        stats = render_frame(state, camera, animation_active=False)
+        glEndQuery(GL_TIME_ELAPSED)
+        cpu_end = time.perf_counter()
+        glFinish()  # no frame cap, wait for the gpu instead
+        end = time.perf_counter()
+        gl_time = glGetQueryObjectui64v(query, GL_QUERY_RESULT)
+        if frame < warmup:
+            continue
+        frame_times.append(end - start)
+        cpu_times.append(cpu_end - start)
+        gl_times.append(gl_time * 1e-9)
+        for field in fields(FrameStats):
+            setattr(
+                totals,
+                field.name,
+                getattr(totals, field.name) + getattr(stats, field.name),
+            )
+
+    glDeleteQueries(1, query)
+    if state.indirect is not None:
+        state.indirect.destroy()
+    glDeleteQueries(2, state.samples_queries)
+    if state.occlusion is not None:
+        state.occlusion.destroy()
+    for ro in objects + [skybox]:
+        destroy_render_object(ro)
+    glDeleteBuffers(1, frame_ubo)
+    arena.destroy()
+    destroy_framebuffer(fbo, renderbuffers)
+
+    return {
+        "frames": frames,
+        "size": list(size),
+        "renderer": glGetString(GL_RENDERER).decode(),
+        "frame_ms": summarize(frame_times),
+        "cpu_ms": summarize(cpu_times),
+        "gl_ms": summarize(gl_times),
+        **{
+            f"mean_{field.name}": getattr(totals, field.name) / frames
+            for field in fields(FrameStats)
+        },
+        # (before, after) average cache miss ratio of the optimized meshes
+        "acmr": [
+            np.asarray(o.model.acmr).tolist()
+            for o in objects
+            if o.model.acmr is not None
+        ],
+        # shaded fragments per pixel of the object pass
+        "overdraw": totals.shaded_samples / frames / (size[0] * size[1]),
+        "indirect": indirect,
+        "depth_prepass": depth_prepass,
+        "occlusion_culling": occlusion_culling,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="headless frame time benchmark, prints json results"
+    )
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--width", type=int, default=800)
+    parser.add_argument("--height", type=int, default=600)
+    parser.add_argument("--platform", choices=PLATFORMS, default="egl")
+    parser.add_argument(
+        "--indirect", action="store_true", help="use multi draw indirect submission"
+    )
+    parser.add_argument(
+        "--depth-prepass",
+        action="store_true",
+        help="lay down depth first and shade with GL_EQUAL",
+    )
+    parser.add_argument(
+        "--occlusion-culling",
+        action="store_true",
+        help="skip objects whose bounding box was occluded in the previous frames",
+    )
+    parser.add_argument("--output", type=str, default=None, help="json file path")
+    args = parser.parse_args()
+
+    size = (args.width, args.height)
+    init_context = init_osmesa if args.platform == "osmesa" else init_egl
+    destroy_context = init_context(size)
+    try:
+        results = run_benchmark(
+            size,
+            args.frames,
+            args.warmup,
+            args.indirect,
+            args.depth_prepass,
+            args.occlusion_culling,
+        )
+    finally:
+        destroy_context()
+
+    text = json.dumps(results, indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
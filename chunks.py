@@ -0,0 +1,601 @@
+import trimesh
+import numpy as np
+import hashlib
+import shutil
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Tuple
+
+from structs import FrameStats, Model
+from alloc import GeometryArena, pack_vertices, vertex_layout
+from geometry import frustum_cull
+from meshopt import MAX_UINT16_VERTICES, optimize_faces
+
+# content addressed store of spatially chunked meshes, one directory per key
+CHUNK_STORE_DIR = Path(".cache") / "chunks"
+CHUNK_STORE_VERSION = 3  # bump when the chunking changes
+CHUNK_FACES = 1 << 16  # target faces per chunk
+CHUNK_RESIDENCY_BUDGET = 256 << 20  # bytes of chunk geometry kept on the gpu
+CHUNK_UPLOAD_BUDGET = 16 << 20  # bytes of chunk geometry uploaded per frame
+CHUNK_BUILD_BATCH_FACES = 1 << 20  # faces of a binary ply processed at once
+
+# one row per chunk in chunks.npy, vertices and faces are ranges of the .bin files
+CHUNK_DTYPE = np.dtype(
+    [
+        ("bounding_box", "f4", (2, 3)),
+        ("first_vertex", "i8"),
+        ("vertex_count", "i8"),
+        ("first_face", "i8"),
+        ("face_count", "i8"),
+    ]
+)
+# chunked meshes are drawn with a uniform color, so no texture coordinates or colors
+CHUNK_ATTRIBUTES = ("position", "normal")
+VERTEX_DTYPE, _ = vertex_layout(CHUNK_ATTRIBUTES)  # chunks are stored ready to upload
+# chunks are split until their local indices fit
+INDEX_DTYPE = np.dtype(np.uint16)
+# numpy types of the ply scalar types
+PLY_TYPES = {
+    "char": "i1",
+    "int8": "i1",
+    "uchar": "u1",
+    "uint8": "u1",
+    "short": "i2",
+    "int16": "i2",
+    "ushort": "u2",
+    "uint16": "u2",
+    "int": "i4",
+    "int32": "i4",
+    "uint": "u4",
+    "uint32": "u4",
+    "float": "f4",
+    "float32": "f4",
+    "double": "f8",
+    "float64": "f8",
+}
+
+
+def source_digest(path: str):
+    """hash a model file and the buffers next to it without reading them at once
+
+    Args:
+        path (str): path to model file
+
+    Returns:
+        str: hex digest
+    """
+    path = Path(path)
+    h = hashlib.sha256()
+    h.update(repr((CHUNK_STORE_VERSION, VERTEX_DTYPE.descr)).encode())
+    # gltf files reference buffers and images next to them
+    files = sorted(path.parent.rglob("*")) if path.suffix == ".gltf" else [path]
+    for file in files:
+        if file.is_file():
+            h.update(str(file.relative_to(path.parent)).encode())
+            with open(file, "rb") as f:
+                while block := f.read(1 << 24):
+                    h.update(block)
+    return h.hexdigest()
+
+
+def scene_meshes(scene: trimesh.Scene):
+    """iterate the meshes of a scene in world coordinates one at a time,
+    instead of concatenating the whole scene with Scene.to_mesh
+
+    Args:
+        scene (trimesh.Scene): scene
+
+    Yields:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: (vertices, faces, normals)
+    """
+    for node in scene.graph.nodes_geometry:
+        transform, geometry_name = scene.graph[node]
+        mesh = scene.geometry[geometry_name]
+        if not isinstance(mesh, trimesh.Trimesh) or len(mesh.faces) == 0:
+            continue
+        vertices = trimesh.transform_points(mesh.vertices, transform)
+        # normals transform with inv(m)^T, as row vectors n @ inv(m)
+        normals = mesh.vertex_normals @ np.linalg.inv(transform[:3, :3])
+        yield vertices, mesh.faces, normals
+
+
+class PlyColumns:
+    """N x 3 view of three scalar properties of a memory mapped ply element,
+    indexing only reads the selected rows
+    """
+
+    def __init__(self, rows: np.memmap, names: Tuple[str, str, str]):
+        self.rows = rows
+        self.names = names
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        return np.stack([self.rows[name][index] for name in self.names], axis=-1)
+
+
+def open_binary_ply(path: str):
+    """memory map the vertices and triangles of a binary ply file instead of reading them
+
+    Args:
+        path (str): path to model file
+
+    Returns:
+        Tuple[PlyColumns, PlyColumns, np.ndarray]:
+            (positions, normals or None, F x 3 faces) or None if the file is not a binary ply
+            whose elements up to the faces have a fixed size and whose faces are all triangles
+    """
+    if Path(path).suffix.lower() != ".ply":
+        return None
+    elements, encoding = [], None
+    with open(path, "rb") as f:
+        if f.readline().strip() != b"ply":
+            return None
+        while (line := f.readline()) and line.strip() != b"end_header":
+            words = line.decode("ascii", errors="replace").split()
+            if words[:1] == ["format"]:
+                encoding = words[1]
+            elif words[:1] == ["element"]:
+                elements.append((words[1], int(words[2]), []))
+            elif words[:1] == ["property"] and elements:
+                elements[-1][2].append(words[1:])
+        offset = f.tell()
+    byte_order = {"binary_little_endian": "<", "binary_big_endian": ">"}.get(encoding)
+    if byte_order is None:
+        return None
+
+    arrays = {}
+    for name, count, properties in elements:
+        fields = []
+        for words in properties:
+            if words[0] != "list":
+                fields.append((words[1], byte_order + PLY_TYPES[words[0]]))
+            elif name == "face" and len(words) == 4:
+                # triangles only, checked below
+                fields.append((f"{words[3]}_count", byte_order + PLY_TYPES[words[1]]))
+                fields.append((words[3], byte_order + PLY_TYPES[words[2]], (3,)))
+            else:
+                return None  # variable size rows
+        dtype = np.dtype(fields)
+        arrays[name] = (
+            np.memmap(path, dtype, mode="r", offset=offset, shape=(count,))
+            if count > 0
+            else np.zeros(0, dtype=dtype)
+        )
+        offset += count * dtype.itemsize
+        if "vertex" in arrays and "face" in arrays:
+            break
+
+    vertex, face = arrays.get("vertex"), arrays.get("face")
+    if vertex is None or face is None or len(face) == 0:
+        return None
+    index_names = [
+        n for n in ("vertex_indices", "vertex_index") if n in face.dtype.names
+    ]
+    if not {"x", "y", "z"} <= set(vertex.dtype.names) or not index_names:
+        return None
+    counts = face[f"{index_names[0]}_count"]
+    for start in range(0, len(face), CHUNK_BUILD_BATCH_FACES):
+        if (counts[start : start + CHUNK_BUILD_BATCH_FACES] != 3).any():
+            return None  # polygons are left to trimesh
+    normals = None
+    if {"nx", "ny", "nz"} <= set(vertex.dtype.names):
+        normals = PlyColumns(vertex, ("nx", "ny", "nz"))
+    return PlyColumns(vertex, ("x", "y", "z")), normals, face[index_names[0]]
+
+
+def face_cells(
+    vertices, faces: np.ndarray, center: np.ndarray, scale: float, resolution: int
+):
+    """grid cells of faces by their centroid, the grid spans the normalized [-1, 1] cube
+
+    Args:
+        vertices (np.ndarray): N x 3 vertex positions, or PlyColumns
+        faces (np.ndarray): F x 3 vertex indices
+        center (np.ndarray): center of the model
+        scale (float): half the largest extent of the model
+        resolution (int): cells per axis
+
+    Returns:
+        np.ndarray: F cell indices
+    """
+    centroids = vertices[np.asarray(faces).ravel()].reshape(-1, 3, 3).mean(axis=1)
+    cells = np.floor(((centroids - center) / scale + 1.0) / 2.0 * resolution)
+    cells = np.clip(cells.astype(np.int64), 0, resolution - 1)
+    return (cells[:, 0] * resolution + cells[:, 1]) * resolution + cells[:, 2]
+
+
+def split_faces(faces: np.ndarray, face_ids: np.ndarray):
+    """halve a set of faces until every part references few enough vertices for uint16
+
+    Args:
+        faces (np.ndarray): F x 3 vertex indices of the mesh
+        face_ids (np.ndarray): faces of one grid cell
+
+    Returns:
+        List[np.ndarray]: face ids of the parts
+    """
+    if np.unique(faces[face_ids]).size <= MAX_UINT16_VERTICES:
+        return [face_ids]
+    return [
+        part
+        for half in np.array_split(face_ids, 2)
+        for part in split_faces(faces, half)
+    ]
+
+
+class ChunkWriter:
+    """appends chunks to the flat files of a chunk store,
+    vertices are centered and scaled to [-1, 1] like in dataload.mesh_to_model
+    """
+
+    def __init__(self, out_dir: Path, center: np.ndarray, scale: float):
+        self.out_dir = out_dir
+        self.center = center
+        self.scale = scale
+        self.chunks = []
+        self.vertex_count, self.face_count = 0, 0
+        self.vertex_file = open(out_dir / "vertices.bin", "wb")
+        self.face_file = open(out_dir / "faces.bin", "wb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.vertex_file.close()
+        self.face_file.close()
+        if exc_type is None:
+            np.save(
+                self.out_dir / "chunks.npy", np.array(self.chunks, dtype=CHUNK_DTYPE)
+            )
+
+    def write(self, vertices, faces: np.ndarray, normals, face_ids: np.ndarray):
+        """write the faces of one grid cell as one or more chunks,
+        every chunk is reordered for the vertex cache and indexed with uint16
+
+        Args:
+            vertices (np.ndarray): N x 3 vertex positions of the mesh, or PlyColumns
+            faces (np.ndarray): F x 3 vertex indices of the mesh
+            normals (np.ndarray): N x 3 vertex normals of the mesh, or PlyColumns
+            face_ids (np.ndarray): faces of the cell
+        """
+        for part in split_faces(faces, face_ids):
+            used, local_faces = np.unique(faces[part], return_inverse=True)
+            vertex_order, local_faces = optimize_faces(
+                local_faces.reshape(-1, 3), len(used)
+            )
+            used = used[vertex_order]
+            chunk_vertices = ((vertices[used] - self.center) / self.scale).astype(
+                np.float32
+            )
+            chunk_normals = np.asarray(normals[used], dtype=np.float32)
+            chunk_normals /= np.maximum(
+                np.linalg.norm(chunk_normals, axis=1, keepdims=True), 1e-12
+            )
+            data, _ = pack_vertices(
+                Model(
+                    vertices=chunk_vertices,
+                    faces=None,
+                    normals=chunk_normals,
+                    colors=None,
+                    texture_coords=None,
+                    bounding_box=None,
+                    m=None,
+                ),
+                names=CHUNK_ATTRIBUTES,
+            )
+            self.vertex_file.write(data.tobytes())
+            self.face_file.write(local_faces.astype(INDEX_DTYPE).tobytes())
+            self.chunks.append(
+                (
+                    np.stack([chunk_vertices.min(0), chunk_vertices.max(0)]),
+                    self.vertex_count,
+                    len(used),
+                    self.face_count,
+                    len(part),
+                )
+            )
+            self.vertex_count += len(used)
+            self.face_count += len(part)
+
+
+def grid_resolution(face_count: int, chunk_faces: int):
+    """cells per axis of the chunk grid
+
+    Args:
+        face_count (int): faces of the whole model
+        chunk_faces (int): target faces per chunk
+
+    Returns:
+        int: cells per axis
+    """
+    return max(int(np.ceil(np.cbrt(face_count / chunk_faces))), 1)
+
+
+def build_chunk_store_from_ply(
+    ply: Tuple, out_dir: Path, chunk_faces: int = CHUNK_FACES
+):
+    """chunk a memory mapped binary ply in bounded batches of faces,
+    faces are bucketed by grid cell with a counting sort into a scratch file,
+    missing vertex normals are accumulated in another one
+
+    Args:
+        ply (Tuple): (positions, normals or None, faces) returned by open_binary_ply
+        out_dir (Path): directory to write chunks.npy, vertices.bin and faces.bin to
+        chunk_faces (int, optional): target faces per chunk. Defaults to CHUNK_FACES.
+    """
+    vertices, normals, faces = ply
+    batch = CHUNK_BUILD_BATCH_FACES
+    mi = np.full(3, np.inf)
+    ma = np.full(3, -np.inf)
+    for start in range(0, len(vertices), batch):
+        positions = vertices[start : start + batch]
+        mi = np.minimum(mi, positions.min(axis=0))
+        ma = np.maximum(ma, positions.max(axis=0))
+    center = (ma + mi) / 2
+    scale = max(((ma - mi) / 2).max(), np.finfo(np.float32).tiny)
+    resolution = grid_resolution(len(faces), chunk_faces)
+
+    scratch = []
+    try:
+        if normals is None:
+            # area weighted face normals summed per vertex
+            scratch.append(out_dir / "normals.scratch")
+            normals = np.memmap(
+                scratch[-1], np.float32, mode="w+", shape=(len(vertices), 3)
+            )
+            for start in range(0, len(faces), batch):
+                batch_faces = np.asarray(faces[start : start + batch], dtype=np.int64)
+                corners = vertices[batch_faces.ravel()].reshape(-1, 3, 3)
+                face_normals = np.cross(
+                    corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]
+                )
+                for k in range(3):
+                    np.add.at(normals, batch_faces[:, k], face_normals)
+
+        # counting sort of the face ids by cell
+        cell_count = resolution**3
+        counts = np.zeros(cell_count, dtype=np.int64)
+        for start in range(0, len(faces), batch):
+            cells = face_cells(
+                vertices, faces[start : start + batch], center, scale, resolution
+            )
+            counts += np.bincount(cells, minlength=cell_count)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        scratch.append(out_dir / "faces.scratch")
+        sorted_ids = np.memmap(scratch[-1], np.int64, mode="w+", shape=(len(faces),))
+        cursors = offsets[:-1].copy()
+        for start in range(0, len(faces), batch):
+            cells = face_cells(
+                vertices, faces[start : start + batch], center, scale, resolution
+            )
+            order = np.argsort(cells, kind="stable")
+            sorted_cells = cells[order]
+            rank = np.arange(len(cells)) - np.searchsorted(sorted_cells, sorted_cells)
+            sorted_ids[cursors[sorted_cells] + rank] = start + order
+            cursors += np.bincount(cells, minlength=cell_count)
+
+        with ChunkWriter(out_dir, center, scale) as writer:
+            for cell in np.flatnonzero(counts).tolist():
+                face_ids = np.array(sorted_ids[offsets[cell] : offsets[cell + 1]])
+                writer.write(vertices, faces, normals, face_ids)
+    finally:
+        for file in scratch:
+            file.unlink(missing_ok=True)
+
+
+def build_chunk_store(path: str, out_dir: Path, chunk_faces: int = CHUNK_FACES):
+    """split a model into spatial chunks and append them to flat files,
+    binary ply files are memory mapped and processed in bounded batches,
+    other formats are loaded with trimesh and must fit in memory,
+    then only one mesh of the scene is processed at a time
+
+    Args:
+        path (str): path to model file
+        out_dir (Path): directory to write chunks.npy, vertices.bin and faces.bin to
+        chunk_faces (int, optional): target faces per chunk. Defaults to CHUNK_FACES.
+    """
+    ply = open_binary_ply(path)
+    if ply is not None:
+        build_chunk_store_from_ply(ply, out_dir, chunk_faces)
+        return
+
+    scene = trimesh.load(path, force="scene")
+    mi, ma = scene.bounds
+    center = (ma + mi) / 2
+    scale = max(((ma - mi) / 2).max(), np.finfo(np.float32).tiny)
+    total_faces = sum(
+        len(g.faces) for g in scene.geometry.values() if hasattr(g, "faces")
+    )
+    resolution = grid_resolution(total_faces, chunk_faces)
+
+    with ChunkWriter(out_dir, center, scale) as writer:
+        for vertices, faces, normals in scene_meshes(scene):
+            cells = face_cells(vertices, faces, center, scale, resolution)
+            order = np.argsort(cells, kind="stable")
+            splits = np.flatnonzero(np.diff(cells[order])) + 1
+            for face_ids in np.split(order, splits):
+                writer.write(vertices, faces, normals, face_ids)
+
+
+class ChunkStore:
+    """memory mapped chunk store written by build_chunk_store"""
+
+    def __init__(self, directory: Path):
+        self.chunks = np.load(directory / "chunks.npy")
+        self.vertices = np.memmap(directory / "vertices.bin", VERTEX_DTYPE, mode="r")
+        self.faces = np.memmap(directory / "faces.bin", INDEX_DTYPE, mode="r")
+        self.faces = self.faces.reshape(-1, 3)
+        bounding_boxes = self.chunks["bounding_box"]
+        self.bounding_box = np.stack(
+            [bounding_boxes[:, 0].min(axis=0), bounding_boxes[:, 1].max(axis=0)]
+        )
+        # gpu memory of each chunk
+        self.sizes = (
+            self.chunks["vertex_count"] * VERTEX_DTYPE.itemsize
+            + self.chunks["face_count"] * 3 * INDEX_DTYPE.itemsize
+        )
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def chunk(self, index: int):
+        """read a chunk, only its pages of the store files are touched
+
+        Args:
+            index (int): chunk index
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (packed vertices, F x 3 local faces)
+        """
+        c = self.chunks[index]
+        vertices = self.vertices[
+            c["first_vertex"] : c["first_vertex"] + c["vertex_count"]
+        ]
+        faces = self.faces[c["first_face"] : c["first_face"] + c["face_count"]]
+        return np.ascontiguousarray(vertices), np.ascontiguousarray(faces)
+
+
+def load_chunk_store(path: str, chunk_faces: int = CHUNK_FACES):
+    """open the chunk store of a model file, building it on the first call
+
+    Args:
+        path (str): path to model file
+        chunk_faces (int, optional): target faces per chunk. Defaults to CHUNK_FACES.
+
+    Returns:
+        ChunkStore: memory mapped chunks
+    """
+    h = hashlib.sha256()
+    h.update(repr((source_digest(path), chunk_faces)).encode())
+    key = h.hexdigest()
+    directory = CHUNK_STORE_DIR / key
+    if not directory.is_dir():
+        # write to a temporary directory first so readers never see partial entries
+        tmp_dir = CHUNK_STORE_DIR / f"{key}.{uuid.uuid4().hex}.tmp"
+        tmp_dir.mkdir(parents=True)
+        try:
+            build_chunk_store(path, tmp_dir, chunk_faces)
+        except BaseException:
+            shutil.rmtree(tmp_dir)  # no partial entry left behind
+            raise
+        try:
+            tmp_dir.rename(directory)
+        except OSError:
+            shutil.rmtree(tmp_dir)  # written concurrently by someone else
+    return ChunkStore(directory)
+
+
+class ChunkResidency:
+    """keeps the visible chunks of a chunk store in a geometry arena,
+    nearest chunks are uploaded first within a per frame upload budget,
+    when the residency budget is exceeded the least recently visible chunks are evicted
+    """
+
+    def __init__(
+        self,
+        store: ChunkStore,
+        arena: GeometryArena,
+        budget: int = CHUNK_RESIDENCY_BUDGET,
+        upload_budget: int = CHUNK_UPLOAD_BUDGET,
+    ):
+        self.store = store
+        self.arena = arena
+        self.budget = budget
+        self.upload_budget = upload_budget
+        # chunk index -> (base vertex, first index), least recently visible first
+        self.resident = OrderedDict()
+        self.resident_bytes = 0
+        self.centers = store.chunks["bounding_box"].mean(axis=1)
+
+    def _upload(self, index: int):
+        vertices, faces = self.store.chunk(index)
+        self.resident[index] = self.arena.allocate_packed(vertices, faces)
+        self.resident_bytes += int(self.store.sizes[index])
+
+    def _evict(self, index: int):
+        base_vertex, first_index = self.resident.pop(index)
+        c = self.store.chunks[index]
+        self.arena.release(
+            CHUNK_ATTRIBUTES,
+            base_vertex,
+            int(c["vertex_count"]),
+            first_index,
+            int(c["face_count"]) * 3,
+            INDEX_DTYPE.itemsize,
+        )
+        self.resident_bytes -= int(self.store.sizes[index])
+
+    def update(
+        self,
+        pvm: np.ndarray,
+        m: np.ndarray,
+        camera_pos: np.ndarray,
+        stats: FrameStats = None,
+    ):
+        """cull the chunks, stream in missing visible ones and evict stale ones
+
+        Args:
+            pvm (np.ndarray): projection @ view @ model matrix of the object
+            m (np.ndarray): model matrix of the object
+            camera_pos (np.ndarray): camera position in world coordinates
+            stats (FrameStats, optional): frame stats counting resident chunks and uploaded bytes. Defaults to None.
+
+        Returns:
+            np.ndarray: (base vertex, first index, index count) of the visible resident chunks
+        """
+        n = len(self.store)
+        visible = frustum_cull(
+            np.broadcast_to(pvm.astype(np.float32), (n, 4, 4)),
+            self.store.chunks["bounding_box"],
+        )
+        centers = self.centers @ m[:3, :3].T + m[:3, 3]
+        distances = np.linalg.norm(centers - camera_pos, axis=1)
+        wanted = np.flatnonzero(visible)
+        wanted = wanted[np.argsort(distances[wanted], kind="stable")]
+        wanted_set = set(wanted.tolist())
+
+        # visible chunks become most recently used, the nearest last
+        for index in wanted[::-1].tolist():
+            if index in self.resident:
+                self.resident.move_to_end(index)
+
+        uploaded = 0
+        for index in wanted.tolist():
+            if index in self.resident:
+                continue
+            size = int(self.store.sizes[index])
+            if size > self.budget:
+                continue  # never fits
+            if uploaded > 0 and uploaded + size > self.upload_budget:
+                break
+            # make room by evicting chunks that are not visible, oldest first
+            while self.resident_bytes + size > self.budget:
+                oldest = next(iter(self.resident))
+                if oldest in wanted_set:
+                    break
+                self._evict(oldest)
+            if self.resident_bytes + size > self.budget:
+                break  # the budget is full of nearer visible chunks
+            self._upload(index)
+            uploaded += size
+
+        ranges = np.array(
+            [
+                (*self.resident[index], int(self.store.chunks[index]["face_count"]) * 3)
+                for index in wanted.tolist()
+                if index in self.resident
+            ],
+            dtype=np.int64,
+        ).reshape(-1, 3)
+        if stats is not None:
+            stats.chunks_resident += len(self.resident)
+            stats.chunk_bytes_uploaded += uploaded
+        return ranges
+
+    def evict_all(self):
+        """give all resident chunks back to the arena"""
+        for index in list(self.resident):
+            self._evict(index)
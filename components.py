@@ -1,25 +1,30 @@
+import dataclasses
 from pathlib import Path
-from PIL import Image
 import numpy as np
+from typing import List
 from OpenGL.GL import *
-import copy
 
-from dataload import load_model, SceneRemoveGraphNodes, Model, pillow_to_opengl_rgba
-from alloc import create_vao, create_2d_texture, create_cubemap_texture
-from structs import RenderObject, Uniform
+from dataload import load_model, Model
+from scene import load_scene, walk_scene
+from texture import load_cubemap, prepare_texture
+from alloc import (
+    GeometryArena,
+    create_instance_vbo,
+    create_2d_texture,
+    create_cubemap_texture,
+    model_attributes,
+    CUBEMAP_FACES,
+)
+from structs import RenderObject, Uniform, SceneGraph, Texture
+from lod import LOD_FACE_RATIOS
+from streaming import TextureStreamer
+from shaders import ShaderVariants
+from chunks import CHUNK_ATTRIBUTES, ChunkResidency, load_chunk_store
 from geometry import (
     pose,
     translation,
     rotation_y,
 )
-from light import (
-    AMBIENT_STRENGTH,
-    AMBIENT_COLOR,
-    DIFFUSE_POS,
-    DIFFUSE_COLOR,
-    SPECULAR_STRENGTH,
-    SPECULAR_SHININESS,
-)
 
 
 CUBEMAP_VERTICES = np.array(
@@ -65,39 +70,6 @@ CUBEMAP_VERTICES = np.array(
 )
 
 
-def light_uniforms():
-    """construct a list of static uniforms for lighting computations
-
-    Returns:
-        List[Uniform]: uniforms for lighting computations
-    """
-    ambient_strength = Uniform(
-        name="ambient_light_strength", value=AMBIENT_STRENGTH, type="float"
-    )
-    ambient_color = Uniform(
-        name="ambient_light_color", value=AMBIENT_COLOR, type="vec3"
-    )
-    diffuse_pos = Uniform(name="diffuse_light_position", value=DIFFUSE_POS, type="vec3")
-    diffuse_color = Uniform(
-        name="diffuse_light_color", value=DIFFUSE_COLOR, type="vec3"
-    )
-    specular_strength = Uniform(
-        name="specular_light_strength", value=SPECULAR_STRENGTH, type="float"
-    )
-    specular_shininess = Uniform(
-        name="specular_light_shininess", value=SPECULAR_SHININESS, type="float"
-    )
-    # camera position, model matrix, normal matrix uniforms are computed and set in render loop
-    return [
-        ambient_strength,
-        ambient_color,
-        diffuse_pos,
-        diffuse_color,
-        specular_strength,
-        specular_shininess,
-    ]
-
-
 def rotation_animation(model: Model):
     """rotate a given model around the y-axis by 0.1 radians
 
@@ -112,105 +84,247 @@ def rotation_animation(model: Model):
     return model
 
 
-def olympic_rings(shaders: int):
-    """construct a render object for the olympic rings model
-
-    Args:
-        shaders (int): shader program
+def olympic_rings_assets():
+    """load the olympic rings scene graph and its textures,
+    cpu only so it can run in a worker process
 
     Returns:
-        RenderObject: olympic rings render object
+        Tuple[SceneGraph, List[TextureImage]]: (scene graph, texture mip chains)
     """
-    model, texture_img = load_model(
+    graph = load_scene(
         "models/olympic_rings.glb",
         m=pose(),
         texture="base_color",
-        scene_transforms=[SceneRemoveGraphNodes(["Object_23", "Grass"])],
-    )
-    height = model.bounding_box[1, 1] - model.bounding_box[0, 1]
-    model.m = translation([0.0, 0.5 * height, -4.0]) @ model.m
-    texture = create_2d_texture(texture_img, GL_TEXTURE0)
-    vao, vbos = create_vao(model, shaders)
-    texture_sampler = Uniform(
-        name="texture_sampler", value=texture.unit - GL_TEXTURE0, type="int"
-    )
-    reflection_strength = Uniform(name="reflection_strength", value=0.0, type="float")
-    use_vertice_colors = Uniform(name="use_colors", value=0, type="int")
-    return RenderObject(
-        model=model,
-        vao=vao,
-        vbos=vbos,
-        shaders=shaders,
-        textures=[texture],
-        static_uniforms=[
-            texture_sampler,
-            reflection_strength,
-            use_vertice_colors,
-            *light_uniforms(),
-        ],
-        animation_function=None,
+        exclude_nodes=["Object_23", "Grass"],
     )
+    height = graph.bounding_box[1, 1] - graph.bounding_box[0, 1]
+    graph.m = translation([0.0, 0.5 * height, -4.0]) @ graph.m
+    return graph, [prepare_texture(img) for img in graph.textures]
 
 
-def floor(shaders: int):
-    """create a 5x5 grid of floor tiles centered at the origin,
-    each tile is 2x2, so the grid is 10x10
+def olympic_rings(
+    shaders: ShaderVariants,
+    instanced_shaders: ShaderVariants,
+    arena: GeometryArena,
+    assets=None,
+    streamer: TextureStreamer = None,
+):
+    """construct the render objects for the olympic rings scene
 
     Args:
-        shaders (int): shader program
+        shaders (ShaderVariants): object shader variants
+        instanced_shaders (ShaderVariants): instanced object shader variants, used for meshes shared by several nodes
+        arena (GeometryArena): arena to allocate the geometry in
+        assets (Tuple[SceneGraph, List[TextureImage]], optional): result of olympic_rings_assets, loaded here if None. Defaults to None.
+        streamer (TextureStreamer, optional): uploads the textures in the background, synchronous upload if None. Defaults to None.
 
     Returns:
-        List[RenderObject]: list of floor tile render objects
+        List[RenderObject]: one render object per mesh of the scene
+    """
+    if assets is None:
+        assets = olympic_rings_assets()
+    graph, texture_imgs = assets
+    if streamer is not None:
+        textures = [
+            streamer.upload(GL_TEXTURE_2D, GL_TEXTURE0, img) for img in texture_imgs
+        ]
+    else:
+        textures = [create_2d_texture(img, GL_TEXTURE0) for img in texture_imgs]
+    return scene_render_objects(graph, textures, shaders, instanced_shaders, arena)
+
+
+def scene_render_objects(
+    graph: SceneGraph,
+    textures: List[Texture],
+    shaders: ShaderVariants,
+    instanced_shaders: ShaderVariants,
+    arena: GeometryArena,
+):
+    """create one render object per mesh of a scene graph,
+    meshes referenced by a single node are drawn normally so they can be culled individually,
+    meshes referenced by several nodes are drawn once instanced
+
+    Args:
+        graph (SceneGraph): scene graph
+        textures (List[Texture]): uploaded graph.textures
+        shaders (ShaderVariants): object shader variants
+        instanced_shaders (ShaderVariants): instanced object shader variants
+        arena (GeometryArena): arena to allocate the geometry in
+
+    Returns:
+        List[RenderObject]: render objects
+    """
+    transforms = {}
+    for node, transform in walk_scene(graph.root):
+        if node.mesh is not None:
+            # from the normalized mesh to scene coordinates
+            transforms.setdefault(node.mesh, []).append(
+                transform @ graph.meshes[node.mesh].m
+            )
+
+    objects = []
+    for mesh, mesh_transforms in transforms.items():
+        model = graph.meshes[mesh]
+        texture = graph.mesh_textures[mesh]
+        if texture is not None:
+            features = ["USE_TEXTURE"]
+            static_uniforms = [
+                Uniform(
+                    name="texture_sampler",
+                    value=textures[texture].unit - GL_TEXTURE0,
+                    type="int",
+                ),
+            ]
+        else:
+            features = []
+            static_uniforms = [
+                Uniform(
+                    name="uniform_color",
+                    value=model.uniform_color.tolist(),
+                    type="vec4",
+                ),
+            ]
+        base_vertex, first_index = arena.allocate(model)
+        ro = RenderObject(
+            model=dataclasses.replace(model, m=graph.m @ mesh_transforms[0]),
+            vao=arena.vao(model_attributes(model)),
+            vbos=[],
+            shaders=shaders.get(*features),
+            textures=[] if texture is None else [textures[texture]],
+            static_uniforms=static_uniforms,
+            animation_function=None,
+            arena=arena,
+            base_vertex=base_vertex,
+            first_index=first_index,
+        )
+        if len(mesh_transforms) > 1:
+            instances = np.stack(mesh_transforms)
+            ro.model.m = graph.m
+            # own vao for the instance attributes
+            ro.vao = arena.create_vao(model_attributes(model))
+            ro.shaders = instanced_shaders.get(*features)
+            ro.instances = instances
+            ro.instance_vbo = create_instance_vbo(
+                ro.shaders, ro.vao, graph.m @ instances
+            )
+            ro.vbos = [ro.instance_vbo]
+        objects.append(ro)
+    return objects
+
+
+def floor_assets():
+    """load the floor tile model and texture,
+    cpu only so it can run in a worker process
+
+    Returns:
+        Tuple[Model, TextureImage]: (model struct, texture mip chain)
     """
     model, texture_img = load_model(
         "models/floor_material.glb",
         m=pose(position=[0.0, 0.0, 0.0]),
         texture="base_color",
     )
+    return model, prepare_texture(texture_img)
+
+
+def floor(
+    shaders: ShaderVariants,
+    arena: GeometryArena,
+    tiles_per_side: int = 5,
+    assets=None,
+    streamer: TextureStreamer = None,
+):
+    """create an instanced grid of floor tiles centered at the origin,
+    each tile is 2x2, so the default 5x5 grid is 10x10
+
+    Args:
+        shaders (ShaderVariants): instanced object shader variants
+        arena (GeometryArena): arena to allocate the geometry in
+        tiles_per_side (int, optional): number of tiles along x and z. Defaults to 5.
+        assets (Tuple[Model, TextureImage], optional): result of floor_assets, loaded here if None. Defaults to None.
+        streamer (TextureStreamer, optional): uploads the texture in the background, synchronous upload if None. Defaults to None.
+
+    Returns:
+        RenderObject: floor render object with one instance per tile
+    """
+    if assets is None:
+        assets = floor_assets()
+    model, texture_img = assets
 
     size_x = model.bounding_box[0, 0] - model.bounding_box[1, 0]
     size_z = model.bounding_box[0, 2] - model.bounding_box[1, 2]
-    model_copies = []
-    for x in range(5):
-        for z in range(5):
-            c = copy.deepcopy(model)
-            c.m = pose(position=[x * size_x, 0.0, z * size_z])
-            model_copies.append(c)
-
-    for c in model_copies:
-        c.m = translation([-2 * size_x, 0.0, -2 * size_z]) @ c.m
-
-    texture = create_2d_texture(texture_img, GL_TEXTURE0)
-    vao, vbos = create_vao(model, shaders)
+    offset = (tiles_per_side - 1) / 2
+    instances = np.stack(
+        [
+            pose(position=[(x - offset) * size_x, 0.0, (z - offset) * size_z])
+            for x in range(tiles_per_side)
+            for z in range(tiles_per_side)
+        ]
+    )
+
+    if streamer is not None:
+        texture = streamer.upload(GL_TEXTURE_2D, GL_TEXTURE0, texture_img)
+    else:
+        texture = create_2d_texture(texture_img, GL_TEXTURE0)
+    program = shaders.get("USE_TEXTURE")
+    base_vertex, first_index = arena.allocate(model)
+    # own vao for the instance attributes
+    vao = arena.create_vao(model_attributes(model))
+    instance_vbo = create_instance_vbo(program, vao, model.m @ instances)
     texture_sampler_uniform = Uniform(
         name="texture_sampler", value=texture.unit - GL_TEXTURE0, type="int"
     )
-    reflection_strength = Uniform(name="reflection_strength", value=0.0, type="float")
-    use_vertice_colors = Uniform(name="use_colors", value=0, type="int")
-    return [
-        RenderObject(
-            model=m,
-            vao=vao,
-            vbos=vbos,
-            shaders=shaders,
-            textures=[texture],
-            static_uniforms=[
-                texture_sampler_uniform,
-                reflection_strength,
-                use_vertice_colors,
-                *light_uniforms(),
-            ],
-            animation_function=None,
-        )
-        for m in model_copies
-    ]
+    return RenderObject(
+        model=model,
+        vao=vao,
+        vbos=[instance_vbo],
+        shaders=program,
+        textures=[texture],
+        static_uniforms=[texture_sampler_uniform],
+        animation_function=None,
+        instances=instances,
+        instance_vbo=instance_vbo,
+        arena=arena,
+        base_vertex=base_vertex,
+        first_index=first_index,
+    )
 
 
-def sky_box(shaders: int):
+def sky_box_assets():
+    """decode the six cubemap faces of the skybox,
+    cpu only so it can run in a worker process
+
+    Returns:
+        Dict[str, TextureImage]: mip chains of the cubemap faces
+    """
+    base_dir = Path("textures/paris_cubemap")
+    paths = {name: base_dir / f"{name}.png" for name in CUBEMAP_FACES}
+    # base_dir = Path("textures/night_stars_skybox")
+    # paths = {
+    #     "px": base_dir / "right.png",
+    #     "nx": base_dir / "left.png",
+    #     "py": base_dir / "top.png",
+    #     "ny": base_dir / "bottom.png",
+    #     "pz": base_dir / "front.png",
+    #     "nz": base_dir / "back.png",
+    # }
+    # all faces share one format, otherwise the cubemap is incomplete
+    return load_cubemap(paths, flip=False)
+
+
+def sky_box(
+    shaders: int,
+    arena: GeometryArena,
+    assets=None,
+    streamer: TextureStreamer = None,
+):
     """create a render object for a skybox
 
     Args:
         shaders (int): shader program
+        arena (GeometryArena): arena to allocate the geometry in
+        assets (Dict[str, TextureImage], optional): result of sky_box_assets, loaded here (or on the streamer worker) if None. Defaults to None.
+        streamer (TextureStreamer, optional): decodes and uploads the faces in the background, synchronous if None. Defaults to None.
 
     Returns:
         RenderObject: sky box render object
@@ -224,44 +338,59 @@ def sky_box(shaders: int):
         bounding_box=None,
         m=pose(),
     )
-    base_dir = Path("textures/paris_cubemap")
-    px = pillow_to_opengl_rgba(Image.open(base_dir / "px.png"), flip=False)
-    nx = pillow_to_opengl_rgba(Image.open(base_dir / "nx.png"), flip=False)
-    py = pillow_to_opengl_rgba(Image.open(base_dir / "py.png"), flip=False)
-    ny = pillow_to_opengl_rgba(Image.open(base_dir / "ny.png"), flip=False)
-    pz = pillow_to_opengl_rgba(Image.open(base_dir / "pz.png"), flip=False)
-    nz = pillow_to_opengl_rgba(Image.open(base_dir / "nz.png"), flip=False)
-    # base_dir = Path("textures/night_stars_skybox")
-    # px = pillow_to_opengl_rgba(Image.open(base_dir / "right.png"), flip=False)
-    # nx = pillow_to_opengl_rgba(Image.open(base_dir / "left.png"), flip=False)
-    # py = pillow_to_opengl_rgba(Image.open(base_dir / "top.png"), flip=False)
-    # ny = pillow_to_opengl_rgba(Image.open(base_dir / "bottom.png"), flip=False)
-    # pz = pillow_to_opengl_rgba(Image.open(base_dir / "front.png"), flip=False)
-    # nz = pillow_to_opengl_rgba(Image.open(base_dir / "back.png"), flip=False)
-    texture = create_cubemap_texture(
-        {"nx": nx, "px": px, "ny": ny, "py": py, "nz": nz, "pz": pz}, GL_TEXTURE1
-    )
-    vao, vbos = create_vao(model, shaders)
+    if streamer is not None and assets is None:
+        texture = streamer.load(GL_TEXTURE_CUBE_MAP, GL_TEXTURE1, sky_box_assets)
+    elif streamer is not None:
+        texture = streamer.upload(GL_TEXTURE_CUBE_MAP, GL_TEXTURE1, assets)
+    else:
+        if assets is None:
+            assets = sky_box_assets()
+        texture = create_cubemap_texture(assets, GL_TEXTURE1)
+    base_vertex, first_index = arena.allocate(model)
     texture_sampler_uniform = Uniform(
         name="skybox_sampler", value=texture.unit - GL_TEXTURE0, type="int"
     )
     return RenderObject(
         model=model,
-        vao=vao,
-        vbos=vbos,
+        vao=arena.vao(model_attributes(model)),
+        vbos=[],
         shaders=shaders,
         textures=[texture],
         static_uniforms=[texture_sampler_uniform],
         animation_function=None,
+        arena=arena,
+        base_vertex=base_vertex,
+        first_index=first_index,
+    )
+
+
+def olympic_logo_assets():
+    """load the olympic logo model,
+    cpu only so it can run in a worker process
+
+    Returns:
+        Model: model struct
+    """
+    model, _ = load_model(
+        "models/olympics_paris/scene.gltf",
+        m=pose(position=[1.5, 0.0, 0.0]),
+        lods=LOD_FACE_RATIOS,
     )
+    height = model.bounding_box[1, 1] - model.bounding_box[0, 1]
+    model.m = translation([0.0, 0.5 * height, 0.0]) @ model.m
+    return model
 
 
-def olympic_logo(shaders: int, skybox: RenderObject):
+def olympic_logo(
+    shaders: ShaderVariants, arena: GeometryArena, skybox: RenderObject, assets=None
+):
     """create a render object for the olympic logo model
 
     Args:
-        shaders (int): shader program
+        shaders (ShaderVariants): object shader variants
+        arena (GeometryArena): arena to allocate the geometry in
         skybox (RenderObject): skybox render object to be used for reflections
+        assets (Model, optional): result of olympic_logo_assets, loaded here if None. Defaults to None.
 
     Returns:
         RenderObject: olympic logo render object
@@ -274,39 +403,37 @@ def olympic_logo(shaders: int, skybox: RenderObject):
     ), "skybox does not have exactly one static uniform (sampler)"
     assert skybox.textures[0].unit == GL_TEXTURE1, "skybox texture unit is not 1"
 
-    model, _ = load_model(
-        "models/olympics_paris/scene.gltf",
-        m=pose(position=[1.5, 0.0, 0.0]),
-    )
-    height = model.bounding_box[1, 1] - model.bounding_box[0, 1]
-    model.m = translation([0.0, 0.5 * height, 0.0]) @ model.m
-    vao, vbos = create_vao(model, shaders)
+    model = assets if assets is not None else olympic_logo_assets()
+    lod_ranges = arena.allocate_lods(model)
+    base_vertex, first_index, _ = lod_ranges[0].tolist()
     reflection_strength = Uniform(name="reflection_strength", value=1.0, type="float")
-    use_vertice_colors = Uniform(name="use_colors", value=0, type="int")
+    # fully reflective, the object color only contributes the alpha
+    uniform_color = Uniform(name="uniform_color", value=[1.0] * 4, type="vec4")
     return RenderObject(
         model=model,
-        vao=vao,
-        vbos=vbos,
-        shaders=shaders,
+        vao=arena.vao(model_attributes(model)),
+        vbos=[],
+        shaders=shaders.get("USE_REFLECTION"),
         textures=skybox.textures,
         static_uniforms=[
             reflection_strength,
-            use_vertice_colors,
-            *light_uniforms(),
+            uniform_color,
             *skybox.static_uniforms,
         ],
         animation_function=rotation_animation,
+        arena=arena,
+        base_vertex=base_vertex,
+        first_index=first_index,
+        lod_ranges=lod_ranges,
     )
 
 
-def human_body(shaders: int):
-    """create a render object for the human body model
-
-    Args:
-        shaders (int): shader program
+def human_body_assets():
+    """load the human body model,
+    cpu only so it can run in a worker process
 
     Returns:
-        RenderObject: render object for the human body model
+        Model: model struct
     """
     scale = 0.5
     model, _ = load_model(
@@ -314,22 +441,87 @@ def human_body(shaders: int):
         m=pose(position=[-1.5, 0.0, 0.0], scale=scale),
         texture="uniform",
         uniform_color=[0.12941176, 0.50196078, 0.74901961],
+        lods=LOD_FACE_RATIOS,
     )
     height = (model.bounding_box[1, 1] - model.bounding_box[0, 1]) * scale
     model.m = translation([0.0, 0.5 * height, 0.0]) @ model.m
-    vao, vbos = create_vao(model, shaders)
-    reflection_strength = Uniform(name="reflection_strength", value=0.0, type="float")
-    use_vertice_colors = Uniform(name="use_colors", value=1, type="int")
+    return model
+
+
+def human_body(shaders: ShaderVariants, arena: GeometryArena, assets=None):
+    """create a render object for the human body model
+
+    Args:
+        shaders (ShaderVariants): object shader variants
+        arena (GeometryArena): arena to allocate the geometry in
+        assets (Model, optional): result of human_body_assets, loaded here if None. Defaults to None.
+
+    Returns:
+        RenderObject: render object for the human body model
+    """
+    model = assets if assets is not None else human_body_assets()
+    lod_ranges = arena.allocate_lods(model)
+    base_vertex, first_index, _ = lod_ranges[0].tolist()
+    uniform_color = Uniform(
+        name="uniform_color", value=model.uniform_color.tolist(), type="vec4"
+    )
     return RenderObject(
         model=model,
-        vao=vao,
-        vbos=vbos,
-        shaders=shaders,
+        vao=arena.vao(model_attributes(model)),
+        vbos=[],
+        shaders=shaders.get(),
         textures=None,
-        static_uniforms=[
-            reflection_strength,
-            use_vertice_colors,
-            *light_uniforms(),
-        ],
+        static_uniforms=[uniform_color],
+        animation_function=None,
+        arena=arena,
+        base_vertex=base_vertex,
+        first_index=first_index,
+        lod_ranges=lod_ranges,
+    )
+
+
+def chunked_mesh(
+    shaders: ShaderVariants,
+    arena: GeometryArena,
+    path: str,
+    m: np.ndarray,
+    color: List[float] = (0.7, 0.7, 0.7),
+):
+    """create a render object for a mesh too large to keep in memory,
+    the mesh is split into a memory mapped chunk store on the first run
+    and the visible chunks are streamed into the arena while rendering
+
+    Args:
+        shaders (ShaderVariants): object shader variants
+        arena (GeometryArena): arena the resident chunks are allocated in
+        path (str): path to model file
+        m (np.ndarray): model matrix
+        color (List[float], optional): uniform object color. Defaults to (0.7, 0.7, 0.7).
+
+    Returns:
+        RenderObject: render object drawing its resident chunks
+    """
+    store = load_chunk_store(path)
+    # geometry lives in the chunk store, the model only carries bounds and transform
+    model = Model(
+        vertices=np.empty((0, 3), dtype=np.float32),
+        faces=np.empty((0, 3), dtype=store.faces.dtype),
+        normals=None,
+        colors=None,
+        texture_coords=None,
+        bounding_box=store.bounding_box,
+        m=m,
+    )
+    uniform_color = Uniform(name="uniform_color", value=[*color, 1.0], type="vec4")
+    return RenderObject(
+        model=model,
+        vao=arena.vao(CHUNK_ATTRIBUTES),
+        vbos=[],
+        shaders=shaders.get(),
+        textures=None,
+        static_uniforms=[uniform_color],
         animation_function=None,
+        arena=arena,
+        chunks=ChunkResidency(store, arena),
+        draw_ranges=np.empty((0, 3), dtype=np.int64),
     )
@@ -1,10 +1,27 @@
 import trimesh
 import numpy as np
+import hashlib
+import shutil
+import tempfile
+import uuid
+from pathlib import Path
 from OpenGL.GL import *
 from PIL import Image
-from typing import Literal, List, Callable
+from typing import Literal, List, Callable, Tuple
 
 from structs import Model
+from lod import build_lods
+from meshopt import optimize_model
+
+# content addressed cache of preprocessed models, one directory of .npy files per key
+MODEL_CACHE_DIR = Path(".cache") / "models"
+MODEL_CACHE_VERSION = 5  # bump when the preprocessing changes
+# rows converted per step of the fused loader pass, bounds the size of temporaries
+LOADER_CHUNK_ROWS = 1 << 16
+# meshes with more vertices are converted straight into memory mapped cache files
+MMAP_OUTPUT_MIN_VERTICES = 1 << 20
+# memory mapped files of large meshes loaded without the cache, on disk unlike /tmp
+MODEL_SCRATCH_DIR = Path(".cache") / "scratch"
 
 
 class SceneRemoveGraphNodes:
@@ -20,6 +37,10 @@ class SceneRemoveGraphNodes:
             scene.graph.transforms.remove_node(node)
         return scene
 
+    def __repr__(self):
+        # stable across runs, used in model cache keys
+        return f"SceneRemoveGraphNodes({self.graph_nodes!r})"
+
 
 def pillow_to_opengl_rgba(pillow_img, flip=True):
     """convert pillow image to np array for opengl
@@ -39,33 +60,94 @@ def pillow_to_opengl_rgba(pillow_img, flip=True):
     return opengl_img
 
 
-def mesh_to_model(mesh, m):
-    """generate model struct from trimesh mesh
+def allocate_array(shape: tuple, dtype, out_dir: Path = None, name: str = None):
+    """allocate a loader output array, memory mapped into out_dir if given
+
+    Args:
+        shape (tuple): array shape
+        dtype (np.dtype): array dtype
+        out_dir (Path, optional): directory of the .npy file to map. Defaults to None.
+        name (str, optional): file name without suffix, required with out_dir. Defaults to None.
+
+    Returns:
+        np.ndarray: uninitialized array
+    """
+    if out_dir is None:
+        return np.empty(shape, dtype=dtype)
+    return np.lib.format.open_memmap(
+        out_dir / f"{name}.npy", mode="w+", dtype=dtype, shape=shape
+    )
+
+
+def convert_into(
+    src: np.ndarray, out: np.ndarray, offset: np.ndarray = None, scale: float = None
+):
+    """copy an array into a buffer of another dtype chunk by chunk,
+    optionally computing (src - offset) * scale in the same pass,
+    so no full size intermediate (e.g. float64) copy is created
+
+    Args:
+        src (np.ndarray): source array
+        out (np.ndarray): output buffer of the same shape
+        offset (np.ndarray, optional): subtracted before scaling. Defaults to None.
+        scale (float, optional): applied after the offset. Defaults to None.
+
+    Returns:
+        np.ndarray: out
+    """
+    for start in range(0, len(src), LOADER_CHUNK_ROWS):
+        chunk = np.asarray(src[start : start + LOADER_CHUNK_ROWS])
+        if offset is not None:
+            chunk = (chunk - offset) * scale
+        out[start : start + LOADER_CHUNK_ROWS] = chunk
+    return out
+
+
+def mesh_to_model(mesh, m, out_dir: Path = None, normalize: bool = True):
+    """generate model struct from trimesh mesh,
+    vertices are centered and scaled to [-1, 1] while converting to float32
 
     Args:
         mesh (trimesh.Mesh): mesh
         m (np array): model matrix
+        out_dir (Path, optional): write the arrays to memory mapped .npy files in this directory. Defaults to None.
+        normalize (bool, optional): center and scale the vertices, False keeps mesh coordinates. Defaults to True.
 
     Returns:
         model (Model): model struct
     """
-    vertices = np.ascontiguousarray(mesh.vertices).astype(np.float32)
-    faces = np.ascontiguousarray(mesh.faces).astype(np.uint32)
-    normals = np.ascontiguousarray(mesh.vertex_normals).astype(np.float32)
+    n = len(mesh.vertices)
 
-    # center vertices at origin and scale to [-1, 1]
-    ma = vertices.max(axis=0)
-    mi = vertices.min(axis=0)
-    center = (ma + mi) / 2
-    vertices -= center
-    scale = np.abs(vertices).max()
-    vertices /= scale
+    # center vertices at origin and scale to [-1, 1],
+    # the bounds are cached by trimesh so the box follows without another pass
+    mi, ma = mesh.bounds
+    center = (ma + mi) / 2 if normalize else np.zeros(3)
+    scale = max(((ma - mi) / 2).max(), np.finfo(np.float32).tiny) if normalize else 1.0
+    vertices = convert_into(
+        mesh.vertices,
+        allocate_array((n, 3), np.float32, out_dir, "vertices"),
+        offset=center,
+        scale=1.0 / scale,
+    )
+    bounding_box = ((np.stack([mi, ma]) - center) / scale).astype(np.float32)
 
-    bounding_box = np.stack([vertices.min(0), vertices.max(0)], axis=0)
+    faces = convert_into(
+        mesh.faces,
+        allocate_array((len(mesh.faces), 3), np.uint32, out_dir, "faces"),
+    )
+    normals = convert_into(
+        mesh.vertex_normals,
+        allocate_array((n, 3), np.float32, out_dir, "normals"),
+    )
 
     # texture coordinates if present
     if hasattr(mesh.visual, "uv"):
-        texture_coords = np.ascontiguousarray(mesh.visual.uv).astype(np.float32)
+        texture_coords = convert_into(
+            mesh.visual.uv,
+            allocate_array(
+                (len(mesh.visual.uv), 2), np.float32, out_dir, "texture_coords"
+            ),
+        )
     else:
         texture_coords = None
 
@@ -85,6 +167,150 @@ def mesh_to_model(mesh, m):
     )
 
 
+def model_cache_key(
+    path: str,
+    texture: str,
+    scene_transforms: List[Callable],
+    mesh_transforms: List[Callable],
+    uniform_color: List[float],
+    lods: Tuple[float, ...] = None,
+):
+    """compute the cache key of a model from its source files and load parameters
+
+    Args:
+        path (str): path to model file
+        texture (str): texture mode
+        scene_transforms (List[Callable]): transforms on the trimesh scene
+        mesh_transforms (List[Callable]): transforms on the trimesh mesh
+        uniform_color (List[float]): vertex color for uniform texture mode
+        lods (Tuple[float, ...], optional): face ratios of the levels of detail. Defaults to None.
+
+    Returns:
+        str: hex digest, or None if a transform has no stable representation
+    """
+    transforms = [*(scene_transforms or []), *(mesh_transforms or [])]
+    if any(type(t).__repr__ is object.__repr__ for t in transforms):
+        return None  # default repr contains a memory address
+    h = hashlib.sha256()
+    h.update(
+        repr((MODEL_CACHE_VERSION, texture, transforms, uniform_color, lods)).encode()
+    )
+    hash_source_files(h, path)
+    return h.hexdigest()
+
+
+def hash_source_files(h, path: str):
+    """feed a model file and the files it references into a hash
+
+    Args:
+        h (hashlib._Hash): hash object
+        path (str): path to model file
+    """
+    path = Path(path)
+    # gltf files reference buffers and images next to them
+    files = sorted(path.parent.rglob("*")) if path.suffix == ".gltf" else [path]
+    for file in files:
+        if file.is_file():
+            h.update(str(file.relative_to(path.parent)).encode())
+            h.update(file.read_bytes())
+
+
+def load_cached_model(key: str, m: np.ndarray):
+    """load a preprocessed model from the cache, arrays are memory mapped
+
+    Args:
+        key (str): cache key
+        m (np.ndarray): model matrix
+
+    Returns:
+        Tuple[Model, np.ndarray]: (model struct, texture image) or None if not cached
+    """
+    cache_dir = MODEL_CACHE_DIR / key
+    if not cache_dir.is_dir():
+        return None
+
+    def load(name):
+        file = cache_dir / f"{name}.npy"
+        return np.load(file, mmap_mode="r") if file.exists() else None
+
+    def load_model_arrays(prefix=""):
+        return Model(
+            vertices=load(f"{prefix}vertices"),
+            faces=load(f"{prefix}faces"),
+            normals=load(f"{prefix}normals"),
+            colors=load(f"{prefix}colors"),
+            texture_coords=load(f"{prefix}texture_coords"),
+            bounding_box=np.array(load(f"{prefix}bounding_box")),
+            m=m,
+            uniform_color=load(f"{prefix}uniform_color"),
+            acmr=load(f"{prefix}acmr"),
+        )
+
+    model = load_model_arrays()
+    lods = []
+    while (cache_dir / f"lod{len(lods)}_vertices.npy").exists():
+        lods.append(load_model_arrays(f"lod{len(lods)}_"))
+    model.lods = lods or None
+    return model, load("texture")
+
+
+def new_cache_entry(key: str):
+    """create a temporary directory for a cache entry,
+    it only becomes visible to readers when store_cached_model renames it
+
+    Args:
+        key (str): cache key
+
+    Returns:
+        Path: temporary directory
+    """
+    tmp_dir = MODEL_CACHE_DIR / f"{key}.{uuid.uuid4().hex}.tmp"
+    tmp_dir.mkdir(parents=True)
+    return tmp_dir
+
+
+def store_cached_model(
+    key: str, model: Model, texture_img: np.ndarray, tmp_dir: Path = None
+):
+    """write a preprocessed model to the cache
+
+    Args:
+        key (str): cache key
+        model (Model): model struct
+        texture_img (np.ndarray): texture image formatted for opengl or None
+        tmp_dir (Path, optional): entry from new_cache_entry that may already hold memory mapped arrays. Defaults to None.
+    """
+    arrays = {"texture": texture_img}
+    # levels of detail are stored with all their fields under a lod<i>_ prefix
+    for prefix, level in [("", model)] + [
+        (f"lod{i}_", lod) for i, lod in enumerate(model.lods or [])
+    ]:
+        arrays[f"{prefix}vertices"] = level.vertices
+        arrays[f"{prefix}faces"] = level.faces
+        arrays[f"{prefix}normals"] = level.normals
+        arrays[f"{prefix}colors"] = level.colors
+        arrays[f"{prefix}texture_coords"] = level.texture_coords
+        arrays[f"{prefix}bounding_box"] = level.bounding_box
+        arrays[f"{prefix}uniform_color"] = level.uniform_color
+        arrays[f"{prefix}acmr"] = level.acmr
+    # write to a temporary directory first so readers never see partial entries
+    if tmp_dir is None:
+        tmp_dir = new_cache_entry(key)
+    for name, array in arrays.items():
+        # memmap filenames are absolute while the cache directory is relative
+        if (
+            isinstance(array, np.memmap)
+            and Path(array.filename).resolve().parent == tmp_dir.resolve()
+        ):
+            array.flush()  # written in place by mesh_to_model
+        elif array is not None:
+            np.save(tmp_dir / f"{name}.npy", np.ascontiguousarray(array))
+    try:
+        tmp_dir.rename(MODEL_CACHE_DIR / key)
+    except OSError:
+        shutil.rmtree(tmp_dir)  # written concurrently by someone else
+
+
 def load_model(
     path: str,
     m: np.ndarray,
@@ -92,8 +318,11 @@ def load_model(
     scene_transforms: List[Callable[[trimesh.Scene], trimesh.Scene]] = None,
     mesh_transforms: List[Callable[[trimesh.Trimesh], trimesh.Trimesh]] = None,
     uniform_color: List[float] = None,
+    lods: Tuple[float, ...] = None,
+    cache: bool = True,
 ):
-    """load models from a file
+    """load models from a file,
+    the preprocessed result is cached on disk so warm starts skip trimesh
 
     Args:
         path (str): path to model file
@@ -101,11 +330,23 @@ def load_model(
         texture (Literal[&quot;none&quot;, &quot;base_color&quot;, &quot;uniform&quot;], optional): the texture mode to use. Defaults to "none".
         scene_transforms (List[Callable[[trimesh.Scene], trimesh.Scene]], optional): a list of transforms on a trimesh scene. Defaults to None.
         mesh_transforms (List[Callable[[trimesh.Trimesh], trimesh.Trimesh]], optional): a list of transforms on a trimesh mesh. Defaults to None.
-        uniform_color (List[float], optional): the vertex color if texture mode is uniform. Defaults to None.
+        uniform_color (List[float], optional): the object color if texture mode is uniform. Defaults to None.
+        lods (Tuple[float, ...], optional): face ratios of simplified versions to build, e.g. lod.LOD_FACE_RATIOS. Defaults to None.
+        cache (bool, optional): use the on disk model cache. Defaults to True.
 
     Returns:
-        Tuple[Model, PIL.Image]: (model struct, texture image)
+        Tuple[Model, np.ndarray]: (model struct, texture image formatted for opengl)
     """
+    key = None
+    if cache:
+        key = model_cache_key(
+            path, texture, scene_transforms, mesh_transforms, uniform_color, lods
+        )
+    if key is not None:
+        cached = load_cached_model(key, m)
+        if cached is not None:
+            return cached
+
     mesh = trimesh.load_mesh(path)
 
     if isinstance(mesh, trimesh.Scene):
@@ -118,19 +359,39 @@ def load_model(
         for transform in mesh_transforms:
             mesh = transform(mesh)
 
-    model = mesh_to_model(mesh, m)
-
-    if texture == "none":
-        texture_img = None
-    if texture == "base_color":
-        texture_img = pillow_to_opengl_rgba(mesh.visual.material.baseColorTexture)
-    if texture == "uniform":
-        texture_img = None
-        assert uniform_color is not None
-        assert len(uniform_color) == 3
-        model.colors = np.repeat(
-            np.array([*uniform_color, 1.0], dtype=np.float32)[None, :],
-            model.vertices.shape[0],
-            axis=0,
-        )
+    # very large meshes are converted straight into the cache files,
+    # or into scratch files without the cache
+    tmp_dir = None
+    if len(mesh.vertices) >= MMAP_OUTPUT_MIN_VERTICES:
+        if key is not None:
+            tmp_dir = new_cache_entry(key)
+        else:
+            MODEL_SCRATCH_DIR.mkdir(parents=True, exist_ok=True)
+            tmp_dir = Path(tempfile.mkdtemp(dir=MODEL_SCRATCH_DIR))
+    try:
+        model = mesh_to_model(mesh, m, out_dir=tmp_dir)
+        if tmp_dir is None:
+            # memory mapped meshes are too large for uint16 and would be copied into memory
+            model = optimize_model(model)
+
+        if texture == "none":
+            texture_img = None
+        if texture == "base_color":
+            texture_img = pillow_to_opengl_rgba(mesh.visual.material.baseColorTexture)
+        if texture == "uniform":
+            texture_img = None
+            assert uniform_color is not None
+            assert len(uniform_color) == 3
+            # set as a uniform instead of repeating it for every vertex
+            model.uniform_color = np.array([*uniform_color, 1.0], dtype=np.float32)
+        if lods is not None:
+            model.lods = [optimize_model(lod) for lod in build_lods(model, lods)]
+        if key is not None:
+            store_cached_model(key, model, texture_img, tmp_dir)
+            tmp_dir = None  # renamed into the cache
+    finally:
+        # partial cache entries and scratch files are removed,
+        # arrays mapped from scratch files stay valid after unlinking (posix)
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
     return model, texture_img
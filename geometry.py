@@ -1,4 +1,5 @@
 import numpy as np
+import itertools
 from typing import List, Tuple
 
 from structs import Camera
@@ -165,6 +166,77 @@ def normal_from_model_matrix(m: np.ndarray):
     return np.linalg.inv(m[:3, :3]).T
 
 
+def bounding_box_corners(bounding_boxes: np.ndarray):
+    """enumerate the corners of a batch of axis aligned bounding boxes
+
+    Args:
+        bounding_boxes (np array): N x 2 x 3 bounding boxes (min, max)
+
+    Returns:
+        np array: N x 8 x 3 corners
+    """
+    corner_idx = np.array(list(itertools.product([0, 1], repeat=3)))
+    return bounding_boxes[:, corner_idx, np.arange(3)]
+
+
+def transform_bounding_boxes(ms: np.ndarray, bounding_boxes: np.ndarray):
+    """transform a batch of axis aligned bounding boxes,
+    the result is the axis aligned bounding box of the 8 transformed corners
+
+    Args:
+        ms (np array): N x 4 x 4 affine transformation matrices
+        bounding_boxes (np array): N x 2 x 3 bounding boxes (min, max)
+
+    Returns:
+        np array: N x 2 x 3 transformed bounding boxes
+    """
+    corners = bounding_box_corners(bounding_boxes)
+    transformed = np.einsum("nij,nkj->nki", ms[:, :3, :3], corners)
+    transformed += ms[:, None, :3, 3]
+    return np.stack([transformed.min(axis=1), transformed.max(axis=1)], axis=1)
+
+
+def frustum_cull(pvms: np.ndarray, bounding_boxes: np.ndarray):
+    """test a batch of bounding boxes against the six view frustum planes,
+    a box is culled if all its corners are outside of the same plane in clip space
+    (conservative, boxes crossing a frustum corner may be kept)
+
+    Args:
+        pvms (np array): N x 4 x 4 projection @ view @ model matrices
+        bounding_boxes (np array): N x 2 x 3 bounding boxes in model coordinates
+
+    Returns:
+        np array: N bool mask, True if the object is potentially visible
+    """
+    corners = bounding_box_corners(bounding_boxes)
+    clip = np.einsum("nij,nkj->nki", pvms[:, :, :3], corners)
+    clip += pvms[:, None, :, 3]  # N x 8 x 4
+    xyz, w = clip[..., :3], clip[..., 3:]
+    outside = np.all(xyz > w, axis=1) | np.all(xyz < -w, axis=1)  # N x 3
+    return ~np.any(outside, axis=1)
+
+
+def screen_sizes(pvms: np.ndarray, bounding_boxes: np.ndarray):
+    """projected size of a batch of bounding boxes,
+    boxes reaching behind the camera are treated as covering the whole screen
+
+    Args:
+        pvms (np array): N x 4 x 4 projection @ view @ model matrices
+        bounding_boxes (np array): N x 2 x 3 bounding boxes in model coordinates
+
+    Returns:
+        np array: N sizes as fraction of the viewport along its larger axis
+    """
+    corners = bounding_box_corners(bounding_boxes)
+    clip = np.einsum("nij,nkj->nki", pvms[:, :, :3], corners)
+    clip += pvms[:, None, :, 3]  # N x 8 x 4
+    w = clip[..., 3:]
+    in_front = np.all(w > 1e-6, axis=(1, 2))
+    ndc = clip[..., :2] / np.where(w > 1e-6, w, 1.0)
+    extent = (ndc.max(axis=1) - ndc.min(axis=1)).max(axis=1) / 2
+    return np.where(in_front, extent, np.inf)
+
+
 def camera_position(camera: Camera):
     """get camera position from camera struct
 
@@ -205,3 +277,22 @@ def np_matrix_to_opengl(m: np.ndarray):
         np array: matrix formatted for opengl
     """
     return np.ascontiguousarray(m.T)
+
+
+def instance_matrices_to_opengl(ms: np.ndarray):
+    """format a batch of model matrices as per instance vertex attributes,
+    each row holds the column major model matrix followed by the column major normal matrix
+
+    Args:
+        ms (np array): N x 4 x 4 model matrices
+
+    Returns:
+        np array: N x 25 float32 array formatted for opengl
+    """
+    n = ms.shape[0]
+    model_matrices = ms.transpose(0, 2, 1).reshape(n, 16)
+    # column major of inv(m)^T is row major of inv(m)
+    normal_matrices = np.linalg.inv(ms[:, :3, :3]).reshape(n, 9)
+    return np.ascontiguousarray(
+        np.concatenate([model_matrices, normal_matrices], axis=1), dtype=np.float32
+    )
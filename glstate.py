@@ -0,0 +1,61 @@
+from OpenGL.GL import *
+
+from structs import FrameStats, Texture
+
+# gl objects currently bound, reset at the start of every frame
+# because setup code binds and unbinds without going through these functions
+BOUND_STATE = {"program": None, "vao": None, "textures": {}}
+
+
+def reset_bound_state():
+    """forget the tracked bindings, the next bind of every kind is issued"""
+    BOUND_STATE["program"] = None
+    BOUND_STATE["vao"] = None
+    BOUND_STATE["textures"] = {}
+
+
+def use_program(program: int, stats: FrameStats = None):
+    """glUseProgram unless the program is already in use
+
+    Args:
+        program (int): shader program
+        stats (FrameStats, optional): frame stats counting skipped calls. Defaults to None.
+    """
+    if BOUND_STATE["program"] == program:
+        if stats is not None:
+            stats.program_binds_skipped += 1
+        return
+    glUseProgram(program)
+    BOUND_STATE["program"] = program
+
+
+def bind_vertex_array(vao: int, stats: FrameStats = None):
+    """glBindVertexArray unless the vao is already bound
+
+    Args:
+        vao (int): vao id
+        stats (FrameStats, optional): frame stats counting skipped calls. Defaults to None.
+    """
+    if BOUND_STATE["vao"] == vao:
+        if stats is not None:
+            stats.vao_binds_skipped += 1
+        return
+    glBindVertexArray(vao)
+    BOUND_STATE["vao"] = vao
+
+
+def bind_texture(texture: Texture, stats: FrameStats = None):
+    """bind a texture to its unit unless it is already bound there
+
+    Args:
+        texture (Texture): texture struct
+        stats (FrameStats, optional): frame stats counting skipped calls. Defaults to None.
+    """
+    key = (texture.type, texture.id)
+    if BOUND_STATE["textures"].get(texture.unit) == key:
+        if stats is not None:
+            stats.texture_binds_skipped += 1
+        return
+    glActiveTexture(texture.unit)
+    glBindTexture(texture.type, texture.id)
+    BOUND_STATE["textures"][texture.unit] = key
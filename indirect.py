@@ -0,0 +1,238 @@
+from OpenGL.GL import *
+import numpy as np
+import ctypes
+from typing import List
+
+from shaders import (
+    ATTRIBUTE_LOCATIONS,
+    DRAW_DATA_BINDING,
+    ShaderVariants,
+    depth_only_program,
+)
+from structs import RenderObject, FrameStats
+from transforms import TransformStage
+from uniforms import set_uniform
+from glstate import use_program, bind_vertex_array, bind_texture
+from alloc import INDEX_TYPES, model_attributes
+
+# layout of DrawElementsIndirectCommand
+DRAW_COMMAND_DTYPE = np.dtype(
+    [
+        ("count", "u4"),
+        ("instance_count", "u4"),
+        ("first_index", "u4"),
+        ("base_vertex", "i4"),
+        ("base_instance", "u4"),
+    ]
+)
+
+
+def material_key(render_object: RenderObject):
+    """key of all per object state that can not change within a multi draw call
+
+    Args:
+        render_object (RenderObject): render object
+
+    Returns:
+        tuple: hashable textures and static uniform values
+    """
+    textures = tuple((t.type, t.id, t.unit) for t in render_object.textures or [])
+    uniforms = tuple(
+        (u.name, repr(np.asarray(u.value).tolist()))
+        for u in render_object.static_uniforms or []
+    )
+    return textures, uniforms
+
+
+class IndirectRenderer:
+    """submits all objects drawn with the indirect programs through glMultiDrawElementsIndirect,
+    one call per program, vertex layout, index type and material (textures and static uniforms)
+    instead of one draw call per object,
+    per draw model and normal matrices are read from a shader storage buffer
+    indexed by the base instance of the draw command
+    """
+
+    def __init__(self, objects: List[RenderObject], shaders: ShaderVariants):
+        self.shaders = shaders
+        # chunked objects change their draw ranges every frame and are drawn directly
+        self.indices = np.array(
+            [
+                i
+                for i, o in enumerate(objects)
+                if o.shaders in shaders and o.chunks is None
+            ],
+            dtype=np.int64,
+        )
+        assert (
+            self.indices.size > 0
+        ), f"No objects use the {shaders.vertex_shader} variants"
+        self.objects_mask = np.zeros(len(objects), dtype=bool)
+        self.objects_mask[self.indices] = True
+        members = [objects[i] for i in self.indices]
+        self.arena = members[0].arena
+        assert all(
+            o.arena is self.arena and o.model.faces is not None and o.instances is None
+            for o in members
+        ), "indirect objects must be indexed, not instanced and share one arena"
+        n = len(members)
+
+        # group members by program, vertex layout, index type and material,
+        # commands of a group are contiguous
+        groups = {}
+        for slot, o in enumerate(members):
+            key = (
+                int(o.shaders),
+                model_attributes(o.model),
+                o.model.faces.itemsize,
+                material_key(o),
+            )
+            groups.setdefault(key, []).append(slot)
+        self.order = np.array([s for slots in groups.values() for s in slots])
+        self.group_ids = np.repeat(
+            np.arange(len(groups)), [len(slots) for slots in groups.values()]
+        )
+        self.group_objects = [members[slots[0]] for slots in groups.values()]
+        self.group_layouts = [key[1] for key in groups]
+
+        # the base instance selects the slot of an object in the draw data buffer
+        self.commands = np.zeros(n, dtype=DRAW_COMMAND_DTYPE)
+        self.commands["count"] = [o.model.faces.size for o in members]
+        self.commands["instance_count"] = 1
+        self.commands["first_index"] = [o.first_index for o in members]
+        self.commands["base_vertex"] = [o.base_vertex for o in members]
+        self.commands["base_instance"] = np.arange(n)
+        self.commands = self.commands[self.order]
+        # commands rewritten every frame with the selected level of detail
+        self.lod_commands = [
+            (row, members[slot])
+            for row, slot in enumerate(self.order)
+            if members[slot].lod_ranges is not None
+        ]
+
+        self.command_buffer = glGenBuffers(1)
+        glBindBuffer(GL_DRAW_INDIRECT_BUFFER, self.command_buffer)
+        glBufferData(
+            target=GL_DRAW_INDIRECT_BUFFER,
+            size=self.commands.nbytes,
+            data=None,
+            usage=GL_DYNAMIC_DRAW,
+        )
+        glBindBuffer(GL_DRAW_INDIRECT_BUFFER, 0)
+
+        # std430 DrawData: column major M and normal matrix padded to a mat4
+        self.draw_data = np.zeros((n, 2, 4, 4), dtype=np.float32)
+        self.draw_buffer = glGenBuffers(1)
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.draw_buffer)
+        glBufferData(
+            target=GL_SHADER_STORAGE_BUFFER,
+            size=self.draw_data.nbytes,
+            data=None,
+            usage=GL_DYNAMIC_DRAW,
+        )
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, 0)
+
+        # draw ids advance once per instance, so they start at the base instance
+        draw_ids = np.arange(n, dtype=np.uint32)
+        self.draw_id_vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.draw_id_vbo)
+        glBufferData(
+            target=GL_ARRAY_BUFFER,
+            size=draw_ids.nbytes,
+            data=draw_ids,
+            usage=GL_STATIC_DRAW,
+        )
+        # one vao per vertex layout, all reading the same draw ids
+        self.vaos = {}
+        location = ATTRIBUTE_LOCATIONS["draw_id"]
+        for layout in set(self.group_layouts):
+            vao = self.arena.create_vao(layout)
+            glBindVertexArray(vao)
+            glBindBuffer(GL_ARRAY_BUFFER, self.draw_id_vbo)
+            glVertexAttribIPointer(location, 1, GL_UNSIGNED_INT, 0, ctypes.c_void_p(0))
+            glEnableVertexAttribArray(location)
+            glVertexAttribDivisor(location, 1)
+            self.vaos[layout] = vao
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def submit(
+        self,
+        transforms: TransformStage,
+        dirty: List[int],
+        stats: FrameStats = None,
+        depth_only: bool = False,
+        hidden: np.ndarray = None,
+    ):
+        """upload changed transforms and the commands of all visible objects,
+        then draw them with one multi draw call per material
+
+        Args:
+            transforms (TransformStage): transforms of the frame
+            dirty (List[int]): indices of the objects whose model matrix changed
+            stats (FrameStats, optional): frame stats counting the skipped binds. Defaults to None.
+            depth_only (bool, optional): draw with the depth only programs for a depth pre-pass. Defaults to False.
+            hidden (np.ndarray, optional): N bools, objects skipped by occlusion culling. Defaults to None.
+        """
+        if np.isin(self.indices, dirty).any():
+            self.draw_data[:, 0] = transforms.gl_ms[self.indices]
+            self.draw_data[:, 1, :3, :3] = transforms.gl_normal_matrices[self.indices]
+            glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.draw_buffer)
+            glBufferSubData(
+                GL_SHADER_STORAGE_BUFFER, 0, self.draw_data.nbytes, self.draw_data
+            )
+            glBindBuffer(GL_SHADER_STORAGE_BUFFER, 0)
+
+        for row, render_object in self.lod_commands:
+            base_vertex, first_index, count = render_object.lod_ranges[
+                render_object.lod
+            ]
+            self.commands["count"][row] = count
+            self.commands["first_index"][row] = first_index
+            self.commands["base_vertex"][row] = base_vertex
+
+        visible = transforms.visible
+        if hidden is not None:
+            visible = visible & ~hidden
+        visible = visible[self.indices][self.order]
+        commands = np.ascontiguousarray(self.commands[visible])
+        counts = np.bincount(self.group_ids[visible], minlength=len(self.group_objects))
+        if commands.size == 0:
+            return
+
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, DRAW_DATA_BINDING, self.draw_buffer)
+        glBindBuffer(GL_DRAW_INDIRECT_BUFFER, self.command_buffer)
+        glBufferSubData(GL_DRAW_INDIRECT_BUFFER, 0, commands.nbytes, commands)
+
+        first = 0
+        for render_object, layout, count in zip(
+            self.group_objects, self.group_layouts, counts
+        ):
+            if count == 0:
+                continue
+            bind_vertex_array(self.vaos[layout], stats)
+            if depth_only:
+                use_program(depth_only_program(render_object.shaders), stats)
+            else:
+                use_program(render_object.shaders, stats)
+                for uniform in render_object.static_uniforms or []:
+                    set_uniform(uniform, render_object.shaders)
+                for texture in render_object.textures or []:
+                    bind_texture(texture, stats)
+            glMultiDrawElementsIndirect(
+                GL_TRIANGLES,  # mode
+                INDEX_TYPES[render_object.model.faces.itemsize],  # type
+                ctypes.c_void_p(first * DRAW_COMMAND_DTYPE.itemsize),  # indirect
+                int(count),  # draw count
+                0,  # stride (tightly packed)
+            )
+            first += count
+
+        glBindBuffer(GL_DRAW_INDIRECT_BUFFER, 0)
+
+    def destroy(self):
+        """free all gl resources of the renderer"""
+        for vao in self.vaos.values():
+            self.arena.delete_vao(vao)
+        glDeleteBuffers(1, self.draw_id_vbo)
+        glDeleteBuffers(1, self.command_buffer)
+        glDeleteBuffers(1, self.draw_buffer)
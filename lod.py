@@ -0,0 +1,170 @@
+import numpy as np
+from typing import List, Tuple
+
+from structs import Model
+
+# face count of each level of detail relative to the full resolution mesh
+LOD_FACE_RATIOS = (0.5, 0.25, 0.1)
+# lod i + 1 is used once the projected bounding box is smaller than
+# LOD_SCREEN_SIZES[i] (fraction of the viewport along its larger axis)
+LOD_SCREEN_SIZES = (0.5, 0.25, 0.1)
+
+
+def cluster_vertices(model: Model, resolution: int):
+    """assign every vertex to a cell of a regular grid over the bounding box,
+    vertices with opposite facing normals never share a cell,
+    so thin parts are not collapsed into one surface
+
+    Args:
+        model (Model): model struct
+        resolution (int): number of cells along the largest bounding box axis
+
+    Returns:
+        Tuple[np.ndarray, int]: (cluster index of every vertex, number of clusters)
+    """
+    mi, ma = model.bounding_box
+    cell_size = max(float((ma - mi).max()), 1e-6) / resolution
+    cells = np.floor((model.vertices - mi) / cell_size).astype(np.int64)
+    cells = np.minimum(cells, resolution - 1)
+    octants = (np.asarray(model.normals) >= 0.0) @ np.array([1, 2, 4])
+    keys = ((cells[:, 0] * resolution + cells[:, 1]) * resolution + cells[:, 2]) * 8
+    keys += octants
+    _, clusters = np.unique(keys, return_inverse=True)
+    return clusters.ravel(), int(clusters.max()) + 1
+
+
+def cluster_faces(faces: np.ndarray, clusters: np.ndarray):
+    """remap faces to clusters, dropping collapsed and duplicate triangles
+
+    Args:
+        faces (np.ndarray): F x 3 vertex indices
+        clusters (np.ndarray): cluster index of every vertex
+
+    Returns:
+        np.ndarray: F' x 3 cluster indices
+    """
+    faces = clusters[faces]
+    keep = (
+        (faces[:, 0] != faces[:, 1])
+        & (faces[:, 1] != faces[:, 2])
+        & (faces[:, 2] != faces[:, 0])
+    )
+    faces = faces[keep]
+    # triangles are equal if they have the same vertices in the same winding
+    rotation = np.argmin(faces, axis=1)
+    canonical = np.take_along_axis(
+        faces, (rotation[:, None] + np.arange(3)) % 3, axis=1
+    )
+    _, first = np.unique(canonical, axis=0, return_index=True)
+    return faces[np.sort(first)]
+
+
+def cluster_mean(values: np.ndarray, clusters: np.ndarray, n: int):
+    """average per vertex values over the vertices of each cluster
+
+    Args:
+        values (np.ndarray): V x C per vertex values
+        clusters (np.ndarray): cluster index of every vertex
+        n (int): number of clusters
+
+    Returns:
+        np.ndarray: n x C float32 averages
+    """
+    counts = np.bincount(clusters, minlength=n)[:, None]
+    sums = np.stack(
+        [
+            np.bincount(clusters, weights=values[:, c], minlength=n)
+            for c in range(values.shape[1])
+        ],
+        axis=1,
+    )
+    return (sums / np.maximum(counts, 1)).astype(np.float32)
+
+
+def decimate(model: Model, ratio: float):
+    """simplify a mesh to about a fraction of its faces by vertex clustering,
+    the grid resolution is searched so the face count does not exceed the target
+
+    Args:
+        model (Model): indexed model struct with normals
+        ratio (float): target face count relative to the model
+
+    Returns:
+        Model: simplified model struct sharing bounding box and model matrix
+    """
+    target = max(int(model.faces.shape[0] * ratio), 1)
+    lo, hi = 1, 1024
+    best = None
+    while lo <= hi:
+        resolution = (lo + hi) // 2
+        clusters, n = cluster_vertices(model, resolution)
+        faces = cluster_faces(model.faces, clusters)
+        if faces.shape[0] <= target:
+            best = clusters, n, faces
+            lo = resolution + 1
+        else:
+            hi = resolution - 1
+    if best is None:
+        best = clusters, n, faces  # resolution 1, as coarse as it gets
+    clusters, n, faces = best
+
+    # drop clusters no longer referenced by any face
+    used = np.zeros(n, dtype=bool)
+    used[faces] = True
+    remap = np.cumsum(used) - 1
+    faces = remap[faces].astype(np.uint32)
+    clusters = np.where(used[clusters], remap[clusters], -1)
+    vertex_mask = clusters >= 0
+    clusters, n = clusters[vertex_mask], int(used.sum())
+
+    def mean(values):
+        if values is None:
+            return None
+        return cluster_mean(np.asarray(values)[vertex_mask], clusters, n)
+
+    normals = mean(model.normals)
+    normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+    return Model(
+        vertices=mean(model.vertices),
+        faces=faces,
+        normals=normals,
+        colors=mean(model.colors),
+        texture_coords=mean(model.texture_coords),
+        bounding_box=model.bounding_box,
+        m=model.m,
+        uniform_color=model.uniform_color,
+    )
+
+
+def build_lods(model: Model, ratios: Tuple[float, ...] = LOD_FACE_RATIOS):
+    """build a chain of simplified versions of a model,
+    each level is simplified from the previous one
+
+    Args:
+        model (Model): indexed model struct with normals
+        ratios (Tuple[float, ...], optional): face counts relative to the model, decreasing. Defaults to LOD_FACE_RATIOS.
+
+    Returns:
+        List[Model]: simplified models, coarsest last
+    """
+    lods = []
+    previous, previous_ratio = model, 1.0
+    for ratio in ratios:
+        previous = decimate(previous, ratio / previous_ratio)
+        previous_ratio = ratio
+        lods.append(previous)
+    return lods
+
+
+def select_lods(screen_sizes: np.ndarray, lod_counts: np.ndarray):
+    """pick a level of detail for every object from its projected size
+
+    Args:
+        screen_sizes (np.ndarray): N projected bounding box sizes (fraction of the viewport)
+        lod_counts (np.ndarray): N number of levels per object (including the full resolution mesh)
+
+    Returns:
+        np.ndarray: N lod indices, 0 is the full resolution mesh
+    """
+    lods = (screen_sizes[:, None] < np.array(LOD_SCREEN_SIZES)).sum(axis=1)
+    return np.minimum(lods, lod_counts - 1)
@@ -5,16 +5,49 @@ os.environ["SDL_VIDEO_X11_FORCE_EGL"] = "1"  # hack for linux vm on mac
 import pygame
 from OpenGL.GL import *
 import numpy as np
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from typing import Tuple
 
 from structs import Camera
-from components import olympic_rings, sky_box, floor, olympic_logo, human_body
+from components import (
+    olympic_rings,
+    olympic_rings_assets,
+    sky_box,
+    sky_box_assets,
+    floor,
+    floor_assets,
+    olympic_logo,
+    olympic_logo_assets,
+    human_body,
+    human_body_assets,
+    chunked_mesh,
+)
 from render import render_loop
-from geometry import P
-from alloc import destroy_render_object
-from shaders import compile_shaders
+from geometry import P, pose
+from alloc import destroy_render_object, create_uniform_buffer, GeometryArena
+from shaders import (
+    compile_shaders,
+    ShaderVariants,
+    FRAME_DATA_SIZE,
+    FRAME_DATA_BINDING,
+)
+from streaming import TextureStreamer
 
 WINDOW_SIZE = (800, 600)
+# submit all normal objects with glMultiDrawElementsIndirect (needs opengl 4.3)
+USE_MULTI_DRAW_INDIRECT = False
+# lay down depth first, then shade every pixel once (cuts overdraw when fill rate bound)
+USE_DEPTH_PREPASS = False
+# skip objects hidden behind others, decided by bounding box queries of earlier frames
+USE_OCCLUSION_CULLING = False
+# upload textures in the background, objects show a placeholder until then
+USE_TEXTURE_STREAMING = True
+# optional mesh larger than memory (e.g. a scan), split into chunks streamed by visibility,
+# binary ply files with triangle faces are chunked straight from disk,
+# other formats are loaded whole by trimesh once to build the chunk store
+# and must fit in memory
+CHUNKED_MODEL_PATH = None
 
 
 def init_pygame(window_size: Tuple[int, int]):
@@ -41,6 +74,77 @@ def init_opengl(window_size: Tuple[int, int]):
     # glClearColor(0.7, 0.7, 1.0, 1.0) # sky box anyway
 
 
+def build_scene(
+    object_shaders: ShaderVariants,
+    instanced_object_shaders: ShaderVariants,
+    skybox_shaders: int,
+    arena: GeometryArena,
+    streamer: TextureStreamer = None,
+):
+    """load all assets in parallel worker processes,
+    the render objects are created on this (the context) thread as soon as their assets arrive
+
+    Args:
+        object_shaders (ShaderVariants): shader variants for normal objects
+        instanced_object_shaders (ShaderVariants): shader variants for instanced objects
+        skybox_shaders (int): shader program for the skybox
+        arena (GeometryArena): arena holding the geometry of all objects
+        streamer (TextureStreamer, optional): streams the textures, the skybox faces are then decoded by the streamer. Defaults to None.
+
+    Returns:
+        Tuple[List[RenderObject], RenderObject]: (normal objects, sky box)
+    """
+    built = {}
+    logo_assets = None
+    if streamer is not None:
+        built["sky_box"] = sky_box(skybox_shaders, arena, streamer=streamer)
+    # spawn instead of fork, the parent holds an opengl context
+    with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {
+            pool.submit(floor_assets): "floor",
+            pool.submit(olympic_rings_assets): "olympic_rings",
+            pool.submit(olympic_logo_assets): "olympic_logo",
+            pool.submit(human_body_assets): "human_body",
+        }
+        if "sky_box" not in built:
+            futures[pool.submit(sky_box_assets)] = "sky_box"
+        for future in as_completed(futures):
+            name = futures[future]
+            assets = future.result()
+            if name == "sky_box":
+                built[name] = sky_box(skybox_shaders, arena, assets=assets)
+            elif name == "floor":
+                built[name] = floor(
+                    instanced_object_shaders, arena, assets=assets, streamer=streamer
+                )
+            elif name == "olympic_rings":
+                built[name] = olympic_rings(
+                    object_shaders,
+                    instanced_object_shaders,
+                    arena,
+                    assets=assets,
+                    streamer=streamer,
+                )
+            elif name == "olympic_logo":
+                logo_assets = assets
+            elif name == "human_body":
+                built[name] = human_body(object_shaders, arena, assets=assets)
+            # the logo reflects the skybox
+            if logo_assets is not None and "sky_box" in built:
+                built["olympic_logo"] = olympic_logo(
+                    object_shaders, arena, built["sky_box"], assets=logo_assets
+                )
+                logo_assets = None
+
+    objects = [
+        built["floor"],
+        *built["olympic_rings"],
+        built["olympic_logo"],
+        built["human_body"],
+    ]
+    return objects, built["sky_box"]
+
+
 def main():
     init_pygame(WINDOW_SIZE)
     init_opengl(WINDOW_SIZE)
@@ -54,15 +158,38 @@ def main():
         distance=3.0,
     )
 
-    object_shaders = compile_shaders("object")
+    # object programs are compiled per feature set when the components ask for them
+    if USE_MULTI_DRAW_INDIRECT:
+        object_shaders = ShaderVariants(
+            "object", vertex_shader="indirect_vertex_shader.glsl"
+        )
+    else:
+        object_shaders = ShaderVariants("object")
+    instanced_object_shaders = ShaderVariants(
+        "object", vertex_shader="instanced_vertex_shader.glsl"
+    )
     skybox_shaders = compile_shaders("cubemap")
 
-    skybox = sky_box(skybox_shaders)
-    objects = []
-    objects += floor(object_shaders)
-    objects.append(olympic_rings(object_shaders))
-    objects.append(olympic_logo(object_shaders, skybox))
-    objects.append(human_body(object_shaders))
+    frame_ubo = create_uniform_buffer(FRAME_DATA_SIZE, FRAME_DATA_BINDING)
+
+    arena = GeometryArena()
+    streamer = TextureStreamer() if USE_TEXTURE_STREAMING else None
+    objects, skybox = build_scene(
+        object_shaders, instanced_object_shaders, skybox_shaders, arena, streamer
+    )
+    if CHUNKED_MODEL_PATH is not None:
+        # chunks are drawn directly, not with the indirect program
+        chunked_shaders = (
+            ShaderVariants("object") if USE_MULTI_DRAW_INDIRECT else object_shaders
+        )
+        objects.append(
+            chunked_mesh(
+                chunked_shaders,
+                arena,
+                CHUNKED_MODEL_PATH,
+                m=pose(position=[0.0, 1.0, 4.0], scale=2.0),
+            )
+        )
 
     render_loop(
         window_size=WINDOW_SIZE,
@@ -70,10 +197,19 @@ def main():
         p=p,
         objects=objects,
         skybox=skybox,
+        frame_ubo=frame_ubo,
+        indirect_shaders=object_shaders if USE_MULTI_DRAW_INDIRECT else None,
+        streamer=streamer,
+        depth_prepass=USE_DEPTH_PREPASS,
+        occlusion_culling=USE_OCCLUSION_CULLING,
     )
 
+    if streamer is not None:
+        streamer.destroy()
     for ro in objects + [skybox]:
         destroy_render_object(ro)
+    glDeleteBuffers(1, frame_ubo)
+    arena.destroy()
 
 
 if __name__ == "__main__":
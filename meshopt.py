@@ -0,0 +1,195 @@
+import numpy as np
+
+from structs import Model
+
+# simulated post transform vertex cache (fifo), the size tipsify optimizes for
+VERTEX_CACHE_SIZE = 16
+# meshes with at most this many vertices are indexed with uint16
+MAX_UINT16_VERTICES = 1 << 16
+
+
+def acmr(faces: np.ndarray, cache_size: int = VERTEX_CACHE_SIZE):
+    """average cache miss ratio, transformed vertices per triangle of a fifo vertex cache,
+    between 0.5 (ideal for large meshes) and 3 (no reuse)
+
+    Args:
+        faces (np.ndarray): F x 3 vertex indices
+        cache_size (int, optional): number of cached vertices. Defaults to VERTEX_CACHE_SIZE.
+
+    Returns:
+        float: cache misses per triangle
+    """
+    if len(faces) == 0:
+        return 0.0
+    # a vertex is cached if fewer than cache_size misses happened since it was loaded
+    loaded = {}
+    misses = 0
+    for v in np.asarray(faces).ravel().tolist():
+        if misses - loaded.get(v, -cache_size) >= cache_size:
+            loaded[v] = misses
+            misses += 1
+    return misses / len(faces)
+
+
+def weld_vertices(model: Model):
+    """merge vertices with identical attributes, e.g. split by the file format per face
+
+    Args:
+        model (Model): indexed model struct
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (index of a representative per unique vertex, F x 3 faces into them)
+    """
+    attributes = [
+        np.asarray(a, dtype=np.float32).reshape(len(model.vertices), -1)
+        for a in (model.vertices, model.normals, model.texture_coords, model.colors)
+        if a is not None
+    ]
+    rows = np.ascontiguousarray(np.concatenate(attributes, axis=1))
+    # compare rows as raw bytes, -0.0 and 0.0 stay distinct which only costs a vertex
+    keys = rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1])))
+    _, first, inverse = np.unique(keys.ravel(), return_index=True, return_inverse=True)
+    return first, inverse.ravel()[model.faces]
+
+
+def tipsify(faces: np.ndarray, vertex_count: int, cache_size: int = VERTEX_CACHE_SIZE):
+    """reorder triangles for the post transform vertex cache,
+    fans around the most recently used vertices (Sander et al. 2007)
+
+    Args:
+        faces (np.ndarray): F x 3 vertex indices
+        vertex_count (int): number of vertices
+        cache_size (int, optional): cache size to optimize for. Defaults to VERTEX_CACHE_SIZE.
+
+    Returns:
+        np.ndarray: F triangle indices in drawing order
+    """
+    faces = np.asarray(faces, dtype=np.int64)
+    # vertex -> adjacent triangles, as offsets into a sorted triangle list
+    corners = faces.ravel()
+    adjacency = (np.argsort(corners, kind="stable") // 3).tolist()
+    offsets = np.zeros(vertex_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(corners, minlength=vertex_count), out=offsets[1:])
+    offsets = offsets.tolist()
+    live = np.bincount(corners, minlength=vertex_count).tolist()
+    triangles = faces.tolist()
+
+    stamps = [0] * vertex_count  # time each vertex entered the cache
+    emitted = [False] * len(triangles)
+    dead_ends = []
+    order = []
+    time = cache_size + 1
+    cursor = 0
+    fan = 0 if vertex_count > 0 else -1
+    while fan >= 0:
+        candidates = []
+        for t in adjacency[offsets[fan] : offsets[fan + 1]]:
+            if emitted[t]:
+                continue
+            emitted[t] = True
+            order.append(t)
+            for v in triangles[t]:
+                dead_ends.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if time - stamps[v] > cache_size:
+                    stamps[v] = time
+                    time += 1
+
+        # next fan: the oldest candidate whose fan still fits into the cache
+        fan, best = -1, -1
+        for v in candidates:
+            if live[v] > 0:
+                priority = 0
+                if time - stamps[v] + 2 * live[v] <= cache_size:
+                    priority = time - stamps[v]
+                if priority > best:
+                    fan, best = v, priority
+        if fan == -1:
+            # dead end, go back to a recently used vertex or scan for any left
+            while dead_ends:
+                v = dead_ends.pop()
+                if live[v] > 0:
+                    fan = v
+                    break
+        while fan == -1 and cursor < vertex_count:
+            if live[cursor] > 0:
+                fan = cursor
+            cursor += 1
+    return np.array(order, dtype=np.int64)
+
+
+def optimize_vertex_fetch(faces: np.ndarray):
+    """order vertices by their first use, so vertex reads walk the buffer forward,
+    vertices not referenced by any face are dropped
+
+    Args:
+        faces (np.ndarray): F x 3 vertex indices
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (old index of every new vertex, F x 3 remapped faces)
+    """
+    used, first, inverse = np.unique(
+        faces.ravel(), return_index=True, return_inverse=True
+    )
+    rank = np.empty(len(used), dtype=np.int64)
+    rank[np.argsort(first, kind="stable")] = np.arange(len(used))
+    return used[np.argsort(rank)], rank[inverse.ravel()].reshape(faces.shape)
+
+
+def index_dtype(vertex_count: int):
+    """smallest index type for a mesh
+
+    Args:
+        vertex_count (int): number of vertices
+
+    Returns:
+        np.dtype: uint16 or uint32
+    """
+    return np.dtype(np.uint16 if vertex_count <= MAX_UINT16_VERTICES else np.uint32)
+
+
+def optimize_faces(faces: np.ndarray, vertex_count: int):
+    """reorder triangles for the vertex cache and vertices for fetch locality
+
+    Args:
+        faces (np.ndarray): F x 3 vertex indices
+        vertex_count (int): number of vertices
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (old index of every new vertex, F x 3 faces with the smallest index type)
+    """
+    faces = np.asarray(faces)[tipsify(faces, vertex_count)]
+    vertex_order, faces = optimize_vertex_fetch(faces)
+    return vertex_order, faces.astype(index_dtype(len(vertex_order)))
+
+
+def optimize_model(model: Model):
+    """weld duplicate vertices, reorder triangles and vertices and shrink the indices,
+    the acmr before and after is recorded in the returned model
+
+    Args:
+        model (Model): indexed model struct
+
+    Returns:
+        Model: optimized copy, levels of detail are not carried over
+    """
+    before = acmr(model.faces)
+    welded, faces = weld_vertices(model)
+    vertex_order, faces = optimize_faces(faces, len(welded))
+    vertices = welded[vertex_order]
+
+    def select(values):
+        return None if values is None else np.asarray(values)[vertices]
+
+    return Model(
+        vertices=select(model.vertices),
+        faces=faces,
+        normals=select(model.normals),
+        colors=select(model.colors),
+        texture_coords=select(model.texture_coords),
+        bounding_box=model.bounding_box,
+        m=model.m,
+        uniform_color=model.uniform_color,
+        acmr=np.array([before, acmr(faces)], dtype=np.float32),
+    )
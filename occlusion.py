@@ -0,0 +1,164 @@
+from OpenGL.GL import *
+import numpy as np
+import ctypes
+
+from shaders import ATTRIBUTE_LOCATIONS, compile_shaders
+from structs import FrameStats, Uniform
+from transforms import TransformStage
+from uniforms import set_uniform
+from glstate import use_program, bind_vertex_array
+
+# consecutive occluded query results before an object is skipped,
+# a single visible result shows it again (hysteresis against popping)
+OCCLUSION_HIDE_FRAMES = 2
+# bounding boxes are grown by this fraction of their size (plus the same absolute amount),
+# so flat boxes are not hidden by the depth of their own object
+OCCLUSION_BOX_MARGIN = 1e-2
+
+# unit cube as 12 triangles, corner index is x * 4 + y * 2 + z
+_CORNERS = np.array(
+    [[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)], dtype=np.float32
+)
+_QUADS = np.array(
+    [
+        [0, 1, 3, 2],
+        [4, 5, 7, 6],
+        [0, 1, 5, 4],
+        [2, 3, 7, 6],
+        [0, 2, 6, 4],
+        [1, 3, 7, 5],
+    ]
+)
+BOX_VERTICES = np.ascontiguousarray(_CORNERS[_QUADS[:, [0, 1, 2, 0, 2, 3]].ravel()])
+
+
+def near_plane_extent(p: np.ndarray):
+    """distance from the camera to the farthest corner of the near plane
+
+    Args:
+        p (np.ndarray): projection matrix
+
+    Returns:
+        float: distance in view space units
+    """
+    corners = np.array(
+        [[x, y, -1.0, 1.0] for x in (-1.0, 1.0) for y in (-1.0, 1.0)], dtype=np.float64
+    )
+    corners = corners @ np.linalg.inv(p).T
+    corners = corners[:, :3] / corners[:, 3:]
+    return float(np.linalg.norm(corners, axis=1).max())
+
+
+class OcclusionCuller:
+    """hides objects behind other objects with GL_ANY_SAMPLES_PASSED queries,
+    after the objects are drawn the bounding box of every object in the view frustum
+    is tested against the depth buffer, the results are read in the next frame
+    (never waiting for the gpu) and decide whether the object is drawn in that frame
+    """
+
+    def __init__(
+        self,
+        object_count: int,
+        p: np.ndarray,
+        hide_frames: int = OCCLUSION_HIDE_FRAMES,
+    ):
+        self.hide_frames = hide_frames
+        # boxes the camera may be inside of or that the near plane may clip are never tested
+        self.near_extent = near_plane_extent(p)
+        self.queries = np.atleast_1d(glGenQueries(object_count))
+        self.pending = np.zeros(object_count, dtype=bool)  # query issued, not read
+        self.occluded_frames = np.zeros(object_count, dtype=np.int64)
+        self.hidden = np.zeros(object_count, dtype=bool)
+
+        self.program = compile_shaders("bounds")
+        self.vao = glGenVertexArrays(1)
+        glBindVertexArray(self.vao)
+        self.vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(
+            target=GL_ARRAY_BUFFER,
+            size=BOX_VERTICES.nbytes,
+            data=BOX_VERTICES,
+            usage=GL_STATIC_DRAW,
+        )
+        location = ATTRIBUTE_LOCATIONS["position"]
+        glVertexAttribPointer(location, 3, GL_FLOAT, GL_FALSE, 0, ctypes.c_void_p(0))
+        glEnableVertexAttribArray(location)
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def read_results(self):
+        """collect the query results of the previous frame and update the hidden objects,
+        results that are not available yet keep the current state
+        """
+        for i in np.flatnonzero(self.pending).tolist():
+            query = self.queries[i]
+            if not glGetQueryObjectuiv(query, GL_QUERY_RESULT_AVAILABLE):
+                continue
+            self.pending[i] = False
+            if glGetQueryObjectuiv(query, GL_QUERY_RESULT):
+                self.occluded_frames[i] = 0
+            else:
+                self.occluded_frames[i] += 1
+        self.hidden = self.occluded_frames >= self.hide_frames
+
+    def issue(
+        self,
+        transforms: TransformStage,
+        camera_pos: np.ndarray,
+        stats: FrameStats = None,
+    ):
+        """test the bounding boxes of all objects in the view frustum against the depth buffer,
+        call after the objects of the frame are drawn
+
+        Args:
+            transforms (TransformStage): transforms of the frame
+            camera_pos (np.ndarray): camera position in world coordinates
+            stats (FrameStats, optional): frame stats counting the issued queries. Defaults to None.
+        """
+        boxes = transforms.world_bounding_boxes
+        margin = OCCLUSION_BOX_MARGIN * (boxes[:, 1] - boxes[:, 0] + 1.0)
+        mins, maxs = boxes[:, 0] - margin, boxes[:, 1] + margin
+        near = self.near_extent
+        contains_camera = np.all(
+            (mins - near <= camera_pos) & (camera_pos <= maxs + near), axis=1
+        )
+        # objects outside the frustum start visible when they come back
+        self.occluded_frames[~transforms.visible | contains_camera] = 0
+        self.hidden &= transforms.visible & ~contains_camera
+        candidates = np.flatnonzero(
+            transforms.visible & ~contains_camera & ~self.pending
+        )
+        if candidates.size == 0:
+            return
+
+        use_program(self.program, stats)
+        bind_vertex_array(self.vao, stats)
+        glColorMask(GL_FALSE, GL_FALSE, GL_FALSE, GL_FALSE)
+        glDepthMask(GL_FALSE)
+        glDepthFunc(GL_LEQUAL)
+        glDisable(GL_CULL_FACE)  # the box may be seen from inside
+        for i in candidates.tolist():
+            set_uniform(
+                Uniform(name="box_min", value=mins[i], type="vec3"), self.program
+            )
+            set_uniform(
+                Uniform(name="box_max", value=maxs[i], type="vec3"), self.program
+            )
+            glBeginQuery(GL_ANY_SAMPLES_PASSED, self.queries[i])
+            glDrawArrays(GL_TRIANGLES, 0, BOX_VERTICES.shape[0])
+            glEndQuery(GL_ANY_SAMPLES_PASSED)
+        glEnable(GL_CULL_FACE)
+        glDepthFunc(GL_LESS)
+        glDepthMask(GL_TRUE)
+        glColorMask(GL_TRUE, GL_TRUE, GL_TRUE, GL_TRUE)
+        self.pending[candidates] = True
+        if stats is not None:
+            stats.occlusion_queries += int(candidates.size)
+
+    def destroy(self):
+        """free all gl resources of the culler"""
+        glDeleteQueries(len(self.queries), self.queries)
+        glDeleteVertexArrays(1, self.vao)
+        glDeleteBuffers(1, self.vbo)
+        glDeleteProgram(self.program)
@@ -1,99 +1,498 @@
 from OpenGL.GL import *
+from dataclasses import dataclass
 import pygame
 import numpy as np
+import ctypes
 
+from alloc import update_instance_vbo, update_uniform_buffer, INDEX_TYPES
 from events import handle_events
 from geometry import (
     np_matrix_to_opengl,
     V,
-    V_no_translation,
     camera_position,
-    normal_from_model_matrix,
 )
-from structs import Uniform, RenderObject, Camera
+from light import (
+    AMBIENT_STRENGTH,
+    AMBIENT_COLOR,
+    DIFFUSE_POS,
+    DIFFUSE_COLOR,
+    SPECULAR_STRENGTH,
+    SPECULAR_SHININESS,
+)
+from shaders import (
+    check_uniforms,
+    depth_only_program,
+    ShaderVariants,
+    FRAME_DATA_SIZE,
+)
+from structs import Uniform, RenderObject, Camera, FrameStats
+from transforms import TransformStage
+from indirect import IndirectRenderer
+from occlusion import OcclusionCuller
+from uniforms import set_uniform
+from glstate import reset_bound_state, use_program, bind_vertex_array, bind_texture
+from render_queue import RenderQueue
+from lod import select_lods
+from streaming import TextureStreamer
 from typing import List, Tuple
 
+# uniforms computed and set in the render loop
+# (projection, view, camera position and lights come from the frame data ubo)
+OBJECT_DYNAMIC_UNIFORMS = ["M", "normal_matrix"]
+INSTANCED_DYNAMIC_UNIFORMS = []
+INDIRECT_DYNAMIC_UNIFORMS = []  # transforms come from a storage buffer
+SKYBOX_DYNAMIC_UNIFORMS = ["M"]
 
-def set_uniform(uniform: Uniform, shaders: int):
-    """set a uniform value in shader program
+
+def frame_data(p: np.ndarray, v: np.ndarray, camera_pos: np.ndarray):
+    """pack the per frame camera and light data according to the std140 FrameData block
 
     Args:
-        uniform (Uniform): uniform struct
-        shaders (int): shader program id
+        p (np.ndarray): projection matrix
+        v (np.ndarray): view matrix
+        camera_pos (np.ndarray): camera position in world coordinates
+
+    Returns:
+        np.ndarray: float32 array of FRAME_DATA_SIZE bytes
     """
-    loc = glGetUniformLocation(shaders, uniform.name)
-    assert loc != -1, f"Uniform {uniform.name} not found in shaders {shaders}"
-    if uniform.type == "int":
-        glUniform1i(loc, uniform.value)
-    elif uniform.type == "float":
-        glUniform1f(loc, uniform.value)
-    elif uniform.type == "vec3":
-        glUniform3f(loc, *uniform.value)
-    elif uniform.type == "mat3":
-        glUniformMatrix3fv(
-            loc,  # location
-            1,  # count
-            GL_FALSE,  # transpose
-            uniform.value,  # value
-        )
-    elif uniform.type == "mat4":
-        glUniformMatrix4fv(
-            loc,  # location
-            1,  # count
-            GL_FALSE,  # transpose
-            uniform.value,  # value
-        )
+    data = np.zeros(FRAME_DATA_SIZE // 4, dtype=np.float32)
+    data[0:16] = p.T.ravel()  # column major
+    data[16:32] = v.T.ravel()
+    # vec3 members are 16 byte aligned, the following float fills the gap
+    data[32:35] = camera_pos
+    data[35] = AMBIENT_STRENGTH
+    data[36:39] = AMBIENT_COLOR
+    data[39] = SPECULAR_STRENGTH
+    data[40:43] = DIFFUSE_POS
+    data[43] = SPECULAR_SHININESS
+    data[44:47] = DIFFUSE_COLOR
+    return data
 
 
-def draw(render_object: RenderObject, dynamic_uniforms: List[Uniform] = None):
-    """draw a render object on the screen
+def camera_state(camera: Camera):
+    """snapshot of all camera parameters, used to detect camera changes
+
+    Args:
+        camera (Camera): camera struct
+
+    Returns:
+        tuple: hashable camera parameters
+    """
+    return (*camera.center.tolist(), camera.psi, camera.phi, camera.distance)
+
+
+def draw(
+    render_object: RenderObject,
+    dynamic_uniforms: List[Uniform] = None,
+    stats: FrameStats = None,
+    depth_program: int = None,
+):
+    """draw a render object on the screen,
+    program, textures and vao are only bound if they differ from the bound ones
+    and stay bound afterwards
 
     Args:
         render_object (RenderObject): the render object to be drawn
         dynamic_uniforms (List[Uniform], optional): a list of additional uniforms to set. Defaults to None.
+        stats (FrameStats, optional): frame stats counting the skipped binds. Defaults to None.
+        depth_program (int, optional): depth only program to draw the geometry with, static uniforms and textures are skipped. Defaults to None.
     """
     # bind shaders
-    glUseProgram(render_object.shaders)
+    program = render_object.shaders if depth_program is None else depth_program
+    use_program(program, stats)
 
     # set uniforms
-    if render_object.static_uniforms is not None:
+    if render_object.static_uniforms is not None and depth_program is None:
         for uniform in render_object.static_uniforms:
-            set_uniform(uniform, render_object.shaders)
+            set_uniform(uniform, program)
     if dynamic_uniforms is not None:
         for uniform in dynamic_uniforms:
-            set_uniform(uniform, render_object.shaders)
+            set_uniform(uniform, program)
 
     # bind textures if needed
-    if render_object.textures is not None:
+    if render_object.textures is not None and depth_program is None:
         for texture in render_object.textures:
-            glActiveTexture(texture.unit)
-            glBindTexture(texture.type, texture.id)
+            bind_texture(texture, stats)
+
+    # bind vao, objects in a geometry arena share one
+    bind_vertex_array(render_object.vao, stats)
 
-    # bind vao
-    glBindVertexArray(render_object.vao)
+    # 16 bit indices for meshes with few vertices, levels of detail and chunks alike
+    faces = render_object.model.faces
+    index_size = faces.itemsize if faces is not None else 4
 
-    # draw
-    if render_object.model.faces is not None:
-        glDrawElements(
+    # draw all resident chunks with one call
+    if render_object.draw_ranges is not None:
+        ranges = render_object.draw_ranges
+        if len(ranges) > 0:
+            glMultiDrawElementsBaseVertex(
+                GL_TRIANGLES,  # mode
+                ranges[:, 2].astype(np.int32),  # counts
+                INDEX_TYPES[index_size],  # type
+                (ctypes.c_void_p * len(ranges))(
+                    *(ranges[:, 1] * index_size).tolist()
+                ),  # indices
+                len(ranges),  # draw count
+                ranges[:, 0].astype(np.int32),  # base vertices
+            )
+        return
+
+    # draw the selected level of detail
+    base_vertex, count = render_object.base_vertex, None
+    if render_object.lod_ranges is not None:
+        base_vertex, first_index, count = render_object.lod_ranges[
+            render_object.lod
+        ].tolist()
+        indices = ctypes.c_void_p(first_index * index_size)  # byte offset
+    elif faces is not None:
+        count = faces.size
+        indices = ctypes.c_void_p(render_object.first_index * index_size)
+    if render_object.instances is not None:
+        glDrawElementsInstancedBaseVertex(
+            GL_TRIANGLES,  # mode
+            count,  # count
+            INDEX_TYPES[index_size],  # type
+            indices,  # indices
+            render_object.instances.shape[0],  # instance count
+            base_vertex,  # base vertex
+        )
+    elif count is not None:
+        glDrawElementsBaseVertex(
             GL_TRIANGLES,  # mode
-            render_object.model.faces.size,  # count
-            GL_UNSIGNED_INT,  # type
-            None,  # indices
+            count,  # count
+            INDEX_TYPES[index_size],  # type
+            indices,  # indices
+            base_vertex,  # base vertex
         )
     else:
         glDrawArrays(
             GL_TRIANGLES,  # mode
-            0,  # first
+            render_object.base_vertex,  # first
             render_object.model.vertices.shape[0],  # count
         )
 
-    # unbind vao
-    glBindVertexArray(0)
 
-    # unbind textures if needed
-    if render_object.textures is not None:
-        for texture in render_object.textures:
-            glBindTexture(texture.type, 0)
+def draw_transformed(
+    render_object: RenderObject,
+    transforms: TransformStage,
+    index: int,
+    stats: FrameStats = None,
+    depth_program: int = None,
+):
+    """draw a normal object with the transforms of the frame
+
+    Args:
+        render_object (RenderObject): the render object to be drawn
+        transforms (TransformStage): transforms of the frame
+        index (int): index of the object in the object list
+        stats (FrameStats, optional): frame stats counting the skipped binds. Defaults to None.
+        depth_program (int, optional): depth only program for a depth pre-pass. Defaults to None.
+    """
+    if render_object.instances is not None:
+        # model and normal matrices come from the instance vbo
+        draw(render_object, stats=stats, depth_program=depth_program)
+        return
+    dynamic_uniforms = [Uniform(name="M", value=transforms.gl_ms[index], type="mat4")]
+    if depth_program is None:
+        dynamic_uniforms.append(
+            Uniform(
+                name="normal_matrix",
+                value=transforms.gl_normal_matrices[index],
+                type="mat3",
+            )
+        )
+    draw(render_object, dynamic_uniforms, stats, depth_program)
+
+
+def check_render_object(render_object: RenderObject, dynamic_names: List[str]):
+    """make sure all uniforms a render object will set exist in its shaders
+
+    Args:
+        render_object (RenderObject): render object to check
+        dynamic_names (List[str]): names of the uniforms set by the render loop
+    """
+    names = list(dynamic_names)
+    if render_object.static_uniforms is not None:
+        names += [u.name for u in render_object.static_uniforms]
+    check_uniforms(render_object.shaders, names)
+
+
+@dataclass
+class RenderState:
+    objects: List[RenderObject]
+    skybox: RenderObject
+    p: np.ndarray
+    frame_ubo: int
+    transforms: TransformStage
+    queue: RenderQueue
+    lod_objects: np.ndarray  # indices of the objects with levels of detail
+    chunked_objects: np.ndarray  # indices of the objects streamed in chunks
+    camera_state: tuple = None  # camera parameters of the last uploaded frame data
+    pv: np.ndarray = None
+    camera_pos: np.ndarray = None
+    indirect: IndirectRenderer = None  # submits the objects using the indirect program
+    streamer: TextureStreamer = None  # advanced once per frame
+    # depth only program per object if the frame starts with a depth pre-pass
+    depth_programs: List[int] = None
+    # two queries counting the fragments shaded by the object pass, used alternately
+    samples_queries: np.ndarray = None
+    samples_pending: np.ndarray = None  # query issued, result not read yet
+    samples_index: int = 0  # query of the current frame
+    occlusion: OcclusionCuller = None  # skips objects hidden behind others
+    # N bools, objects drawn one by one instead of by the indirect renderer
+    direct_mask: np.ndarray = None
+    # indices of the directly drawn objects in queue order and front to back
+    direct_order: np.ndarray = None
+    direct_front_to_back: np.ndarray = None
+    # N submitted triangles per object at the current level of detail
+    triangle_counts: np.ndarray = None
+
+
+def sort_direct(state: RenderState):
+    """restrict the queue orders to the directly drawn objects,
+    needed whenever the queue was sorted
+
+    Args:
+        state (RenderState): render state
+    """
+    order, front_to_back = state.queue.order, state.queue.front_to_back
+    state.direct_order = order[state.direct_mask[order]]
+    state.direct_front_to_back = front_to_back[state.direct_mask[front_to_back]]
+
+
+def prepare_render(
+    p: np.ndarray,
+    objects: List[RenderObject],
+    skybox: RenderObject,
+    frame_ubo: int,
+    indirect_shaders: ShaderVariants = None,
+    streamer: TextureStreamer = None,
+    depth_prepass: bool = False,
+    count_samples: bool = False,
+    occlusion_culling: bool = False,
+):
+    """check the render objects and set up the per frame caches
+
+    Args:
+        p (np.ndarray): projection matrix
+        objects (List[RenderObject]): the list of normal objects to be drawn
+        skybox (RenderObject): sky box render object
+        frame_ubo (int): uniform buffer bound to the FrameData block of all programs
+        indirect_shaders (ShaderVariants, optional): variants whose objects are submitted with multi draw indirect. Defaults to None.
+        streamer (TextureStreamer, optional): texture streamer to advance every frame. Defaults to None.
+        depth_prepass (bool, optional): lay down depth first, then shade each pixel once with GL_EQUAL. Defaults to False.
+        count_samples (bool, optional): count the shaded fragments of the object pass in FrameStats.shaded_samples (one or two frames late, 0 while no result is available). Defaults to False.
+        occlusion_culling (bool, optional): skip objects whose bounding box was occluded in the previous frames. Defaults to False.
+
+    Returns:
+        RenderState: state to be passed to render_frame
+    """
+    for render_object in objects:
+        if indirect_shaders is not None and render_object.shaders in indirect_shaders:
+            assert (
+                render_object.chunks is None
+            ), "Chunked objects can not use the indirect program"
+            check_render_object(render_object, INDIRECT_DYNAMIC_UNIFORMS)
+        elif render_object.instances is not None:
+            check_render_object(render_object, INSTANCED_DYNAMIC_UNIFORMS)
+        else:
+            check_render_object(render_object, OBJECT_DYNAMIC_UNIFORMS)
+    check_render_object(skybox, SKYBOX_DYNAMIC_UNIFORMS)
+    indirect = (
+        IndirectRenderer(objects, indirect_shaders)
+        if indirect_shaders is not None
+        else None
+    )
+    state = RenderState(
+        objects=objects,
+        skybox=skybox,
+        p=p,
+        frame_ubo=frame_ubo,
+        transforms=TransformStage(objects),
+        queue=RenderQueue(objects),
+        lod_objects=np.array(
+            [i for i, o in enumerate(objects) if o.lod_ranges is not None],
+            dtype=np.int64,
+        ),
+        chunked_objects=np.array(
+            [i for i, o in enumerate(objects) if o.chunks is not None],
+            dtype=np.int64,
+        ),
+        indirect=indirect,
+        streamer=streamer,
+        # compiled here instead of in the first frame
+        depth_programs=(
+            [depth_only_program(o.shaders) for o in objects] if depth_prepass else None
+        ),
+        samples_queries=np.atleast_1d(glGenQueries(2)) if count_samples else None,
+        samples_pending=np.zeros(2, dtype=bool),
+        occlusion=OcclusionCuller(len(objects), p) if occlusion_culling else None,
+        direct_mask=(
+            ~indirect.objects_mask
+            if indirect is not None
+            else np.ones(len(objects), dtype=bool)
+        ),
+        # levels of detail and chunks are counted once selected
+        triangle_counts=np.array(
+            [
+                (
+                    o.model.faces.shape[0]
+                    if o.model.faces is not None and o.chunks is None
+                    else 0
+                )
+                for o in objects
+            ],
+            dtype=np.int64,
+        ),
+    )
+    sort_direct(state)
+    return state
+
+
+def render_frame(state: RenderState, camera: Camera, animation_active: bool):
+    """render one frame into the currently bound framebuffer
+
+    Args:
+        state (RenderState): state created by prepare_render
+        camera (Camera): camera struct
+        animation_active (bool): whether to advance object animations
+
+    Returns:
+        FrameStats: statistics of the frame
+    """
+    objects, skybox, transforms = state.objects, state.skybox, state.transforms
+    stats = FrameStats()
+
+    # issue this frame's share of texture uploads
+    if state.streamer is not None:
+        state.streamer.update(stats)
+    reset_bound_state()  # setup code and the streamer may have bound other gl objects
+
+    # clear color and depth buffers
+    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+
+    # recompute view dependent data only when the camera moved
+    cam_state = camera_state(camera)
+    camera_moved = cam_state != state.camera_state
+    if camera_moved:
+        state.camera_state = cam_state
+        v = V(camera)
+        state.pv = state.p @ v
+        state.camera_pos = camera_position(camera)
+        update_uniform_buffer(state.frame_ubo, frame_data(state.p, v, state.camera_pos))
+
+    # run animations and update the transforms of changed objects
+    if animation_active:
+        for render_object in objects:
+            if render_object.animation_function is not None:
+                render_object.model = render_object.animation_function(
+                    render_object.model
+                )
+    dirty = transforms.update(state.pv)
+    for i in dirty:
+        if objects[i].instances is not None:
+            update_instance_vbo(
+                objects[i].instance_vbo,
+                objects[i].model.m @ objects[i].instances,
+            )
+
+    # objects are drawn in state sorted order, only resorted when the depths changed,
+    # levels of detail only change with the screen sizes
+    if camera_moved or dirty:
+        state.queue.sort(transforms, state.camera_pos)
+        sort_direct(state)
+        lods = select_lods(
+            transforms.screen_sizes[state.lod_objects],
+            np.array([len(objects[i].lod_ranges) for i in state.lod_objects]),
+        )
+        for i, lod in zip(state.lod_objects, lods.tolist()):
+            objects[i].lod = lod
+            state.triangle_counts[i] = objects[i].lod_ranges[lod, 2] // 3
+
+    # stream the chunks of out of core meshes, every frame to keep the lru order current
+    for i in state.chunked_objects:
+        if transforms.visible[i]:
+            objects[i].draw_ranges = objects[i].chunks.update(
+                transforms.pvms[i], transforms.ms[i], state.camera_pos, stats
+            )
+            state.triangle_counts[i] = objects[i].draw_ranges[:, 2].sum() // 3
+
+    # samples of earlier frames, only read once available so the cpu never waits,
+    # the query of the previous frame is checked first, then the one before
+    if state.samples_queries is not None:
+        read = False
+        for k in (1 - state.samples_index, state.samples_index):
+            query = state.samples_queries[k]
+            if not state.samples_pending[k] or not glGetQueryObjectuiv(
+                query, GL_QUERY_RESULT_AVAILABLE
+            ):
+                continue
+            state.samples_pending[k] = False
+            samples = glGetQueryObjectuiv(query, GL_QUERY_RESULT)
+            if not read:
+                stats.shaded_samples = samples
+                read = True
+
+    # occlusion results of earlier frames, only read once available
+    hidden = None
+    if state.occlusion is not None:
+        state.occlusion.read_results()
+        hidden = state.occlusion.hidden
+
+    # objects inside the view frustum, the indirect ones are submitted in batches
+    drawn = transforms.visible
+    if hidden is not None:
+        drawn = drawn & ~hidden
+        stats.occlusion_culled = int(np.count_nonzero(transforms.visible & hidden))
+    stats.culled = len(objects) - int(np.count_nonzero(transforms.visible))
+    stats.drawn = int(np.count_nonzero(drawn))
+    stats.triangles = int(state.triangle_counts[drawn].sum())
+    direct = state.direct_order[drawn[state.direct_order]].tolist()
+
+    # depth pre-pass front to back, then every pixel is shaded once by the surface
+    # whose depth is in the buffer
+    if state.depth_programs is not None:
+        glColorMask(GL_FALSE, GL_FALSE, GL_FALSE, GL_FALSE)
+        order = state.direct_front_to_back
+        for i in order[drawn[order]].tolist():
+            draw_transformed(objects[i], transforms, i, stats, state.depth_programs[i])
+        if state.indirect is not None:
+            state.indirect.submit(transforms, dirty, stats, True, hidden)
+            dirty = []  # draw data is uploaded
+        glColorMask(GL_TRUE, GL_TRUE, GL_TRUE, GL_TRUE)
+        glDepthFunc(GL_EQUAL)
+        glDepthMask(GL_FALSE)
+
+    # set dynamic uniforms, draw objects in state sorted order
+    if state.samples_queries is not None:
+        glBeginQuery(GL_SAMPLES_PASSED, state.samples_queries[state.samples_index])
+    for i in direct:
+        draw_transformed(objects[i], transforms, i, stats)
+    if state.indirect is not None:
+        state.indirect.submit(transforms, dirty, stats, hidden=hidden)
+    if state.samples_queries is not None:
+        glEndQuery(GL_SAMPLES_PASSED)
+        state.samples_pending[state.samples_index] = True
+        state.samples_index = 1 - state.samples_index
+    if state.depth_programs is not None:
+        glDepthMask(GL_TRUE)
+        glDepthFunc(GL_LESS)
+
+    # test the bounding boxes against the finished depth buffer, read next frame
+    if state.occlusion is not None:
+        state.occlusion.issue(transforms, state.camera_pos, stats)
+
+    # draw skybox
+    # no idea why you would want to draw the skybox when
+    # there's an object with z = 1.0 in NDC,
+    # but people seem to do it that way
+    glDepthFunc(GL_LEQUAL)
+    skybox_model_matrix_uniform = Uniform(
+        name="M", value=np_matrix_to_opengl(skybox.model.m), type="mat4"
+    )
+    draw(skybox, dynamic_uniforms=[skybox_model_matrix_uniform], stats=stats)
+    glDepthFunc(GL_LESS)
+    return stats
 
 
 def render_loop(
@@ -102,6 +501,11 @@ def render_loop(
     p: np.ndarray,
     objects: List[RenderObject],
     skybox: RenderObject,
+    frame_ubo: int,
+    indirect_shaders: ShaderVariants = None,
+    streamer: TextureStreamer = None,
+    depth_prepass: bool = False,
+    occlusion_culling: bool = False,
 ):
     """main render loop
 
@@ -111,7 +515,25 @@ def render_loop(
         p (np.ndarray): projection matrix
         objects (List[RenderObject]): the list of normal objects to be drawn
         skybox (RenderObject): sky box render object
+        frame_ubo (int): uniform buffer bound to the FrameData block of all programs
+        indirect_shaders (ShaderVariants, optional): variants whose objects are submitted with multi draw indirect. Defaults to None.
+        streamer (TextureStreamer, optional): texture streamer to advance every frame. Defaults to None.
+        depth_prepass (bool, optional): render a depth pre-pass before shading. Defaults to False.
+        occlusion_culling (bool, optional): skip objects occluded by others. Defaults to False.
     """
+    state = prepare_render(
+        p,
+        objects,
+        skybox,
+        frame_ubo,
+        indirect_shaders,
+        streamer,
+        depth_prepass,
+        occlusion_culling=occlusion_culling,
+    )
+    prev_stats = None
+    caption, _ = pygame.display.get_caption()
+
     running = True
     mouse_mvt = None
     animation_active = False
@@ -125,58 +547,27 @@ def render_loop(
             prev_animation_active=animation_active,
         )
 
-        # clear color and depth buffers
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        stats = render_frame(state, camera, animation_active)
 
-        # compute and set dynamic uniforms, draw objects
-        camera_pos_uniform = Uniform(
-            name="camera_position",
-            value=camera_position(camera).tolist(),
-            type="vec3",
-        )
-        for render_object in objects:
-            if animation_active and render_object.animation_function is not None:
-                render_object.model = render_object.animation_function(
-                    render_object.model
-                )
-            pvm_uniform = Uniform(
-                name="PVM",
-                value=np_matrix_to_opengl(p @ V(camera) @ render_object.model.m),
-                type="mat4",
-            )
-            model_matrix_uniform = Uniform(
-                name="M", value=np_matrix_to_opengl(render_object.model.m), type="mat4"
-            )
-            normal_matrix_uniform = Uniform(
-                name="normal_matrix",
-                value=np_matrix_to_opengl(
-                    normal_from_model_matrix(render_object.model.m)
-                ),
-                type="mat3",
+        # report frame stats in the window title
+        if stats != prev_stats:
+            prev_stats = stats
+            skipped = (
+                stats.program_binds_skipped
+                + stats.vao_binds_skipped
+                + stats.texture_binds_skipped
             )
-            draw(
-                render_object,
-                dynamic_uniforms=[
-                    pvm_uniform,
-                    camera_pos_uniform,
-                    model_matrix_uniform,
-                    normal_matrix_uniform,
-                ],
+            pygame.display.set_caption(
+                f"{caption} (drawn: {stats.drawn}, culled: {stats.culled},"
+                f" occluded: {stats.occlusion_culled},"
+                f" binds skipped: {skipped})"
             )
 
-        # draw skybox
-        # no idea why you would want to draw the skybox when
-        # there's an object with z = 1.0 in NDC,
-        # but people seem to do it that way
-        glDepthFunc(GL_LEQUAL)
-        skybox_pvm_uniform = Uniform(
-            name="PVM",
-            value=np_matrix_to_opengl(p @ V_no_translation(camera) @ skybox.model.m),
-            type="mat4",
-        )
-        draw(skybox, dynamic_uniforms=[skybox_pvm_uniform])
-        glDepthFunc(GL_LESS)
-
         # update display and limit to 60 fps
         pygame.display.flip()
         clock.tick(60)
+
+    if state.indirect is not None:
+        state.indirect.destroy()
+    if state.occlusion is not None:
+        state.occlusion.destroy()
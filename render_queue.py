@@ -0,0 +1,114 @@
+import numpy as np
+from typing import List
+
+from structs import RenderObject
+from transforms import TransformStage
+
+# bit layout of the 64 bit sort key, most significant first:
+# program | texture set | vao | depth
+PROGRAM_BITS = 8
+TEXTURES_BITS = 12
+VAO_BITS = 12
+DEPTH_BITS = 32
+
+
+def texture_set(render_object: RenderObject):
+    """hashable description of the textures a render object binds
+
+    Args:
+        render_object (RenderObject): render object
+
+    Returns:
+        tuple: sorted (unit, type, id) triples
+    """
+    return tuple(
+        sorted(
+            (int(t.unit), int(t.type), int(t.id)) for t in render_object.textures or []
+        )
+    )
+
+
+def ranks(values: list):
+    """replace every value by its index in the sorted distinct values,
+    keeps the state ids small enough to be packed into the sort key
+
+    Args:
+        values (list): hashable and orderable values
+
+    Returns:
+        np.ndarray: uint64 rank of each value
+    """
+    distinct = {v: i for i, v in enumerate(sorted(set(values)))}
+    return np.array([distinct[v] for v in values], dtype=np.uint64)
+
+
+def state_keys(objects: List[RenderObject]):
+    """pack the gl state of each object into the high bits of its sort key,
+    objects with equal keys can be drawn without any program, texture or vao switch
+
+    Args:
+        objects (List[RenderObject]): render objects
+
+    Returns:
+        np.ndarray: uint64 keys, the depth bits are zero
+    """
+    programs = ranks([int(o.shaders) for o in objects])
+    textures = ranks([texture_set(o) for o in objects])
+    vaos = ranks([int(o.vao) for o in objects])
+    assert programs.max(initial=0) < 1 << PROGRAM_BITS, "Too many programs"
+    assert textures.max(initial=0) < 1 << TEXTURES_BITS, "Too many texture sets"
+    assert vaos.max(initial=0) < 1 << VAO_BITS, "Too many vaos"
+    return (
+        programs << np.uint64(TEXTURES_BITS + VAO_BITS + DEPTH_BITS)
+        | textures << np.uint64(VAO_BITS + DEPTH_BITS)
+        | vaos << np.uint64(DEPTH_BITS)
+    )
+
+
+def depth_keys(world_bounding_boxes: np.ndarray, camera_pos: np.ndarray):
+    """quantize the camera distance of the bounding box centers,
+    the nearest object gets the smallest key (front to back)
+
+    Args:
+        world_bounding_boxes (np.ndarray): N x 2 x 3 world space bounding boxes
+        camera_pos (np.ndarray): camera position in world coordinates
+
+    Returns:
+        np.ndarray: uint64 keys below 2^DEPTH_BITS
+    """
+    centers = world_bounding_boxes.mean(axis=1)
+    distances = np.linalg.norm(centers - camera_pos, axis=1)
+    far = distances.max(initial=0.0)
+    if far <= 0.0:
+        return np.zeros(len(distances), dtype=np.uint64)
+    scale = ((1 << DEPTH_BITS) - 1) / far
+    return (distances * scale).astype(np.uint64)
+
+
+class RenderQueue:
+    """draw order of a fixed list of opaque render objects,
+    sorted by program, texture set, vao and then front to back,
+    so consecutive draws share as much gl state as possible
+    and the depth test rejects hidden fragments early
+    """
+
+    def __init__(self, objects: List[RenderObject]):
+        self.state_keys = state_keys(objects)
+        self.order = np.argsort(self.state_keys, kind="stable")
+        # nearest first regardless of state, for depth only passes
+        self.front_to_back = np.arange(len(objects))
+
+    def sort(self, transforms: TransformStage, camera_pos: np.ndarray):
+        """recompute the draw order, only needed when the camera or a transform changed
+
+        Args:
+            transforms (TransformStage): up to date transforms of the frame
+            camera_pos (np.ndarray): camera position in world coordinates
+
+        Returns:
+            np.ndarray: object indices in draw order
+        """
+        depths = depth_keys(transforms.world_bounding_boxes, camera_pos)
+        self.order = np.argsort(self.state_keys | depths, kind="stable")
+        self.front_to_back = np.argsort(depths, kind="stable")
+        return self.order
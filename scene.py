@@ -0,0 +1,266 @@
+import trimesh
+import numpy as np
+import hashlib
+import shutil
+from typing import List, Literal
+
+from dataload import (
+    MODEL_CACHE_DIR,
+    MODEL_CACHE_VERSION,
+    hash_source_files,
+    mesh_to_model,
+    new_cache_entry,
+    pillow_to_opengl_rgba,
+)
+from meshopt import optimize_model
+from geometry import bounding_box_corners, translation
+from structs import Model, SceneGraph, SceneNode
+
+# nodes of a cached scene in depth first order, parents before their children
+NODE_DTYPE = np.dtype(
+    [("name", "U64"), ("parent", "i4"), ("mesh", "i4"), ("local", "f4", (4, 4))]
+)
+MESH_ARRAYS = [
+    "vertices",
+    "faces",
+    "normals",
+    "colors",
+    "texture_coords",
+    "uniform_color",
+    "acmr",
+]
+
+
+def walk_scene(node: SceneNode, transform: np.ndarray = None):
+    """iterate a scene graph depth first
+
+    Args:
+        node (SceneNode): root of the (sub) graph
+        transform (np.ndarray, optional): transform of the parent of node. Defaults to identity.
+
+    Yields:
+        Tuple[SceneNode, np.ndarray]: (node, transform from node to scene coordinates)
+    """
+    transform = node.local if transform is None else transform @ node.local
+    yield node, transform
+    for child in node.children:
+        yield from walk_scene(child, transform)
+
+
+def scene_nodes(scene: trimesh.Scene, exclude_nodes: List[str] = None):
+    """read the node hierarchy of a trimesh scene
+
+    Args:
+        scene (trimesh.Scene): scene
+        exclude_nodes (List[str], optional): names of nodes to drop together with their children. Defaults to None.
+
+    Returns:
+        SceneNode: root node, mesh holds the trimesh geometry name for now
+    """
+    children = {}
+    for parent, child, attributes in scene.graph.to_edgelist():
+        children.setdefault(parent, []).append((child, attributes))
+
+    def build(name, attributes):
+        node = SceneNode(
+            name=str(name),
+            local=np.asarray(attributes.get("matrix", np.eye(4)), dtype=np.float64),
+            mesh=attributes.get("geometry"),
+        )
+        for child, child_attributes in children.get(name, []):
+            if child not in (exclude_nodes or []):
+                node.children.append(build(child, child_attributes))
+        return node
+
+    return build(scene.graph.base_frame, {})
+
+
+def load_scene(
+    path: str,
+    m: np.ndarray,
+    texture: Literal["none", "base_color"] = "none",
+    exclude_nodes: List[str] = None,
+    cache: bool = True,
+):
+    """load a model file as scene graph instead of flattening it into one mesh,
+    geometry referenced by several nodes is loaded once
+
+    Args:
+        path (str): path to model file
+        m (np.ndarray): model matrix of the whole scene
+        texture (Literal["none", "base_color"], optional): the texture mode to use, untextured meshes get their material color. Defaults to "none".
+        exclude_nodes (List[str], optional): names of nodes to drop together with their children. Defaults to None.
+        cache (bool, optional): use the on disk model cache. Defaults to True.
+
+    Returns:
+        SceneGraph: scene graph
+    """
+    key = None
+    if cache:
+        h = hashlib.sha256()
+        h.update(repr((MODEL_CACHE_VERSION, "scene", texture, exclude_nodes)).encode())
+        hash_source_files(h, path)
+        key = h.hexdigest()
+        cached = load_cached_scene(key, m)
+        if cached is not None:
+            return cached
+
+    scene = trimesh.load(path, force="scene")
+    root = scene_nodes(scene, exclude_nodes)
+
+    # one model per distinct geometry, in mesh coordinates
+    meshes, mesh_textures, textures = [], [], []
+    mesh_indices, texture_indices = {}, {}
+    for node, _ in walk_scene(root):
+        if node.mesh is None:
+            continue
+        if node.mesh not in mesh_indices:
+            mesh = scene.geometry[node.mesh]
+            # normalized to [-1, 1] for the snorm16 vertex positions,
+            # m maps the normalized mesh back to mesh coordinates
+            mi, ma = mesh.bounds
+            center = (ma + mi) / 2
+            scale = max(((ma - mi) / 2).max(), np.finfo(np.float32).tiny)
+            model = optimize_model(
+                mesh_to_model(
+                    mesh, m=translation(center) @ np.diag([scale] * 3 + [1.0])
+                )
+            )
+            material = getattr(mesh.visual, "material", None)
+            image = getattr(material, "baseColorTexture", None)
+            texture_index = None
+            if texture == "base_color" and image is not None:
+                img = pillow_to_opengl_rgba(image)
+                digest = hashlib.sha256(img.tobytes()).hexdigest()
+                if digest not in texture_indices:
+                    texture_indices[digest] = len(textures)
+                    textures.append(img)
+                texture_index = texture_indices[digest]
+            else:
+                color = getattr(material, "main_color", [255, 255, 255, 255])
+                model.uniform_color = (np.asarray(color) / 255.0).astype(np.float32)
+            mesh_indices[node.mesh] = len(meshes)
+            meshes.append(model)
+            mesh_textures.append(texture_index)
+        node.mesh = mesh_indices[node.mesh]
+
+    # center the scene at the origin and scale it to [-1, 1] in the root transform
+    boxes = np.concatenate(
+        [
+            bounding_box_corners(meshes[node.mesh].bounding_box[None])[0]
+            @ (transform @ meshes[node.mesh].m)[:3, :3].T
+            + (transform @ meshes[node.mesh].m)[:3, 3]
+            for node, transform in walk_scene(root)
+            if node.mesh is not None
+        ]
+    )
+    mi, ma = boxes.min(axis=0), boxes.max(axis=0)
+    center = (ma + mi) / 2
+    scale = max(((ma - mi) / 2).max(), np.finfo(np.float32).tiny)
+    root.local = np.diag([1 / scale] * 3 + [1.0]) @ translation(-center) @ root.local
+
+    graph = SceneGraph(
+        root=root,
+        meshes=meshes,
+        textures=textures,
+        mesh_textures=mesh_textures,
+        bounding_box=((np.stack([mi, ma]) - center) / scale).astype(np.float32),
+        m=m,
+    )
+    if key is not None:
+        store_cached_scene(key, graph)
+    return graph
+
+
+def store_cached_scene(key: str, graph: SceneGraph):
+    """write a scene graph to the model cache
+
+    Args:
+        key (str): cache key
+        graph (SceneGraph): scene graph
+    """
+    nodes = []
+
+    def flatten(node, parent):
+        index = len(nodes)
+        mesh = -1 if node.mesh is None else node.mesh
+        nodes.append((node.name, parent, mesh, node.local))
+        for child in node.children:
+            flatten(child, index)
+
+    flatten(graph.root, -1)
+    arrays = {
+        "nodes": np.array(nodes, dtype=NODE_DTYPE),
+        "mesh_textures": np.array(
+            [-1 if t is None else t for t in graph.mesh_textures], dtype=np.int32
+        ),
+        "bounding_box": graph.bounding_box,
+    }
+    for i, mesh in enumerate(graph.meshes):
+        for name in MESH_ARRAYS:
+            arrays[f"mesh{i}_{name}"] = getattr(mesh, name)
+        arrays[f"mesh{i}_bounding_box"] = mesh.bounding_box
+        arrays[f"mesh{i}_m"] = mesh.m
+    for i, img in enumerate(graph.textures):
+        arrays[f"texture{i}"] = img
+    # write to a temporary directory first so readers never see partial entries
+    tmp_dir = new_cache_entry(key)
+    try:
+        for name, array in arrays.items():
+            if array is not None:
+                np.save(tmp_dir / f"{name}.npy", np.ascontiguousarray(array))
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)  # e.g. disk full or interrupted
+        raise
+    try:
+        tmp_dir.rename(MODEL_CACHE_DIR / key)
+    except OSError:
+        shutil.rmtree(tmp_dir)  # written concurrently by someone else
+
+
+def load_cached_scene(key: str, m: np.ndarray):
+    """load a scene graph from the model cache, arrays are memory mapped
+
+    Args:
+        key (str): cache key
+        m (np.ndarray): model matrix of the whole scene
+
+    Returns:
+        SceneGraph: scene graph or None if not cached
+    """
+    cache_dir = MODEL_CACHE_DIR / key
+    if not cache_dir.is_dir():
+        return None
+
+    def load(name):
+        file = cache_dir / f"{name}.npy"
+        return np.load(file, mmap_mode="r") if file.exists() else None
+
+    nodes = []
+    for name, parent, mesh, local in np.load(cache_dir / "nodes.npy").tolist():
+        node = SceneNode(
+            name=name, local=np.array(local), mesh=None if mesh < 0 else mesh
+        )
+        if parent >= 0:
+            nodes[parent].children.append(node)
+        nodes.append(node)
+    mesh_textures = [None if t < 0 else t for t in load("mesh_textures").tolist()]
+    meshes = [
+        Model(
+            **{name: load(f"mesh{i}_{name}") for name in MESH_ARRAYS},
+            bounding_box=np.array(load(f"mesh{i}_bounding_box")),
+            m=np.array(load(f"mesh{i}_m")),
+        )
+        for i in range(len(mesh_textures))
+    ]
+    textures = []
+    while (cache_dir / f"texture{len(textures)}.npy").exists():
+        textures.append(load(f"texture{len(textures)}"))
+    return SceneGraph(
+        root=nodes[0],
+        meshes=meshes,
+        textures=textures,
+        mesh_textures=mesh_textures,
+        bounding_box=np.array(load("bounding_box")),
+        m=m,
+    )
@@ -1,7 +1,196 @@
+import hashlib
+import os
+import struct
+import uuid
+import numpy as np
 from pathlib import Path
+from typing import Dict, FrozenSet, Iterable
 from OpenGL.GL import shaders as gl_shaders
 from OpenGL.GL import *
 from OpenGL.GL.ARB import separate_shader_objects, get_program_binary
+from OpenGL.error import GLError
+
+# std140 uniform block with per frame camera and light data (see shaders/*/vertex_shader.glsl)
+FRAME_DATA_BLOCK = "FrameData"
+FRAME_DATA_BINDING = 0
+FRAME_DATA_SIZE = 192  # bytes: P, V, 4 x (vec3 + float)
+
+# attribute locations bound before linking, the same for all programs,
+# so a vao can be used with any program (matrices take one location per column)
+ATTRIBUTE_LOCATIONS = {
+    "position": 0,
+    "normal": 1,
+    "texture_coord": 2,
+    "color": 3,
+    "instance_model_matrix": 4,
+    "instance_normal_matrix": 8,
+    "draw_id": 11,
+}
+
+# shader storage buffer binding of the per draw data of indirect draws
+# (fixed in shaders/object/indirect_vertex_shader.glsl)
+DRAW_DATA_BINDING = 0
+
+# uniform name -> location, per linked shader program
+UNIFORM_LOCATIONS: Dict[int, Dict[str, int]] = {}
+
+# linked program binaries keyed by shader sources and driver, one file per key:
+# uint32 binary format followed by the glGetProgramBinary output
+PROGRAM_CACHE_DIR = Path(".cache") / "programs"
+PROGRAM_CACHE_VERSION = 1  # bump when the program setup before linking changes
+
+
+def reflect_uniforms(program: int):
+    """query all active uniforms of a linked program and register their locations,
+    array uniforms are registered under their base name as well
+
+    Args:
+        program (int): linked shader program
+
+    Returns:
+        Dict[str, int]: uniform name -> location
+    """
+    locations = {}
+    for index in range(glGetProgramiv(program, GL_ACTIVE_UNIFORMS)):
+        name, _, _ = glGetActiveUniform(program, index)
+        if isinstance(name, bytes):
+            name = name.decode()
+        loc = glGetUniformLocation(program, name)
+        if loc == -1:
+            continue  # uniform block members and builtins have no location
+        locations[name] = loc
+        if name.endswith("[0]"):
+            locations[name[:-3]] = loc
+    UNIFORM_LOCATIONS[int(program)] = locations
+    return locations
+
+
+def uniform_location(program: int, name: str):
+    """look up the location of an active uniform,
+    the program must have been registered with reflect_uniforms
+
+    Args:
+        program (int): shader program
+        name (str): uniform name
+
+    Returns:
+        int: uniform location
+    """
+    return UNIFORM_LOCATIONS[int(program)][name]
+
+
+def check_uniforms(program: int, names: Iterable[str]):
+    """make sure all given uniform names are active in a program,
+    meant to be called once during setup instead of in the frame loop
+
+    Args:
+        program (int): shader program
+        names (Iterable[str]): uniform names
+    """
+    assert int(program) in UNIFORM_LOCATIONS, f"Shaders {program} were not reflected"
+    missing = [n for n in names if n not in UNIFORM_LOCATIONS[int(program)]]
+    assert not missing, f"Uniforms {missing} not found in shaders {program}"
+
+
+def bind_uniform_block(program: int, block_name: str, binding: int):
+    """attach a uniform block of a program to a uniform buffer binding point,
+    does nothing if the program does not use the block
+
+    Args:
+        program (int): linked shader program
+        block_name (str): name of the uniform block in glsl
+        binding (int): uniform buffer binding point
+    """
+    index = glGetUniformBlockIndex(program, block_name)
+    if index == GL_INVALID_INDEX:
+        return
+    glUniformBlockBinding(program, index, binding)
+
+
+def set_texture_units(program: int):
+    """point the sampler uniforms of a program to their fixed texture units,
+    needed after every link since uniform values are not part of the program
+
+    Args:
+        program (int): linked shader program
+    """
+    glUseProgram(program)
+    glUniform1i(glGetUniformLocation(program, "texture_sampler"), 0)
+    glUniform1i(glGetUniformLocation(program, "skybox_sampler"), 1)
+    glUseProgram(0)
+
+
+def program_cache_key(*sources: str):
+    """hash shader sources together with the driver, binaries are driver specific
+
+    Args:
+        sources (str): glsl code of all stages
+
+    Returns:
+        str: hex digest
+    """
+    h = hashlib.sha256()
+    h.update(
+        repr((PROGRAM_CACHE_VERSION, sorted(ATTRIBUTE_LOCATIONS.items()))).encode()
+    )
+    for name in [GL_VENDOR, GL_RENDERER, GL_VERSION]:
+        h.update(glGetString(name) or b"")
+    for source in sources:
+        h.update(source.encode())
+    return h.hexdigest()
+
+
+def load_cached_program(key: str):
+    """create a program from a cached binary
+
+    Args:
+        key (str): cache key
+
+    Returns:
+        int: linked shader program or None if not cached or rejected by the driver
+    """
+    file = PROGRAM_CACHE_DIR / f"{key}.bin"
+    if not file.exists():
+        return None
+    data = file.read_bytes()
+    (binary_format,) = struct.unpack("<I", data[:4])
+    binary = np.frombuffer(data[4:], dtype=np.uint8)
+    program = glCreateProgram()
+    try:
+        # an unsupported binary format raises GL_INVALID_ENUM
+        glProgramBinary(program, binary_format, binary, binary.size)
+        linked = glGetProgramiv(program, GL_LINK_STATUS) == GL_TRUE
+    except GLError:
+        linked = False
+    if not linked:
+        # e.g. after a driver update that kept its version string
+        glDeleteProgram(program)
+        file.unlink(missing_ok=True)
+        return None
+    return gl_shaders.ShaderProgram(program)
+
+
+def store_cached_program(key: str, program: int):
+    """write the binary of a program linked with the retrievable flag to the cache
+
+    Args:
+        key (str): cache key
+        program (int): linked shader program
+    """
+    length = glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH)
+    if length == 0:
+        return  # the driver does not support program binaries
+    binary = np.empty(length, dtype=np.uint8)
+    written = np.zeros(1, dtype=np.int32)
+    binary_format = np.zeros(1, dtype=np.uint32)
+    glGetProgramBinary(program, length, written, binary_format, binary)
+    PROGRAM_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    # write to a temporary file first so readers never see partial entries
+    tmp_file = PROGRAM_CACHE_DIR / f"{key}.{uuid.uuid4().hex}.tmp"
+    tmp_file.write_bytes(
+        struct.pack("<I", int(binary_format[0])) + binary[: written[0]].tobytes()
+    )
+    os.replace(tmp_file, PROGRAM_CACHE_DIR / f"{key}.bin")
 
 
 def compile_program(*shaders, **named):
@@ -23,14 +212,13 @@ def compile_program(*shaders, **named):
         )
     for shader in shaders:
         glAttachShader(program, shader)
+    for name, location in ATTRIBUTE_LOCATIONS.items():
+        glBindAttribLocation(program, location, name)
     program = gl_shaders.ShaderProgram(program)
     glLinkProgram(program)
     # * make validation succeed with multiple texture samplers
     if named["set_texture_units"]:
-        glUseProgram(program)
-        glUniform1i(glGetUniformLocation(program, "texture_sampler"), 0)
-        glUniform1i(glGetUniformLocation(program, "skybox_sampler"), 1)
-        glUseProgram(0)
+        set_texture_units(program)
     if named.get("validate", True):
         program.check_validate()
     program.check_linked()
@@ -39,23 +227,127 @@ def compile_program(*shaders, **named):
     return program
 
 
-def compile_shaders(shaders_name: str):
-    """compile glsl code into a shader program
+def add_defines(code: str, defines: Iterable[str]):
+    """insert preprocessor defines into glsl code, right after the #version line
+
+    Args:
+        code (str): glsl code
+        defines (Iterable[str]): names to define
+
+    Returns:
+        str: glsl code
+    """
+    lines = code.split("\n")
+    # the version directive has to come first
+    at = 1 if lines[0].startswith("#version") else 0
+    lines[at:at] = [f"#define {name}" for name in sorted(defines)]
+    return "\n".join(lines)
+
+
+def compile_shaders(
+    shaders_name: str,
+    vertex_shader: str = "vertex_shader.glsl",
+    defines: Iterable[str] = (),
+    cache: bool = True,
+    fragment_shader: str = "fragment_shader.glsl",
+):
+    """compile glsl code into a shader program,
+    the linked binary is cached on disk so warm starts skip compiling and linking
 
     Args:
         shaders_name (str): name of the directory under ./shaders containing the sources
+        vertex_shader (str, optional): vertex shader file name, allows variants sharing the fragment shader. Defaults to "vertex_shader.glsl".
+        defines (Iterable[str], optional): preprocessor defines of both stages, e.g. the features of shaders/object/fragment_shader.glsl. Defaults to ().
+        cache (bool, optional): use the on disk program binary cache. Defaults to True.
+        fragment_shader (str, optional): fragment shader file name. Defaults to "fragment_shader.glsl".
 
     Returns:
         int: shader program id
     """
     shaders_dir = Path("shaders") / shaders_name
-    vertex_shader_file = shaders_dir / "vertex_shader.glsl"
-    fragment_shader_file = shaders_dir / "fragment_shader.glsl"
-    vertex_shader_code = vertex_shader_file.read_text()
-    fragment_shader_code = fragment_shader_file.read_text()
-    program = compile_program(
-        gl_shaders.compileShader(vertex_shader_code, GL_VERTEX_SHADER),
-        gl_shaders.compileShader(fragment_shader_code, GL_FRAGMENT_SHADER),
-        set_texture_units=True,
-    )
+    vertex_shader_file = shaders_dir / vertex_shader
+    fragment_shader_file = shaders_dir / fragment_shader
+    vertex_shader_code = add_defines(vertex_shader_file.read_text(), defines)
+    fragment_shader_code = add_defines(fragment_shader_file.read_text(), defines)
+    key = program_cache_key(vertex_shader_code, fragment_shader_code)
+    program = load_cached_program(key) if cache else None
+    if program is not None:
+        set_texture_units(program)
+    else:
+        program = compile_program(
+            gl_shaders.compileShader(vertex_shader_code, GL_VERTEX_SHADER),
+            gl_shaders.compileShader(fragment_shader_code, GL_FRAGMENT_SHADER),
+            set_texture_units=True,
+            retrievable=cache,
+        )
+        if cache:
+            store_cached_program(key, program)
+    bind_uniform_block(program, FRAME_DATA_BLOCK, FRAME_DATA_BINDING)
+    reflect_uniforms(program)
     return program
+
+
+class ShaderVariants:
+    """permutations of one shader pair selected by preprocessor defines,
+    each feature set is compiled on first use and reused afterwards,
+    so objects only pay for the features (and samplers) they need
+    """
+
+    def __init__(self, shaders_name: str, vertex_shader: str = "vertex_shader.glsl"):
+        self.shaders_name = shaders_name
+        self.vertex_shader = vertex_shader
+        self.programs: Dict[FrozenSet[str], int] = {}
+        self.depth_program = None
+
+    def get(self, *defines: str):
+        """program of a feature set
+
+        Args:
+            defines (str): preprocessor defines, the order does not matter
+
+        Returns:
+            int: shader program id
+        """
+        features = frozenset(defines)
+        if features not in self.programs:
+            program = compile_shaders(
+                self.shaders_name, self.vertex_shader, defines=features
+            )
+            self.programs[features] = program
+            PROGRAM_VARIANTS[int(program)] = self
+        return self.programs[features]
+
+    def depth_only(self):
+        """program with the same vertex shader and a fragment shader without outputs,
+        for depth pre-passes (the vertex shader declares gl_Position invariant)
+
+        Returns:
+            int: shader program id
+        """
+        if self.depth_program is None:
+            self.depth_program = compile_shaders(
+                self.shaders_name,
+                self.vertex_shader,
+                fragment_shader="depth_fragment_shader.glsl",
+            )
+        return self.depth_program
+
+    def __contains__(self, program: int):
+        return any(int(p) == int(program) for p in self.programs.values())
+
+
+# shader program -> the variants it was compiled from
+PROGRAM_VARIANTS: Dict[int, ShaderVariants] = {}
+
+
+def depth_only_program(program: int):
+    """depth only counterpart of a program compiled by ShaderVariants
+
+    Args:
+        program (int): shader program
+
+    Returns:
+        int: shader program id
+    """
+    assert int(program) in PROGRAM_VARIANTS, f"Shaders {program} are not variants"
+    return PROGRAM_VARIANTS[int(program)].depth_only()
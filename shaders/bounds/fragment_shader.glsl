@@ -0,0 +1,5 @@
+#version 140
+
+// occlusion queries only count samples, color and depth writes are off
+void main() {
+}
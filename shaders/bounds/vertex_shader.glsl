@@ -0,0 +1,25 @@
+#version 140
+
+// corner of the unit cube
+in vec3 position;
+
+// per frame data shared by all programs, see shaders.FRAME_DATA_BLOCK
+layout(std140) uniform FrameData {
+    mat4 P;
+    mat4 V;
+    vec3 camera_position;
+    float ambient_light_strength;
+    vec3 ambient_light_color;
+    float specular_light_strength;
+    vec3 diffuse_light_position;
+    float specular_light_shininess;
+    vec3 diffuse_light_color;
+};
+
+// world space bounding box
+uniform vec3 box_min;
+uniform vec3 box_max;
+
+void main() {
+    gl_Position = P * V * vec4(mix(box_min, box_max, position), 1.0);
+}
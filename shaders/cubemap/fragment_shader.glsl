@@ -1,4 +1,4 @@
-# version 130
+# version 140
 
 in vec3 pass_texture_direction;
 
@@ -1,15 +1,29 @@
-#version 130
+#version 140
 
 in vec3 position;
 
 out vec3 pass_texture_direction;
 
-uniform mat4 PVM;
+// per frame data shared by all programs, see shaders.FRAME_DATA_BLOCK
+layout(std140) uniform FrameData {
+    mat4 P;
+    mat4 V;
+    vec3 camera_position;
+    float ambient_light_strength;
+    vec3 ambient_light_color;
+    float specular_light_strength;
+    vec3 diffuse_light_position;
+    float specular_light_shininess;
+    vec3 diffuse_light_color;
+};
+
+uniform mat4 M;
 
 void main() {
     // cube is centered at origin and in [-1, 1], so position also acts as texture coordinates
     pass_texture_direction = position; 
-    vec4 clip_position = PVM * vec4(position, 1.0);
+    // drop the view translation so the skybox stays centered at the camera
+    vec4 clip_position = P * mat4(mat3(V)) * M * vec4(position, 1.0);
     // set vertex depth equal to w,
     // so when perspective division (which happens between vertex shader and fragment shader)
     // results in depth 1, the max value
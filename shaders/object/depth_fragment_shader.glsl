@@ -0,0 +1,5 @@
+#version 140
+
+// depth pre-pass, color writes are off so only the depth test and write remain
+void main() {
+}
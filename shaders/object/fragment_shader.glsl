@@ -1,4 +1,10 @@
-#version 130
+#version 140
+
+// compiled per feature set, see shaders.ShaderVariants:
+// USE_TEXTURE: color from texture_sampler
+// USE_VERTEX_COLORS: color from the vertex colors (ignored with USE_TEXTURE)
+// otherwise: color from uniform_color
+// USE_REFLECTION: mix in the skybox reflection by reflection_strength
 
 in vec3 pass_wc_position;
 in vec3 pass_normal;
@@ -7,26 +13,31 @@ in vec4 pass_color;
 
 out vec4 frag_color;
 
-// texture uniforms
-uniform int use_colors;
+// color uniforms
+#if defined(USE_TEXTURE)
 uniform sampler2D texture_sampler;
-
-// ambient light uniforms
-uniform float ambient_light_strength;
-uniform vec3 ambient_light_color;
-
-// diffuse light uniforms
-uniform vec3 diffuse_light_position;
-uniform vec3 diffuse_light_color;
-
-// specular light uniforms
-uniform vec3 camera_position;
-uniform float specular_light_strength;
-uniform float specular_light_shininess;
+#elif !defined(USE_VERTEX_COLORS)
+uniform vec4 uniform_color;
+#endif
+
+// per frame data shared by all programs, see shaders.FRAME_DATA_BLOCK
+layout(std140) uniform FrameData {
+    mat4 P;
+    mat4 V;
+    vec3 camera_position;
+    float ambient_light_strength;
+    vec3 ambient_light_color;
+    float specular_light_strength;
+    vec3 diffuse_light_position;
+    float specular_light_shininess;
+    vec3 diffuse_light_color;
+};
 
 // reflection uniforms
+#ifdef USE_REFLECTION
 uniform samplerCube skybox_sampler;
 uniform float reflection_strength;
+#endif
 
 vec3 ambient_light() {
     return ambient_light_strength * ambient_light_color;
@@ -44,22 +55,22 @@ vec3 specular_light(vec3 view_direction, vec3 normed_normal, vec3 light_directio
 }
 
 vec4 object_color() {
-    if (use_colors == 1) {
-        return pass_color;
-    }
+#if defined(USE_TEXTURE)
     return texture(texture_sampler, pass_texture_coord);
+#elif defined(USE_VERTEX_COLORS)
+    return pass_color;
+#else
+    return uniform_color;
+#endif
 }
 
+#ifdef USE_REFLECTION
 vec3 reflection(vec3 view_direction, vec3 normed_normal) {
-    // make sure you don't have to set skybox sampler if no reflection
-    if (reflection_strength == 0.0) {
-        return vec3(0.0);
-    }
-
     vec3 skybox_direction = reflect(-view_direction, normed_normal);
     vec4 reflection_color = texture(skybox_sampler, skybox_direction);
     return reflection_color.rgb;
 }
+#endif
 
 void main() {
     // phong lighting model
@@ -70,8 +81,9 @@ void main() {
     vec3 light_direction = normalize(diffuse_light_position - pass_wc_position);
 
     vec3 light = ambient_light() + diffuse_light(normed_normal, light_direction) + specular_light(view_direction, normed_normal, light_direction);
-    vec3 reflection = reflection(view_direction, normed_normal);
-    vec4 texture_color = object_color();
-    vec4 mixed_color = vec4((1.0 - reflection_strength) * texture_color.rgb + reflection_strength * reflection, texture_color.a);
-    frag_color = mixed_color * vec4(light, 1.0);
-}
\ No newline at end of file
+    vec4 color = object_color();
+#ifdef USE_REFLECTION
+    color.rgb = mix(color.rgb, reflection(view_direction, normed_normal), reflection_strength);
+#endif
+    frag_color = color * vec4(light, 1.0);
+}
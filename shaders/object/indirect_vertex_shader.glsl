@@ -0,0 +1,62 @@
+#version 430
+
+in vec3 position;
+in vec3 normal;
+in vec2 texture_coord;
+in vec4 color;
+
+// per draw index, fed from an instanced attribute so it equals the base instance of the draw command
+in uint draw_id;
+
+out vec3 pass_normal;
+out vec2 pass_texture_coord;
+out vec3 pass_wc_position;
+out vec4 pass_color;
+
+// the depth pre-pass and the shading pass have to compute the exact same depth
+invariant gl_Position;
+
+// per frame data shared by all programs, see shaders.FRAME_DATA_BLOCK
+layout(std140) uniform FrameData {
+    mat4 P;
+    mat4 V;
+    vec3 camera_position;
+    float ambient_light_strength;
+    vec3 ambient_light_color;
+    float specular_light_strength;
+    vec3 diffuse_light_position;
+    float specular_light_shininess;
+    vec3 diffuse_light_color;
+};
+
+// per draw transforms, see indirect.IndirectRenderer
+struct DrawData {
+    mat4 M;
+    mat4 normal_matrix; // upper left 3x3 is used
+};
+
+layout(std430, binding = 0) readonly buffer DrawBuffer {
+    DrawData draws[];
+};
+
+void main() {
+    DrawData draw = draws[draw_id];
+
+    // position in world coordinates
+    vec4 wc_pos = draw.M * vec4(position, 1.0);
+
+    // set vertex position
+    gl_Position = P * V * wc_pos;
+
+    // pass normal in world coordinates
+    pass_normal = mat3(draw.normal_matrix) * normal;
+
+    // pass texture coords
+    pass_texture_coord = texture_coord;
+
+    // pass color
+    pass_color = color;
+
+    // pass position in world coordinates
+    pass_wc_position = wc_pos.xyz / wc_pos.w;
+}
\ No newline at end of file
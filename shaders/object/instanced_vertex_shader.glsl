@@ -0,0 +1,51 @@
+#version 140
+
+in vec3 position;
+in vec3 normal;
+in vec2 texture_coord;
+in vec4 color;
+
+// per instance attributes (attribute divisor 1)
+in mat4 instance_model_matrix;
+in mat3 instance_normal_matrix;
+
+out vec3 pass_normal;
+out vec2 pass_texture_coord;
+out vec3 pass_wc_position;
+out vec4 pass_color;
+
+// the depth pre-pass and the shading pass have to compute the exact same depth
+invariant gl_Position;
+
+// per frame data shared by all programs, see shaders.FRAME_DATA_BLOCK
+layout(std140) uniform FrameData {
+    mat4 P;
+    mat4 V;
+    vec3 camera_position;
+    float ambient_light_strength;
+    vec3 ambient_light_color;
+    float specular_light_strength;
+    vec3 diffuse_light_position;
+    float specular_light_shininess;
+    vec3 diffuse_light_color;
+};
+
+void main() {
+    // position in world coordinates
+    vec4 wc_pos = instance_model_matrix * vec4(position, 1.0);
+
+    // set vertex position
+    gl_Position = P * V * wc_pos;
+
+    // pass normal in world coordinates
+    pass_normal = instance_normal_matrix * normal;
+
+    // pass texture coords
+    pass_texture_coord = texture_coord;
+
+    // pass color
+    pass_color = color;
+
+    // pass position in world coordinates
+    pass_wc_position = wc_pos.xyz / wc_pos.w;
+}
\ No newline at end of file
@@ -1,4 +1,4 @@
-#version 130
+#version 140
 
 in vec3 position;
 in vec3 normal;
@@ -10,13 +10,31 @@ out vec2 pass_texture_coord;
 out vec3 pass_wc_position;
 out vec4 pass_color;
 
-uniform mat4 PVM;
+// the depth pre-pass and the shading pass have to compute the exact same depth
+invariant gl_Position;
+
+// per frame data shared by all programs, see shaders.FRAME_DATA_BLOCK
+layout(std140) uniform FrameData {
+    mat4 P;
+    mat4 V;
+    vec3 camera_position;
+    float ambient_light_strength;
+    vec3 ambient_light_color;
+    float specular_light_strength;
+    vec3 diffuse_light_position;
+    float specular_light_shininess;
+    vec3 diffuse_light_color;
+};
+
 uniform mat4 M;
 uniform mat3 normal_matrix;
 
 void main() {
+    // position in world coordinates
+    vec4 wc_pos = M * vec4(position, 1.0);
+
     // set vertex position
-    gl_Position = PVM * vec4(position, 1.0);
+    gl_Position = P * V * wc_pos;
 
     // pass normal in world coordinates
     pass_normal = normal_matrix * normal;
@@ -28,6 +46,5 @@ void main() {
     pass_color = color;
 
     // pass position in world coordinates
-    vec4 wc_pos = M * vec4(position, 1.0);
     pass_wc_position = wc_pos.xyz / wc_pos.w;
 }
@@ -0,0 +1,225 @@
+from OpenGL.GL import *
+import ctypes
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Tuple, Union
+
+from alloc import (
+    CUBEMAP_FACES,
+    create_placeholder_texture,
+    set_texture_parameters,
+    upload_texture_level,
+)
+from structs import FrameStats, Texture, TextureImage
+
+# bytes handed to the driver per frame, a larger single level is still uploaded alone
+TEXTURE_UPLOAD_BUDGET = 4 << 20
+
+TextureImages = Union[TextureImage, Dict[str, TextureImage]]  # 2d or cubemap faces
+
+
+@dataclass
+class StreamingJob:
+    texture: Texture  # shows the placeholder until the streamed texture is resident
+    uploads: List[Tuple[int, TextureImage, int]] = None  # (target, image, level) left
+    levels: int = 0
+    tex_id: int = None  # texture receiving the uploads
+    in_flight: int = 0  # fences guarding uploads of this job
+    future: Future = None  # decode running on the worker thread
+
+
+@dataclass
+class PixelBuffer:
+    pbo: int
+    capacity: int  # bytes
+
+
+@dataclass
+class InFlightUploads:
+    fence: object
+    buffers: List[PixelBuffer] = field(default_factory=list)
+    jobs: List[StreamingJob] = field(default_factory=list)
+
+
+class TextureStreamer:
+    """uploads textures in the background without stalling the render loop,
+    images are decoded on a worker thread and copied into pixel buffer objects,
+    update() then issues the uploads from the render thread within a per frame byte budget,
+    fences tell when a pixel buffer can be reused and when a texture is resident,
+    until then the texture struct points to a 1 x 1 placeholder
+    """
+
+    def __init__(self, budget: int = TEXTURE_UPLOAD_BUDGET, workers: int = 1):
+        self.budget = budget
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.loading: List[StreamingJob] = []
+        self.ready: List[StreamingJob] = []
+        self.in_flight: List[InFlightUploads] = []
+        self.free_buffers: List[PixelBuffer] = []
+
+    def load(self, texture_type: int, unit: int, loader: Callable[[], TextureImages]):
+        """stream a texture that still has to be decoded
+
+        Args:
+            texture_type (int): GL_TEXTURE_2D or GL_TEXTURE_CUBE_MAP
+            unit (int): open gl texture unit to use
+            loader (Callable[[], TextureImages]): decodes the mip chain (or the cubemap faces), runs on the worker thread
+
+        Returns:
+            Texture: texture struct, its id changes once the texture is resident
+        """
+        job = StreamingJob(texture=create_placeholder_texture(texture_type, unit))
+        job.future = self.executor.submit(loader)
+        self.loading.append(job)
+        return job.texture
+
+    def upload(self, texture_type: int, unit: int, images: TextureImages):
+        """stream an already decoded texture
+
+        Args:
+            texture_type (int): GL_TEXTURE_2D or GL_TEXTURE_CUBE_MAP
+            unit (int): open gl texture unit to use
+            images (TextureImages): mip chain (or the cubemap faces)
+
+        Returns:
+            Texture: texture struct, its id changes once the texture is resident
+        """
+        job = StreamingJob(texture=create_placeholder_texture(texture_type, unit))
+        self._schedule(job, images)
+        return job.texture
+
+    @property
+    def pending(self):
+        """number of textures that are not resident yet"""
+        jobs = {id(job) for job in self.loading + self.ready}
+        jobs.update(id(job) for uploads in self.in_flight for job in uploads.jobs)
+        return len(jobs)
+
+    def _schedule(self, job: StreamingJob, images: TextureImages):
+        if job.texture.type == GL_TEXTURE_CUBE_MAP:
+            faces = [
+                (GL_TEXTURE_CUBE_MAP_POSITIVE_X + i, images[name])
+                for i, name in enumerate(CUBEMAP_FACES)
+            ]
+        else:
+            faces = [(job.texture.type, images)]
+        job.levels = min(len(image.levels) for _, image in faces)
+        job.uploads = [
+            (target, image, level)
+            for level in range(job.levels)
+            for target, image in faces
+        ]
+        self.ready.append(job)
+
+    def _acquire_buffer(self, size: int):
+        # reuse the smallest free buffer that fits, otherwise grow one or create one
+        fitting = [b for b in self.free_buffers if b.capacity >= size]
+        if fitting:
+            buffer = min(fitting, key=lambda b: b.capacity)
+            self.free_buffers.remove(buffer)
+            glBindBuffer(GL_PIXEL_UNPACK_BUFFER, buffer.pbo)
+            return buffer
+        if self.free_buffers:
+            buffer = self.free_buffers.pop()
+        else:
+            buffer = PixelBuffer(pbo=glGenBuffers(1), capacity=0)
+        buffer.capacity = size
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, buffer.pbo)
+        glBufferData(GL_PIXEL_UNPACK_BUFFER, size, None, GL_STREAM_DRAW)
+        return buffer
+
+    def _retire(self):
+        # fences signal in submission order, stop at the first pending one
+        while self.in_flight:
+            uploads = self.in_flight[0]
+            status = glClientWaitSync(uploads.fence, 0, 0)
+            if status not in (GL_ALREADY_SIGNALED, GL_CONDITION_SATISFIED):
+                break
+            self.in_flight.pop(0)
+            glDeleteSync(uploads.fence)
+            self.free_buffers.extend(uploads.buffers)
+            for job in uploads.jobs:
+                job.in_flight -= 1
+                if job.in_flight == 0 and not job.uploads:
+                    self._make_resident(job)
+
+    def _make_resident(self, job: StreamingJob):
+        glBindTexture(job.texture.type, job.tex_id)
+        set_texture_parameters(job.texture.type, job.levels)
+        glBindTexture(job.texture.type, 0)
+        glDeleteTextures(1, job.texture.id)  # placeholder
+        job.texture.id = job.tex_id
+
+    def update(self, stats: FrameStats = None):
+        """advance streaming by one frame, never waits for the gpu,
+        binds textures and buffers, so call it before drawing
+
+        Args:
+            stats (FrameStats, optional): frame stats counting the streamed bytes. Defaults to None.
+        """
+        self._retire()
+
+        for job in [job for job in self.loading if job.future.done()]:
+            self.loading.remove(job)
+            self._schedule(job, job.future.result())
+
+        budget = self.budget
+        uploads = None
+        while self.ready:
+            job = self.ready[0]
+            target, image, level = job.uploads[0]
+            data = np.ascontiguousarray(image.levels[level])
+            if uploads is not None and data.nbytes > budget:
+                break
+            if uploads is None:
+                uploads = InFlightUploads(fence=None)
+            if job.tex_id is None:
+                job.tex_id = glGenTextures(1)
+
+            # copy into a mapped pixel buffer and upload from there
+            buffer = self._acquire_buffer(data.nbytes)
+            ptr = glMapBufferRange(
+                GL_PIXEL_UNPACK_BUFFER,
+                0,
+                data.nbytes,
+                GL_MAP_WRITE_BIT | GL_MAP_INVALIDATE_BUFFER_BIT,
+            )
+            ctypes.memmove(ptr, data.ctypes.data, data.nbytes)
+            glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER)
+            glBindTexture(job.texture.type, job.tex_id)
+            upload_texture_level(target, image, level)
+            glBindTexture(job.texture.type, 0)
+
+            uploads.buffers.append(buffer)
+            if not uploads.jobs or uploads.jobs[-1] is not job:
+                uploads.jobs.append(job)
+                job.in_flight += 1
+            job.uploads.pop(0)
+            if not job.uploads:
+                self.ready.pop(0)
+            budget -= data.nbytes
+            if stats is not None:
+                stats.texture_bytes_streamed += data.nbytes
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+
+        if uploads is not None:
+            uploads.fence = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+            self.in_flight.append(uploads)
+        if stats is not None:
+            stats.textures_streaming = self.pending
+
+    def destroy(self):
+        """stop the worker and free all gl resources of the streamer"""
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        for uploads in self.in_flight:
+            glDeleteSync(uploads.fence)
+            self.free_buffers.extend(uploads.buffers)
+        jobs = self.ready + [job for uploads in self.in_flight for job in uploads.jobs]
+        for job in jobs:
+            if job.tex_id is not None and job.tex_id != job.texture.id:
+                glDeleteTextures(1, job.tex_id)
+                job.tex_id = None
+        for buffer in self.free_buffers:
+            glDeleteBuffers(1, buffer.pbo)
+        self.in_flight, self.ready, self.loading, self.free_buffers = [], [], [], []
@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import numpy as np
 from typing import Literal, List, Callable
 
@@ -20,13 +20,45 @@ class Model:
     texture_coords: np.ndarray
     bounding_box: np.ndarray  # 2 x 3
     m: np.ndarray
+    version: int = 0  # incremented whenever m is reassigned
+    uniform_color: np.ndarray = (
+        None  # rgba, constant object color instead of per vertex colors
+    )
+    lods: List["Model"] = None  # simplified versions of the mesh, coarsest last
+    # average cache miss ratio (before, after) of meshopt.optimize_model
+    acmr: np.ndarray = None
+
+    def __setattr__(self, name, value):
+        # track reassignments of the model matrix so derived values can be cached,
+        # in place modifications of m are not detected
+        if name == "m":
+            object.__setattr__(self, "version", self.version + 1)
+        object.__setattr__(self, name, value)
+
+
+@dataclass
+class SceneNode:
+    name: str
+    local: np.ndarray  # 4 x 4 transform relative to the parent node
+    mesh: int = None  # index into SceneGraph.meshes, several nodes may share a mesh
+    children: List["SceneNode"] = field(default_factory=list)
+
+
+@dataclass
+class SceneGraph:
+    root: SceneNode  # its local transform centers the scene and scales it to [-1, 1]
+    meshes: List[Model]  # geometry in [-1, 1], their m maps it to mesh coordinates
+    textures: List[np.ndarray]  # distinct base color images
+    mesh_textures: List[int]  # texture index per mesh, None for untextured meshes
+    bounding_box: np.ndarray  # 2 x 3, scene bounds after the root transform
+    m: np.ndarray  # model matrix of the whole scene
 
 
 @dataclass
 class Uniform:
     name: str  # must match shader program
     value: object
-    type: Literal["int", "float", "vec3", "mat3", "mat4"]
+    type: Literal["int", "float", "vec3", "vec4", "mat3", "mat4"]
 
 
 @dataclass
@@ -36,6 +68,14 @@ class Texture:
     unit: int
 
 
+@dataclass
+class TextureImage:
+    levels: List[np.ndarray]  # mip chain, level 0 first
+    width: int
+    height: int
+    format: Literal["rgba8", "bc1", "bc3"]  # bc formats hold the raw blocks per level
+
+
 @dataclass
 class RenderObject:
     model: Model
@@ -45,3 +85,37 @@ class RenderObject:
     shaders: int
     static_uniforms: List[Uniform]
     animation_function: Callable[[Model], Model]
+    instances: np.ndarray = None  # N x 4 x 4, instance i is drawn with m @ instances[i]
+    instance_vbo: int = None
+    arena: object = (
+        None  # alloc.GeometryArena holding the geometry, None for own buffers
+    )
+    base_vertex: int = 0
+    first_index: int = 0
+    # (base vertex, first index, index count) per level of detail, row 0 is the full mesh
+    lod_ranges: np.ndarray = None
+    lod: int = 0  # level of detail selected for the current frame
+    # chunks.ChunkResidency streaming the geometry, None for meshes kept in memory
+    chunks: object = None
+    # (base vertex, first index, index count) per sub mesh, drawn with one multi draw call
+    draw_ranges: np.ndarray = None
+
+
+@dataclass
+class FrameStats:
+    drawn: int = 0
+    culled: int = 0
+    triangles: int = 0  # submitted triangles, excluding instancing and the skybox
+    # redundant state changes avoided by the render queue
+    program_binds_skipped: int = 0
+    vao_binds_skipped: int = 0
+    texture_binds_skipped: int = 0
+    texture_bytes_streamed: int = 0
+    textures_streaming: int = 0  # textures still showing their placeholder
+    chunks_resident: int = 0
+    chunk_bytes_uploaded: int = 0
+    # fragments passing the depth test in the object pass of an earlier frame (0 while the
+    # gpu has not finished it), divided by the pixel count this is the overdraw
+    shaded_samples: int = 0
+    occlusion_queries: int = 0  # bounding boxes tested against the depth buffer
+    occlusion_culled: int = 0  # objects in the frustum skipped as occluded
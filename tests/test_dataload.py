@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+trimesh = pytest.importorskip("trimesh")
+pytest.importorskip("OpenGL.GL")
+pytest.importorskip("PIL")
+
+import dataload
+
+
+def test_store_memory_mapped_model(tmp_path, monkeypatch):
+    # the cache directory is relative, as in the application
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(dataload, "MMAP_OUTPUT_MIN_VERTICES", 1)
+    mesh = trimesh.creation.icosphere(subdivisions=2)
+    mesh.export(tmp_path / "sphere.ply")
+    m = np.eye(4)
+
+    cold, _ = dataload.load_model("sphere.ply", m)
+    assert isinstance(cold.vertices, np.memmap)
+    warm, _ = dataload.load_model("sphere.ply", m)
+
+    assert len(list(dataload.MODEL_CACHE_DIR.iterdir())) == 1
+    np.testing.assert_array_equal(warm.vertices, cold.vertices)
+    np.testing.assert_array_equal(warm.faces, cold.faces)
+    np.testing.assert_array_equal(warm.normals, cold.normals)
+    assert warm.vertices.shape == (len(mesh.vertices), 3)
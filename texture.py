@@ -0,0 +1,393 @@
+import numpy as np
+import hashlib
+import shutil
+import uuid
+from pathlib import Path
+from PIL import Image
+from typing import Dict, Literal
+
+from structs import TextureImage
+from dataload import pillow_to_opengl_rgba
+
+# content addressed cache of mip chains, one directory of .npy files per key
+TEXTURE_CACHE_DIR = Path(".cache") / "textures"
+TEXTURE_CACHE_VERSION = 2  # bump when the preprocessing changes
+# block compression is lossy and opt in, "bc1", "bc3" or "auto"
+# ("auto" picks bc3 for images with transparency and bc1 otherwise)
+TEXTURE_COMPRESSION = "none"
+
+Compression = Literal["none", "bc1", "bc3", "auto"]
+
+
+def box_filter_axis(img: np.ndarray, axis: int, size: int):
+    """shrink an image along one axis with a box filter,
+    every output texel averages the input span it covers, partially covered texels
+    at the span edges are weighted by their coverage
+
+    Args:
+        img (np.ndarray): float image
+        axis (int): axis to shrink
+        size (int): output size along the axis
+
+    Returns:
+        np.ndarray: image with size texels along the axis
+    """
+    n = img.shape[axis]
+    img = np.moveaxis(img, axis, 0)
+    # sums[k] is the sum of the first k texels, integrated linearly between them
+    sums = np.concatenate([np.zeros_like(img[:1]), np.cumsum(img, axis=0)])
+    edges = np.arange(size + 1) * (n / size)
+    k = np.minimum(edges.astype(np.int64), n - 1)
+    frac = (edges - k).reshape(-1, *[1] * (img.ndim - 1))
+    integral = sums[k] + frac * img[k]
+    return np.moveaxis((integral[1:] - integral[:-1]) * (size / n), 0, axis)
+
+
+def downsample(img: np.ndarray):
+    """halve an image to the size of the next gl mip level with a box filter,
+    odd sizes are rounded down and their texels split between the neighbouring outputs
+
+    Args:
+        img (np.ndarray): H x W x C uint8 image
+
+    Returns:
+        np.ndarray: max(H // 2, 1) x max(W // 2, 1) x C uint8 image
+    """
+    h, w = img.shape[:2]
+    img = img.astype(np.float64)
+    img = box_filter_axis(img, 0, max(h // 2, 1))
+    img = box_filter_axis(img, 1, max(w // 2, 1))
+    return np.round(img).astype(np.uint8)
+
+
+def build_mipmaps(img: np.ndarray):
+    """build the full mip chain of an image down to 1 x 1,
+    floor(log2(max(H, W))) + 1 levels with the sizes gl expects
+
+    Args:
+        img (np.ndarray): H x W x 4 uint8 image
+
+    Returns:
+        List[np.ndarray]: mip levels, level 0 is the image itself
+    """
+    levels = [np.ascontiguousarray(img)]
+    while levels[-1].shape[0] > 1 or levels[-1].shape[1] > 1:
+        levels.append(downsample(levels[-1]))
+    return levels
+
+
+def image_blocks(img: np.ndarray):
+    """split an image into 4 x 4 blocks, partial blocks are padded with the edge texels
+
+    Args:
+        img (np.ndarray): H x W x C image
+
+    Returns:
+        np.ndarray: N x 16 x C texels, blocks in row major order
+    """
+    h, w, c = img.shape
+    img = np.pad(img, ((0, -h % 4), (0, -w % 4), (0, 0)), mode="edge")
+    bh, bw = img.shape[0] // 4, img.shape[1] // 4
+    return img.reshape(bh, 4, bw, 4, c).transpose(0, 2, 1, 3, 4).reshape(-1, 16, c)
+
+
+def encode_bc1_blocks(rgb: np.ndarray):
+    """encode color blocks as bc1 (dxt1) in four color mode,
+    the endpoints are the corners of the bounding box of the block colors
+
+    Args:
+        rgb (np.ndarray): N x 16 x 3 uint8 texels
+
+    Returns:
+        np.ndarray: N x 8 uint8 encoded blocks
+    """
+    rgb = rgb.astype(np.int32)
+    bits = np.array([5, 6, 5])
+    # quantize the endpoints to 565 and expand them back to 8 bit
+    q_max = (rgb.max(axis=1) * ((1 << bits) - 1) + 127) // 255
+    q_min = (rgb.min(axis=1) * ((1 << bits) - 1) + 127) // 255
+
+    def pack(q):
+        return (q[:, 0] << 11) | (q[:, 1] << 5) | q[:, 2]
+
+    def expand(q):
+        return (q << (8 - bits)) | (q >> (2 * bits - 8))
+
+    color0, color1 = pack(q_max), pack(q_min)
+    # four color mode needs color0 > color1
+    swap = color0 < color1
+    color0, color1 = np.where(swap, color1, color0), np.where(swap, color0, color1)
+    e0 = np.where(swap[:, None], expand(q_min), expand(q_max))
+    e1 = np.where(swap[:, None], expand(q_max), expand(q_min))
+
+    palette = np.stack(
+        [e0, e1, (2 * e0 + e1) // 3, (e0 + 2 * e1) // 3], axis=1
+    )  # N x 4 x 3
+    distances = ((rgb[:, :, None, :] - palette[:, None, :, :]) ** 2).sum(axis=-1)
+    indices = np.argmin(distances, axis=-1).astype(np.uint32)  # N x 16
+    indices[color0 == color1] = 0  # single color block
+    index_bits = (indices << (2 * np.arange(16, dtype=np.uint32))).sum(
+        axis=1, dtype=np.uint32
+    )
+
+    blocks = np.empty(len(rgb), dtype=[("c0", "<u2"), ("c1", "<u2"), ("i", "<u4")])
+    blocks["c0"], blocks["c1"], blocks["i"] = color0, color1, index_bits
+    return blocks.view(np.uint8).reshape(-1, 8)
+
+
+def encode_bc4_blocks(alpha: np.ndarray):
+    """encode single channel blocks as bc4, the alpha part of bc3 (dxt5),
+    in eight value mode between the block minimum and maximum
+
+    Args:
+        alpha (np.ndarray): N x 16 uint8 texels
+
+    Returns:
+        np.ndarray: N x 8 uint8 encoded blocks
+    """
+    alpha = alpha.astype(np.int32)
+    a0, a1 = alpha.max(axis=1), alpha.min(axis=1)
+    # codes 0 and 1 are the endpoints, codes 2 to 7 interpolate from a0 to a1
+    weights = np.array([0, 7, 1, 2, 3, 4, 5, 6])
+    palette = ((7 - weights) * a0[:, None] + weights * a1[:, None]) // 7  # N x 8
+    distances = np.abs(alpha[:, :, None] - palette[:, None, :])
+    indices = np.argmin(distances, axis=-1).astype(np.uint64)  # N x 16
+    index_bits = (indices << (3 * np.arange(16, dtype=np.uint64))).sum(
+        axis=1, dtype=np.uint64
+    )
+
+    blocks = np.empty((len(alpha), 8), dtype=np.uint8)
+    blocks[:, 0], blocks[:, 1] = a0, a1
+    blocks[:, 2:] = index_bits.astype("<u8").view(np.uint8).reshape(-1, 8)[:, :6]
+    return blocks
+
+
+def compress(img: np.ndarray, compression: str):
+    """block compress one mip level
+
+    Args:
+        img (np.ndarray): H x W x 4 uint8 image
+        compression (str): "bc1" or "bc3"
+
+    Returns:
+        np.ndarray: uint8 blocks in the layout expected by glCompressedTexImage2D
+    """
+    blocks = image_blocks(img)
+    if compression == "bc1":
+        return encode_bc1_blocks(blocks[..., :3]).ravel()
+    return np.concatenate(
+        [encode_bc4_blocks(blocks[..., 3]), encode_bc1_blocks(blocks[..., :3])],
+        axis=1,
+    ).ravel()
+
+
+def auto_compression(*imgs: np.ndarray):
+    """pick the block compression format for images sharing one texture
+
+    Args:
+        *imgs (np.ndarray): H x W x 4 uint8 images
+
+    Returns:
+        str: "bc3" if any image has transparency, "bc1" otherwise
+    """
+    return "bc3" if any((img[..., 3] < 255).any() for img in imgs) else "bc1"
+
+
+def build_texture(img: np.ndarray, compression: Compression = TEXTURE_COMPRESSION):
+    """build the mip chain of an image and optionally block compress it
+
+    Args:
+        img (np.ndarray): H x W x 4 uint8 image formatted for opengl
+        compression (Compression, optional): "none", "bc1", "bc3" or "auto". Defaults to TEXTURE_COMPRESSION.
+
+    Returns:
+        TextureImage: mip chain ready to be uploaded
+    """
+    if compression == "auto":
+        compression = auto_compression(img)
+    levels = build_mipmaps(img)
+    if compression != "none":
+        levels = [compress(level, compression) for level in levels]
+    return TextureImage(
+        levels=levels,
+        width=img.shape[1],
+        height=img.shape[0],
+        format="rgba8" if compression == "none" else compression,
+    )
+
+
+def load_cached_texture(key: str):
+    """load a mip chain from the cache, arrays are memory mapped
+
+    Args:
+        key (str): cache key
+
+    Returns:
+        TextureImage: mip chain or None if not cached
+    """
+    cache_dir = TEXTURE_CACHE_DIR / key
+    if not cache_dir.is_dir():
+        return None
+    width, height, format = (cache_dir / "info.txt").read_text().split()
+    levels = []
+    while (cache_dir / f"level{len(levels)}.npy").exists():
+        levels.append(np.load(cache_dir / f"level{len(levels)}.npy", mmap_mode="r"))
+    return TextureImage(
+        levels=levels, width=int(width), height=int(height), format=format
+    )
+
+
+def store_cached_texture(key: str, texture: TextureImage):
+    """write a mip chain to the cache
+
+    Args:
+        key (str): cache key
+        texture (TextureImage): mip chain
+    """
+    # write to a temporary directory first so readers never see partial entries
+    tmp_dir = TEXTURE_CACHE_DIR / f"{key}.{uuid.uuid4().hex}.tmp"
+    tmp_dir.mkdir(parents=True)
+    (tmp_dir / "info.txt").write_text(
+        f"{texture.width} {texture.height} {texture.format}"
+    )
+    for i, level in enumerate(texture.levels):
+        np.save(tmp_dir / f"level{i}.npy", level)
+    try:
+        tmp_dir.rename(TEXTURE_CACHE_DIR / key)
+    except OSError:
+        shutil.rmtree(tmp_dir)  # written concurrently by someone else
+
+
+def texture_cache_key(source: bytes, *params):
+    """compute the cache key of a texture from its source data and build parameters
+
+    Args:
+        source (bytes): encoded image file or decoded pixels
+
+    Returns:
+        str: hex digest
+    """
+    h = hashlib.sha256()
+    h.update(repr((TEXTURE_CACHE_VERSION, *params)).encode())
+    h.update(source)
+    return h.hexdigest()
+
+
+def prepare_texture(
+    img: np.ndarray,
+    compression: Compression = TEXTURE_COMPRESSION,
+    cache: bool = True,
+):
+    """build the mip chain of a decoded image, cached on disk by the pixel content
+
+    Args:
+        img (np.ndarray): H x W x 4 uint8 image formatted for opengl
+        compression (Compression, optional): "none", "bc1", "bc3" or "auto". Defaults to TEXTURE_COMPRESSION.
+        cache (bool, optional): use the on disk texture cache. Defaults to True.
+
+    Returns:
+        TextureImage: mip chain ready to be uploaded
+    """
+    key = None
+    if cache:
+        img = np.ascontiguousarray(img)
+        key = texture_cache_key(img.tobytes(), img.shape, compression)
+        cached = load_cached_texture(key)
+        if cached is not None:
+            return cached
+    texture = build_texture(img, compression)
+    if key is not None:
+        store_cached_texture(key, texture)
+    return texture
+
+
+def load_texture(
+    path: str,
+    flip: bool = True,
+    compression: Compression = TEXTURE_COMPRESSION,
+    cache: bool = True,
+):
+    """load an image file as mip chain,
+    cached on disk by the file content so warm starts skip decoding
+
+    Args:
+        path (str): path to image file
+        flip (bool, optional): flip image vertically for opengl. Defaults to True.
+        compression (Compression, optional): "none", "bc1", "bc3" or "auto". Defaults to TEXTURE_COMPRESSION.
+        cache (bool, optional): use the on disk texture cache. Defaults to True.
+
+    Returns:
+        TextureImage: mip chain ready to be uploaded
+    """
+    key = None
+    if cache:
+        key = texture_cache_key(Path(path).read_bytes(), flip, compression)
+        cached = load_cached_texture(key)
+        if cached is not None:
+            return cached
+    img = pillow_to_opengl_rgba(Image.open(path), flip=flip)
+    texture = build_texture(img, compression)
+    if key is not None:
+        store_cached_texture(key, texture)
+    return texture
+
+
+def auto_cubemap_compression(paths: Dict[str, Path], flip: bool, cache: bool = True):
+    """pick one block compression format for all faces of a cubemap,
+    cached on disk by the face file contents so warm starts skip decoding the faces
+
+    Args:
+        paths (Dict[str, Path]): image file per face name
+        flip (bool): flip images vertically for opengl
+        cache (bool, optional): use the on disk texture cache. Defaults to True.
+
+    Returns:
+        str: "bc3" if any face has transparency, "bc1" otherwise
+    """
+    format_path = None
+    if cache:
+        key = texture_cache_key(
+            b"".join(Path(p).read_bytes() for p in paths.values()),
+            tuple(paths),
+            flip,
+            "cubemap format",
+        )
+        format_path = TEXTURE_CACHE_DIR / f"{key}.format"
+        if format_path.exists():
+            return format_path.read_text()
+    compression = auto_compression(
+        *(pillow_to_opengl_rgba(Image.open(p), flip=flip) for p in paths.values())
+    )
+    if format_path is not None:
+        # write to a temporary file first so readers never see partial entries
+        tmp_path = TEXTURE_CACHE_DIR / f"{key}.{uuid.uuid4().hex}.tmp"
+        TEXTURE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path.write_text(compression)
+        tmp_path.replace(format_path)
+    return compression
+
+
+def load_cubemap(
+    paths: Dict[str, Path],
+    flip: bool = False,
+    compression: Compression = TEXTURE_COMPRESSION,
+    cache: bool = True,
+):
+    """load the six faces of a cubemap as mip chains of one format,
+    a cubemap with faces of different formats is incomplete
+
+    Args:
+        paths (Dict[str, Path]): image file per face name
+        flip (bool, optional): flip images vertically for opengl. Defaults to False.
+        compression (Compression, optional): "none", "bc1", "bc3" or "auto", "auto" decides once for all faces. Defaults to TEXTURE_COMPRESSION.
+        cache (bool, optional): use the on disk texture cache. Defaults to True.
+
+    Returns:
+        Dict[str, TextureImage]: mip chain per face name
+    """
+    if compression == "auto":
+        compression = auto_cubemap_compression(paths, flip, cache)
+    return {
+        name: load_texture(path, flip, compression, cache)
+        for name, path in paths.items()
+    }
@@ -0,0 +1,86 @@
+import numpy as np
+from typing import List
+
+from structs import RenderObject
+from geometry import transform_bounding_boxes, frustum_cull, screen_sizes
+
+
+class TransformStage:
+    """batched per frame transforms for a fixed list of render objects,
+    all model matrices are kept in one contiguous N x 4 x 4 float32 array
+    so the derived matrices of a frame can be computed with a few numpy calls,
+    derived values are only recomputed for objects whose model matrix changed
+    """
+
+    def __init__(self, objects: List[RenderObject]):
+        self.objects = objects
+        n = len(objects)
+        self.ms = np.stack([o.model.m for o in objects]).astype(np.float32)
+        self.versions = np.full(n, -1)  # model versions the cache was computed from
+        self.pv = None
+        self.pvms = np.empty((n, 4, 4), dtype=np.float32)
+        self.gl_ms = np.empty((n, 4, 4), dtype=np.float32)
+        self.gl_normal_matrices = np.empty((n, 3, 3), dtype=np.float32)
+        self.world_bounding_boxes = np.empty((n, 2, 3), dtype=np.float32)
+        self.visible = np.ones(n, dtype=bool)  # frustum culling result
+        self.screen_sizes = np.full(n, np.inf, dtype=np.float32)  # for lod selection
+        self.local_bounding_boxes = np.stack(
+            [self._local_bounding_box(o) for o in objects]
+        ).astype(np.float32)
+
+    @staticmethod
+    def _local_bounding_box(render_object: RenderObject):
+        # instanced objects are bounded by the union of all instances
+        bounding_box = render_object.model.bounding_box
+        if render_object.instances is None:
+            return bounding_box
+        boxes = transform_bounding_boxes(
+            render_object.instances,
+            np.repeat(bounding_box[None], render_object.instances.shape[0], axis=0),
+        )
+        return np.stack([boxes[:, 0].min(axis=0), boxes[:, 1].max(axis=0)])
+
+    def update(self, pv: np.ndarray):
+        """bring the cached transforms up to date,
+        model dependent values are recomputed for changed model matrices,
+        PVM matrices, visibility and screen sizes additionally when the projection @ view matrix changed
+
+        Args:
+            pv (np.ndarray): projection @ view matrix of the frame
+
+        Returns:
+            List[int]: indices of the objects whose model matrix changed
+        """
+        dirty = [
+            i
+            for i, o in enumerate(self.objects)
+            if o.model.version != self.versions[i]
+        ]
+        if dirty:
+            for i in dirty:
+                self.ms[i] = self.objects[i].model.m
+                self.versions[i] = self.objects[i].model.version
+            ms = self.ms[dirty]
+            # column major for opengl
+            self.gl_ms[dirty] = ms.transpose(0, 2, 1)
+            # normal matrix is inv(m)^T, its column major layout is the row major layout of inv(m)
+            self.gl_normal_matrices[dirty] = np.linalg.inv(ms[:, :3, :3])
+            self.world_bounding_boxes[dirty] = transform_bounding_boxes(
+                ms, self.local_bounding_boxes[dirty]
+            )
+
+        pv = pv.astype(np.float32)  # compare in the stored precision
+        if self.pv is None or not np.array_equal(pv, self.pv):
+            self.pv = pv
+            np.einsum("ij,njk->nik", self.pv, self.ms, out=self.pvms)
+            self.visible[:] = frustum_cull(self.pvms, self.local_bounding_boxes)
+            self.screen_sizes[:] = screen_sizes(self.pvms, self.local_bounding_boxes)
+        elif dirty:
+            self.pvms[dirty] = np.einsum("ij,njk->nik", self.pv, self.ms[dirty])
+            self.visible[dirty] = frustum_cull(
+                self.pvms[dirty], self.local_bounding_boxes[dirty]
+            )
+            self.screen_sizes[dirty] = screen_sizes(
+                self.pvms[dirty], self.local_bounding_boxes[dirty]
+            )
+        return dirty
@@ -0,0 +1,71 @@
+from OpenGL.GL import *
+import numpy as np
+from typing import Dict, Tuple
+
+from shaders import uniform_location
+from structs import Uniform
+
+# last value uploaded per (shader program, uniform location),
+# uniform values are part of the program state so they survive glUseProgram switches
+UNIFORM_STATE: Dict[Tuple[int, int], object] = {}
+
+
+def uniform_changed(shaders: int, loc: int, value: object):
+    """compare a uniform value with the last one uploaded to the same location
+    and remember it if it differs
+
+    Args:
+        shaders (int): shader program id
+        loc (int): uniform location
+        value (object): value about to be uploaded
+
+    Returns:
+        bool: whether the value has to be uploaded
+    """
+    key = (int(shaders), loc)
+    if isinstance(value, (int, float)):
+        if UNIFORM_STATE.get(key) == value:
+            return False
+        UNIFORM_STATE[key] = value
+        return True
+    value = np.asarray(value)
+    prev = UNIFORM_STATE.get(key)
+    if isinstance(prev, np.ndarray) and np.array_equal(prev, value):
+        return False
+    UNIFORM_STATE[key] = value.copy()
+    return True
+
+
+def set_uniform(uniform: Uniform, shaders: int):
+    """set a uniform value in shader program,
+    skipped if the program already holds the same value
+
+    Args:
+        uniform (Uniform): uniform struct
+        shaders (int): shader program id
+    """
+    loc = uniform_location(shaders, uniform.name)
+    if not uniform_changed(shaders, loc, uniform.value):
+        return
+    if uniform.type == "int":
+        glUniform1i(loc, uniform.value)
+    elif uniform.type == "float":
+        glUniform1f(loc, uniform.value)
+    elif uniform.type == "vec3":
+        glUniform3f(loc, *uniform.value)
+    elif uniform.type == "vec4":
+        glUniform4f(loc, *uniform.value)
+    elif uniform.type == "mat3":
+        glUniformMatrix3fv(
+            loc,  # location
+            1,  # count
+            GL_FALSE,  # transpose
+            uniform.value,  # value
+        )
+    elif uniform.type == "mat4":
+        glUniformMatrix4fv(
+            loc,  # location
+            1,  # count
+            GL_FALSE,  # transpose
+            uniform.value,  # value
+        )